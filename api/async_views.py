@@ -0,0 +1,83 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.renderers import JSONRenderer
+from rest_framework.status import HTTP_400_BAD_REQUEST
+from main.async_views import in_thread
+from main.decorators import query_budget, conditional
+from main.models import Bb, Comment
+from main.pagination import KeysetPaginator, InvalidCursor, BB_ORDERINGS
+from main.search import get_search_backend
+from . import views
+from .serializers import BbDetailSerializer, CommentSerializer, BbFilterSerializer, BbValuesSerializer
+from .views import page_link, filter_bbs, bbs_scopes
+
+# Асинхронные варианты API только для чтения (ASYNC_VIEWS). Ответ - тот же JSON, что выдаёт
+# DRF (JSONRenderer), без согласования формата и веб-интерфейса API.
+# Изменяющие запросы передаются синхронным контроллерам api.views
+NOT_FOUND = 'No Bb matches the given query.'  # как у RetrieveAPIView
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+
+
+@conditional(bbs_scopes, per_user=False)
+@query_budget(1)
+async def bbs(request):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    params = BbFilterSerializer(data=request.GET)
+    if not params.is_valid():
+        return json_response(params.errors, status=HTTP_400_BAD_REQUEST)
+    params = params.validated_data
+    bbs = filter_bbs(params)
+    fields = params.get('fields')
+    keyword = params.get('keyword', '')
+    if keyword:
+        rows = BbValuesSerializer.values(get_search_backend().rank(bbs, keyword), fields)[:params['limit']]
+        return json_response(BbValuesSerializer([row async for row in rows], fields).data)
+
+    ordering = BB_ORDERINGS[params['sort']]
+    paginator = KeysetPaginator(BbValuesSerializer.values(bbs, fields, ordering), params['limit'], ordering)
+    cursor = params.get('cursor', '')
+    if cursor:
+        try:
+            paginator.decode_cursor(cursor)
+        except InvalidCursor:
+            return json_response({'cursor': ['Неверный курсор']}, status=HTTP_400_BAD_REQUEST)
+    page = await in_thread(paginator.get_page, cursor)
+    response = json_response(BbValuesSerializer(page.object_list, fields).data)
+    links = []
+    if page.has_next():
+        links.append(page_link(request, page.next_cursor, 'next'))
+    if page.has_previous():
+        links.append(page_link(request, page.previous_cursor, 'prev'))
+    if links:
+        response['Link'] = ', '.join(links)
+    return response
+
+
+@conditional(lambda request, pk: ['bb:%s' % pk], per_user=False)
+@query_budget(1)
+async def bb_detail(request, pk):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    try:
+        bb = await Bb.objects.filter(is_active=True).aget(pk=pk)
+    except Bb.DoesNotExist:
+        return json_response({'detail': NOT_FOUND}, status=404)
+    return json_response(BbDetailSerializer(bb, context={'request': request}).data)
+
+
+@csrf_exempt  # как APIView: проверку CSRF для сессий выполняет DRF
+async def comments(request, pk):
+    if request.method not in ('GET', 'HEAD'):
+        return await sync_to_async(views.comments)(request, pk)
+    return await comment_list(request, pk)
+
+
+@query_budget(3)
+async def comment_list(request, pk):
+    comments = [comment async for comment in Comment.objects.filter(is_active=True, bb=pk)]
+    return json_response(CommentSerializer(comments, many=True).data)
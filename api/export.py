@@ -0,0 +1,154 @@
+import csv
+import datetime
+import io
+import json
+import zlib
+from urllib.parse import urljoin
+
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+from main.models import Bb, Comment
+
+# Выгрузка всего каталога для партнёров. Записи читаются итератором порциями по CHUNK_SIZE
+# и сразу превращаются в текст, поэтому в памяти не бывает больше одной порции
+# независимо от объёма выгрузки. Порядок - по (cursor_field, id): объявления по времени
+# изменения, так что в следующую выгрузку попадают и изменённые объявления, а комментарии,
+# которые не редактируются, - по времени создания. Для следующей инкрементной выгрузки
+# передаются since и after - время и id последней полученной записи. Время выводится
+# с микросекундами, иначе записи, изменённые в одну миллисекунду, терялись бы
+CHUNK_SIZE = 2000
+# Строки объединяются в блоки примерно такого размера, чтобы не отправлять их по одной
+BUFFER_SIZE = 64 * 1024
+
+FORMATS = {'ndjson': 'application/x-ndjson; charset=utf-8', 'csv': 'text/csv; charset=utf-8'}
+
+
+class ExportJSONEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder отбрасывает микросекунды, а по времени строится курсор
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class Export:
+    name = ''
+    fields = ()
+    cursor_field = 'updated_at'
+
+    def __init__(self, base_url=''):
+        self.base_url = base_url
+
+    def after_cursor(self, queryset, since=None, after=None):
+        # Записи позже (since, after) в порядке курсора, без after - со временем позже since
+        if since:
+            later = Q((self.cursor_field + '__gt', since))
+            if after is not None:
+                later |= Q((self.cursor_field, since), id__gt=after)
+            queryset = queryset.filter(later)
+        return queryset.order_by(self.cursor_field, 'id')
+
+    def row(self, values):
+        return values
+
+
+class BbExport(Export):
+    name = 'bbs'
+    fields = ('id', 'rubric_id', 'rubric_name', 'super_rubric_name', 'title', 'content', 'price', 'contacts', 'image',
+              'created_at', 'updated_at')
+
+    def queryset(self, since=None, after=None):
+        return self.after_cursor(Bb.objects.filter(is_active=True), since, after).values(
+            'id', 'rubric_id', 'title', 'content', 'price', 'contacts', 'image', 'created_at', 'updated_at',
+            rubric_name=F('rubric__name'), super_rubric_name=F('rubric__super_rubric__name'))
+
+    def row(self, values):
+        # Абсолютный адрес, чтобы партнёр мог скачать изображение
+        if values['image']:
+            values['image'] = urljoin(self.base_url, default_storage.url(values['image']))
+        return values
+
+
+class CommentExport(Export):
+    name = 'comments'
+    fields = ('id', 'bb_id', 'author', 'content', 'created_at')
+    cursor_field = 'created_at'
+
+    def queryset(self, since=None, after=None):
+        return self.after_cursor(Comment.objects.filter(is_active=True, bb__is_active=True), since,
+                                 after).values(*self.fields)
+
+
+EXPORTS = {export.name: export for export in (BbExport, CommentExport)}
+
+
+def ndjson_lines(export, rows):
+    for values in rows:
+        yield json.dumps(export.row(values), cls=ExportJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def csv_lines(export, rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, export.fields)
+    writer.writeheader()
+    for values in rows:
+        writer.writerow({name: value.isoformat() if hasattr(value, 'isoformat') else value
+                         for name, value in export.row(values).items()})
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    block = []
+    length = 0
+    for line in lines:
+        block.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(block).encode()
+            block = []
+            length = 0
+    if block:
+        yield ''.join(block).encode()
+
+
+def gzip_chunks(chunks):
+    # wbits=31 - формат gzip с заголовком и контрольной суммой, как у утилиты gzip
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(name, format, since=None, base_url='', compress=False, after=None):
+    """
+    Возвращает генератор блоков байтов выгрузки name ('bbs' или 'comments') в формате
+    format ('ndjson' или 'csv'), при compress - сжатых gzip. since и after - курсор
+    предыдущей выгрузки.
+    """
+    export = EXPORTS[name](base_url)
+    rows = export.queryset(since, after).iterator(chunk_size=CHUNK_SIZE)
+    lines = ndjson_lines(export, rows) if format == 'ndjson' else csv_lines(export, rows)
+    chunks = buffered(lines)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+async def async_chunks(chunks):
+    """
+    Асинхронный итератор блоков chunks для ответа под ASGI. Каждый следующий блок читается
+    в потоке базы данных, поэтому, как и при WSGI, в памяти бывает не больше одной порции
+    (синхронный итератор Django под ASGI сначала собирает весь ответ в список).
+    """
+    sentinel = object()
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await next_chunk(chunks, sentinel)) is not sentinel:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.serializers import BbSerializer, BbValuesSerializer
+from main.models import AdvUser, SuperRubric, SubRubric, Bb
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость сериализации списка объявлений через BbSerializer и через values()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # Тестовые объявления создаются в транзакции, которая затем откатывается
+        try:
+            with transaction.atomic():
+                self.run(options['sizes'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, sizes, repeat):
+        super_rubric = SuperRubric.objects.create(name='Замер: надрубрика')
+        rubric = SubRubric.objects.create(name='Замер: рубрика', super_rubric=super_rubric)
+        user = AdvUser.objects.create_user(username='benchmark_serializers')
+        Bb.objects.bulk_create([Bb(rubric=rubric, author=user, title='Товар %s' % i, content='Описание ' * 20,
+                                   contacts='-', price=i) for i in range(max(sizes))], batch_size=2000)
+        queryset = Bb.objects.filter(rubric=rubric).order_by('-created_at', '-id')
+        renderer = JSONRenderer()
+
+        def model_serializer(size):
+            return renderer.render(BbSerializer(queryset[:size], many=True).data)
+
+        def values_serializer(size):
+            return renderer.render(BbValuesSerializer(BbValuesSerializer.values(queryset)[:size]).data)
+
+        self.stdout.write('%8s %22s %22s %8s' % ('записей', 'BbSerializer, зап./с', 'values(), зап./с', 'ускорение'))
+        for size in sizes:
+            rates = []
+            for func in (model_serializer, values_serializer):
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    func(size)
+                    timings.append(time.perf_counter() - start)
+                rates.append(size / min(timings))
+            self.stdout.write('%8s %22.0f %22.0f %7.1fx' % (size, rates[0], rates[1], rates[1] / rates[0]))
@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.export import EXPORTS, FORMATS, export_chunks
+
+
+class Command(BaseCommand):
+    help = 'Выгружает активные объявления или комментарии в NDJSON или CSV, при необходимости сжимая gzip'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson')
+        parser.add_argument('--since', help='Только записи после этого времени (ISO 8601), объявления - '
+                                            'изменённые позже')
+        parser.add_argument('--after', type=int, help='id последней записи предыдущей выгрузки со временем --since')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--base-url', default='', help='Адрес сайта для абсолютных ссылок на изображения')
+        parser.add_argument('--output', help='Файл выгрузки, по умолчанию стандартный вывод')
+
+    def handle(self, *args, **options):
+        since = options['since']
+        if since:
+            try:
+                since = parse_datetime(since)
+            except ValueError:
+                since = None
+            if since is None:
+                raise CommandError('Неверное значение --since')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        chunks = export_chunks(options['name'], options['format'], since, options['base_url'], options['gzip'],
+                               options['after'])
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
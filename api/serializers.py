@@ -1,5 +1,7 @@
+from django.utils import timezone
 from rest_framework import serializers
 from main.models import Bb, Comment
+from main.pagination import BB_ORDERINGS
 
 
 class BbSerializer(serializers.ModelSerializer):
@@ -18,3 +20,66 @@ class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = ('bb', 'author', 'content', 'created_at')
+
+
+class BbFilterSerializer(serializers.Serializer):
+    """
+    Параметры списка объявлений: фильтры, проекция полей, курсор и размер страницы.
+    """
+    rubric = serializers.IntegerField(required=False)
+    price_min = serializers.FloatField(required=False)
+    price_max = serializers.FloatField(required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    fields = serializers.CharField(required=False)
+    cursor = serializers.CharField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=100, default=10)
+    keyword = serializers.CharField(required=False, allow_blank=True)
+    sort = serializers.ChoiceField(choices=tuple(BB_ORDERINGS), required=False, default='new')
+
+    def validate_fields(self, value):
+        fields = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        unknown = [name for name in fields if name not in BbValuesSerializer.columns]
+        if unknown or not fields:
+            raise serializers.ValidationError('Допустимые поля: %s' % ', '.join(BbValuesSerializer.columns))
+        return fields
+
+
+class BbValuesSerializer:
+    """
+    Сериализатор списка объявлений только для чтения. Строки выбираются через values(),
+    поэтому не создаются ни экземпляры модели, ни поля сериализатора для каждой записи.
+    Результат совпадает с BbSerializer для тех же полей.
+    """
+    # Имя в ответе и поле модели
+    columns = {'id': 'id', 'rubric': 'rubric_id', 'title': 'title', 'content': 'content', 'price': 'price',
+               'created_at': 'created_at', 'updated_at': 'updated_at', 'comment_count': 'comment_count',
+               'last_comment_at': 'last_comment_at'}
+    datetime_fields = ('created_at', 'updated_at', 'last_comment_at')
+    default_fields = BbSerializer.Meta.fields
+
+    def __init__(self, rows, fields=None):
+        self.rows = rows
+        self.fields = fields or self.default_fields
+
+    @classmethod
+    def values(cls, queryset, fields=None, ordering=BB_ORDERINGS['new']):
+        # Поля упорядочивания нужны пагинатору для курсора, даже если их нет в проекции
+        names = dict.fromkeys([cls.columns[name] for name in fields or cls.default_fields] +
+                              [name.lstrip('-') for name in ordering])
+        return queryset.values(*names)
+
+    @property
+    def data(self):
+        # Как DateTimeField из DRF: время в текущем часовом поясе, UTC обозначается Z
+        datetimes = [name for name in self.fields if name in self.datetime_fields]
+        columns = [(name, self.columns[name]) for name in self.fields]
+        data = []
+        for row in self.rows:
+            item = {name: row[column] for name, column in columns}
+            for name in datetimes:
+                if item[name] is not None:
+                    value = timezone.localtime(item[name]).isoformat()
+                    item[name] = value[:-6] + 'Z' if value.endswith('+00:00') else value
+            data.append(item)
+        return data
@@ -1,3 +1,246 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import re
+from unittest.mock import patch
+from urllib.parse import urlencode
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db.models import F
+from django.test import AsyncClient, override_settings
+from django.urls import path
+
+from bboard import urls as project_urls
+from main.models import AdvUser, SubRubric, Bb, Comment
+from main.testing import BoardTestCase
+from . import async_views
+from .serializers import BbSerializer
+
+# Адреса асинхронных контроллеров (ASYNC_VIEWS) для AsyncApiTests
+urlpatterns = [
+    path('api/bbs/<int:pk>/comments', async_views.comments),
+    path('api/bbs/<int:pk>', async_views.bb_detail),
+    path('api/bbs/', async_views.bbs),
+] + project_urls.urlpatterns
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class QueryBudgetTests(BoardTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.bb = Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Велосипед', content='Горный',
+                                   contacts='-')
+        Comment.objects.bulk_create([Comment(bb=cls.bb, author='Гость', content='Торг?') for i in range(10)])
+
+    def test_read_endpoints(self):
+        for url in ('/api/bbs/', '/api/bbs/?keyword=велосипед', '/api/bbs/%s' % self.bb.pk,
+                    '/api/bbs/%s/comments' % self.bb.pk):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+    def test_post_comment(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/api/bbs/%s/comments' % self.bb.pk,
+                                    {'bb': self.bb.pk, 'author': 'seller', 'content': 'Продано'})
+        self.assertEqual(response.status_code, 201)
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class BbListTests(BoardTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.rubrics = [cls.rubric, SubRubric.objects.create(name='Самокаты', super_rubric=cls.super_rubric)]
+        cls.bbs = Bb.objects.bulk_create([
+            Bb(rubric=cls.rubrics[i % 2], author=cls.user, title='Товар %s' % i, content='-', contacts='-',
+               price=i * 10)
+            for i in range(25)
+        ])
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [item['id'] for item in response.json()]
+            link = re.search(r'<([^>]+)>; rel="next"', response.get('Link', ''))
+            url = link and link.group(1)
+        return ids
+
+    def test_cursor_pagination(self):
+        expected = list(Bb.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+        self.assertEqual(self.walk('/api/bbs/?limit=7'), expected)
+
+    def test_filters(self):
+        ids = self.walk('/api/bbs/?rubric=%s&price_min=50&price_max=150' % self.rubrics[1].pk)
+        expected = Bb.objects.filter(rubric=self.rubrics[1], price__gte=50, price__lte=150)
+        self.assertEqual(sorted(ids), sorted(expected.values_list('pk', flat=True)))
+        since = Bb.objects.order_by('created_at')[10].created_at
+        ids = self.walk('/api/bbs/?' + urlencode({'created_after': since.isoformat()}))
+        self.assertEqual(sorted(ids), sorted(Bb.objects.filter(created_at__gte=since).values_list('pk', flat=True)))
+
+    def test_matches_model_serializer(self):
+        response = self.client.get('/api/bbs/')
+        self.assertEqual(response.json(), BbSerializer(Bb.objects.order_by('-created_at', '-pk')[:10], many=True).data)
+
+    def test_fields_projection(self):
+        response = self.client.get('/api/bbs/?fields=id,price')
+        self.assertEqual(set(response.json()[0]), {'id', 'price'})
+        self.assertIn('rel="next"', response['Link'])
+
+    def test_sort(self):
+        for i, bb in enumerate(self.bbs[:6]):
+            for j in range(i % 3 + 1):
+                Comment.objects.create(bb=bb, author='Гость', content='Комментарий')
+        cache.clear()
+        for sort, ordering in (('discussed', ('-comment_count', '-created_at', '-pk')),
+                               ('active', (F('last_comment_at').desc(nulls_last=True), '-pk'))):
+            expected = list(Bb.objects.order_by(*ordering).values_list('pk', flat=True))
+            self.assertEqual(self.walk('/api/bbs/?limit=4&sort=%s' % sort), expected, sort)
+        item = self.client.get('/api/bbs/?sort=discussed&fields=id,comment_count,last_comment_at').json()[0]
+        self.assertEqual(item['comment_count'], 3)
+        self.assertTrue(item['last_comment_at'].endswith('Z'))
+
+    def test_bad_parameters(self):
+        for query in ('fields=id,password', 'price_min=дорого', 'cursor=xyz', 'limit=1000', 'sort=price'):
+            self.assertEqual(self.client.get('/api/bbs/?' + query).status_code, 400, query)
+
+
+# Данные TestCase не зафиксированы и видны только через соединение теста
+@override_settings(QUERY_BUDGET_RAISE=True, ROOT_URLCONF=__name__, ASYNC_PARALLEL_QUERIES=False)
+class AsyncApiTests(BoardTestCase):
+    """
+    Асинхронные контроллеры API выдают тот же JSON, что и DRF.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Bb.objects.bulk_create([Bb(rubric=cls.rubric, author=cls.user, title='Велосипед %s' % i, content='-',
+                                   contacts='-', price=i) for i in range(5)])
+        cls.bb = Bb.objects.first()
+        Comment.objects.create(bb=cls.bb, author='Гость', content='Торг?')
+
+    def setUp(self):
+        cache.clear()
+        self.async_client = AsyncClient()
+
+    def test_same_responses(self):
+        for url in ('/api/bbs/', '/api/bbs/?limit=2&fields=id,price', '/api/bbs/?keyword=велосипед',
+                    '/api/bbs/?sort=price', '/api/bbs/%s' % self.bb.pk, '/api/bbs/0',
+                    '/api/bbs/%s/comments' % self.bb.pk):
+            cache.clear()
+            response = async_to_sync(self.async_client.get)(url)
+            with override_settings(ROOT_URLCONF='bboard.urls'):
+                cache.clear()
+                expected = self.client.get(url)
+            self.assertEqual(response.status_code, expected.status_code, url)
+            self.assertEqual(response.content, expected.content, url)
+            self.assertEqual(response.get('Link'), expected.get('Link'), url)
+
+    def test_head(self):
+        for url in ('/api/bbs/', '/api/bbs/%s' % self.bb.pk, '/api/bbs/%s/comments' % self.bb.pk):
+            self.assertEqual(async_to_sync(self.async_client.head)(url).status_code, 200, url)
+        self.assertEqual(async_to_sync(self.async_client.delete)('/api/bbs/').status_code, 405)
+
+    def test_post_comment(self):
+        # изменяющие запросы обрабатывает DRF
+        url = '/api/bbs/%s/comments' % self.bb.pk
+        data = {'bb': self.bb.pk, 'author': 'seller', 'content': 'Продано'}
+        self.assertEqual(async_to_sync(self.async_client.post)(url, data).status_code, 403)
+        async_to_sync(self.async_client.aforce_login)(self.user)
+        self.assertEqual(async_to_sync(self.async_client.post)(url, data).status_code, 201)
+
+
+class ExportTests(BoardTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.bbs = [Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Товар %s' % i, content='-',
+                                     contacts='-', image='bbs/%s.jpg' % i if i % 2 else '') for i in range(5)]
+        Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Скрыто', content='-', contacts='-',
+                          is_active=False)
+        Comment.objects.create(bb=cls.bbs[0], author='Гость', content='Торг?')
+        # комментарий меняет updated_at объявления, а выгрузка упорядочена по нему
+        cls.bbs = list(Bb.objects.filter(is_active=True).order_by('updated_at', 'id'))
+        cls.partner = AdvUser.objects.create_user(username='partner', password='password', is_staff=True)
+
+    def setUp(self):
+        cache.clear()  # частота выгрузок
+        self.client.force_login(self.partner)
+
+    def get(self, url, **headers):
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in self.get('/api/export/bbs.ndjson').decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [bb.pk for bb in self.bbs])
+        self.assertEqual(rows[0]['rubric_name'], 'Велосипеды')
+        self.assertEqual(rows[0]['super_rubric_name'], 'Транспорт')
+        self.assertEqual({row['image'] for row in rows},
+                         {'', 'http://testserver/media/bbs/1.jpg', 'http://testserver/media/bbs/3.jpg'})
+        rows = self.get('/api/export/comments.ndjson').decode().splitlines()
+        self.assertEqual(json.loads(rows[0])['content'], 'Торг?')
+
+    def test_csv_since_gzip(self):
+        since = self.bbs[2].updated_at.isoformat()
+        data = gzip.decompress(self.get('/api/export/bbs.csv?' + urlencode({'since': since, 'gzip': '1'}),
+                                        accept='text/csv'))
+        rows = list(csv.DictReader(io.StringIO(data.decode())))
+        self.assertEqual([int(row['id']) for row in rows], [bb.pk for bb in self.bbs[3:]])
+
+    def test_incremental(self):
+        def export(**cursor):
+            lines = self.get('/api/export/bbs.ndjson?' + urlencode(cursor)).decode().splitlines()
+            return [json.loads(line) for line in lines]
+
+        last = export()[-1]
+        self.assertEqual(export(since=last['updated_at'], after=last['id']), [])
+        # изменённое объявление попадает в следующую выгрузку, а объявления с тем же временем
+        # изменения выгружаются после курсора по id
+        self.bbs[1].title = 'Изменено'
+        self.bbs[1].save()
+        Bb.objects.filter(pk=self.bbs[0].pk).update(updated_at=self.bbs[1].updated_at)
+        rows = export(since=last['updated_at'], after=last['id'])
+        self.assertEqual([row['id'] for row in rows], [self.bbs[0].pk, self.bbs[1].pk])
+        self.assertEqual(rows[1]['title'], 'Изменено')
+        self.assertEqual(export(since=rows[0]['updated_at'], after=rows[0]['id']), rows[1:])
+
+    def test_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/export/bbs.ndjson').status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/export/bbs.ndjson', headers={'accept': 'text/csv'}).status_code,
+                         403)
+
+    @patch('api.views.ExportRateThrottle.rate', '2/hour')
+    def test_throttled(self):
+        for i in range(2):
+            self.get('/api/export/comments.csv')
+        self.assertEqual(self.client.get('/api/export/comments.csv').status_code, 429)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get('/api/export/bbs.xml').status_code, 404)
+        self.assertEqual(self.client.get('/api/export/bbs.csv?since=вчера').status_code, 400)
+        self.assertEqual(self.client.get('/api/export/bbs.csv?since=2024-02-30T10:00').status_code, 400)
+        self.assertEqual(self.client.get('/api/export/bbs.csv?since=2024-02-01T10:00&after=x').status_code, 400)
+        with self.assertRaises(CommandError):
+            call_command('export_catalog', 'bbs', since='2024-02-30T10:00')
+
+    def test_asgi(self):
+        async def get(url):
+            client = AsyncClient()
+            await client.aforce_login(self.partner)
+            response = await client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        lines = async_to_sync(get)('/api/export/bbs.ndjson').decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [bb.pk for bb in self.bbs])
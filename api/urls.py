@@ -1,8 +1,13 @@
+from django.conf import settings
 from django.urls import path
-from .views import bbs, BbDetailView, comments
+from . import views, async_views
+
+# Чтение под ASGI обслуживают асинхронные контроллеры
+views_module = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
-    path('bbs/<int:pk/comments', comments),
-    path('bbs/<int:pk>', BbDetailView.as_view()),
-    path('bbs/', bbs),
+    path('bbs/<int:pk>/comments', views_module.comments),
+    path('bbs/<int:pk>', views_module.bb_detail),
+    path('bbs/', views_module.bbs),
+    path('export/<slug:name>.<slug:format>', views.export),
 ]
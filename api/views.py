@@ -1,29 +1,108 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse, HttpResponseBadRequest, Http404
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.permissions import IsAdminUser, IsAuthenticatedOrReadOnly
 from rest_framework.generics import RetrieveAPIView
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.views import APIView
+from rest_framework.throttling import UserRateThrottle
+from django.utils.decorators import method_decorator
+from main.decorators import query_budget, conditional
 from main.models import Bb, Comment
-from .serializers import BbSerializer, BbDetailSerializer, CommentSerializer
+from main.pagination import KeysetPaginator, InvalidCursor, BB_ORDERINGS
+from main.search import get_search_backend
+from .export import EXPORTS, FORMATS, export_chunks, async_chunks
+from .serializers import BbDetailSerializer, CommentSerializer, BbFilterSerializer, BbValuesSerializer
 
 
 # Create your views here.
+def page_link(request, cursor, rel):
+    query = request.GET.copy()
+    query['cursor'] = cursor
+    return '<%s>; rel="%s"' % (request.build_absolute_uri('?' + query.urlencode()), rel)
+
+
+def filter_bbs(params):
+    bbs = Bb.objects.filter(is_active=True)
+    if 'rubric' in params:
+        bbs = bbs.filter(rubric=params['rubric'])
+    if 'price_min' in params:
+        bbs = bbs.filter(price__gte=params['price_min'])
+    if 'price_max' in params:
+        bbs = bbs.filter(price__lte=params['price_max'])
+    if 'created_after' in params:
+        bbs = bbs.filter(created_at__gte=params['created_after'])
+    if 'created_before' in params:
+        bbs = bbs.filter(created_at__lt=params['created_before'])
+    return bbs
+
+
+def bbs_scopes(request):
+    rubric = request.GET.get('rubric', '')
+    return ['rubric:%s' % rubric] if rubric.isdigit() else ['index']
+
+
+@conditional(bbs_scopes, per_user=False)
 @api_view(['GET'])
+@query_budget(1)
 def bbs(request):
+    """
+    Список активных объявлений, новые первыми (sort=discussed - самые обсуждаемые,
+    sort=active - с новыми комментариями). Тело ответа - список, как и раньше,
+    а ссылки на соседние страницы передаются в заголовке Link (курсор по полям сортировки).
+    С ключевым словом выдаётся одна страница, упорядоченная по релевантности.
+    """
     if request.method == 'GET':
-        bbs = Bb.objects.filter(is_active=True)[:10]
-        serializer = BbSerializer(bbs, many=True)
-        return Response(serializer.data)
+        params = BbFilterSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=HTTP_400_BAD_REQUEST)
+        params = params.validated_data
+        bbs = filter_bbs(params)
+        fields = params.get('fields')
+        keyword = params.get('keyword', '')
+        if keyword:
+            rows = BbValuesSerializer.values(get_search_backend().rank(bbs, keyword), fields)[:params['limit']]
+            return Response(BbValuesSerializer(rows, fields).data)
+
+        ordering = BB_ORDERINGS[params['sort']]
+        paginator = KeysetPaginator(BbValuesSerializer.values(bbs, fields, ordering), params['limit'], ordering)
+        cursor = params.get('cursor', '')
+        if cursor:
+            try:
+                paginator.decode_cursor(cursor)
+            except InvalidCursor:
+                return Response({'cursor': ['Неверный курсор']}, status=HTTP_400_BAD_REQUEST)
+        page = paginator.get_page(cursor)
+        response = Response(BbValuesSerializer(page.object_list, fields).data)
+        links = []
+        if page.has_next():
+            links.append(page_link(request, page.next_cursor, 'next'))
+        if page.has_previous():
+            links.append(page_link(request, page.previous_cursor, 'prev'))
+        if links:
+            response['Link'] = ', '.join(links)
+        return response
 
 
+@method_decorator(conditional(lambda request, pk: ['bb:%s' % pk], per_user=False), name='get')
+@method_decorator(query_budget(1), name='get')
 class BbDetailView(RetrieveAPIView):
     queryset = Bb.objects.filter(is_active=True)
     serializer_class = BbDetailSerializer
 
 
+bb_detail = BbDetailView.as_view()
+
+
 @api_view(['GET', 'POST'])
 @permission_classes((IsAuthenticatedOrReadOnly,))
+@query_budget(3)
 def comments(request, pk):
     if request.method == 'POST':
         serializer = CommentSerializer(data=request.data)
@@ -36,3 +115,60 @@ def comments(request, pk):
         comments = Comment.objects.filter(is_active=True, bb=pk)
         serializer = CommentSerializer(comments, many=True)
         return Response(serializer.data)
+
+
+class ExportRateThrottle(UserRateThrottle):
+    # Полная выгрузка читает весь каталог, поэтому число выгрузок на пользователя ограничено
+    rate = '60/hour'
+
+
+class ExportNegotiation(DefaultContentNegotiation):
+    # Тело выгрузки формирует контроллер по формату из адреса, а ошибки (нет прав, превышена
+    # частота) выводятся первым рендерером при любом заголовке Accept
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class ExportView(APIView):
+    """
+    Потоковая выгрузка активных объявлений или комментариев в NDJSON или CSV для персонала
+    сайта и партнёров с учётной записью персонала. ?since=<дата и время ISO 8601>&after=<id> -
+    только записи после курсора (объявления - изменённые позже), ?gzip=1 - сжатие gzip.
+    """
+    permission_classes = (IsAdminUser,)
+    throttle_classes = (ExportRateThrottle,)
+    renderer_classes = (JSONRenderer,)
+    content_negotiation_class = ExportNegotiation
+
+    def get(self, request, name, format):
+        if name not in EXPORTS or format not in FORMATS:
+            raise Http404
+        after = request.GET.get('after', '')
+        if after and not after.isdigit():
+            return HttpResponseBadRequest('Неверное значение after')
+        since = request.GET.get('since')
+        if since:
+            try:
+                since = parse_datetime(since.replace(' ', '+'))  # + в строке запроса превращается в пробел
+            except ValueError:  # верный формат, но несуществующая дата
+                since = None
+            if since is None:
+                return HttpResponseBadRequest('Неверное значение since')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        compress = request.GET.get('gzip') == '1'
+        chunks = export_chunks(name, format, since, request.build_absolute_uri('/'), compress,
+                               int(after) if after else None)
+        if isinstance(request._request, ASGIRequest):
+            chunks = async_chunks(chunks)
+        filename = '%s.%s' % (name, format)
+        if compress:
+            response = StreamingHttpResponse(chunks, content_type='application/gzip')
+            filename += '.gz'
+        else:
+            response = StreamingHttpResponse(chunks, content_type=FORMATS[format])
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
+
+
+export = ExportView.as_view()
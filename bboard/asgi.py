@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bboard.settings')
+# Асинхронные контроллеры (main.async_views, api.async_views)
+os.environ.setdefault('BBOARD_ASYNC_VIEWS', '1')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from main.events import events_application  # noqa: E402 - после загрузки приложений
+
+# Поток комментариев (/events/bbs/<pk>) обслуживается в обход обработчика Django
+application = events_application(django_application)
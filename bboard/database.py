@@ -0,0 +1,61 @@
+import os
+
+# Настройки SQLite для рабочего сервера.
+# - WAL: читатели не блокируют писателя и наоборот, запись не ждёт fsync основного файла;
+# - synchronous=NORMAL: в режиме WAL fsync выполняется только при переносе журнала в базу,
+#   при сбое питания теряются лишь последние транзакции, целостность базы сохраняется;
+# - mmap_size и cache_size: чтение страниц из отображённого в память файла и больший кэш страниц;
+# - busy_timeout: ожидание освобождения блокировки вместо немедленной ошибки "database is locked".
+# Транзакции начинаются командой BEGIN IMMEDIATE: блокировка записи берётся в начале транзакции,
+# а не при первой записи, поэтому две транзакции, начавшие с чтения, не ждут друг друга
+# до истечения busy_timeout (повышение блокировки в режиме DEFERRED сразу даёт ошибку)
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # отрицательное значение - в килобайтах
+    'busy_timeout': 5000,  # миллисекунды
+    'temp_store': 'MEMORY',
+}
+
+
+def init_command(pragmas):
+    # None отменяет прагму из PRAGMAS
+    return ';'.join('PRAGMA %s = %s' % (name, value) for name, value in pragmas.items() if value is not None)
+
+
+def sqlite_database(name, pragmas=None, conn_max_age=None, transaction_mode='IMMEDIATE'):
+    """
+    Возвращает настройки базы данных SQLite для DATABASES. pragmas дополняет и заменяет PRAGMAS,
+    значение None отменяет прагму.
+    Соединения постоянные (CONN_MAX_AGE секунд, по умолчанию из переменной окружения
+    BBOARD_DB_CONN_MAX_AGE или 600) и проверяются перед повторным использованием.
+    """
+    pragmas = {**PRAGMAS, **(pragmas or {})}
+    if conn_max_age is None:
+        conn_max_age = int(os.environ.get('BBOARD_DB_CONN_MAX_AGE', 600))
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': init_command(pragmas),
+            'transaction_mode': transaction_mode,
+            # Ожидание блокировки модулем sqlite3, секунды, совпадает с busy_timeout
+            'timeout': pragmas['busy_timeout'] / 1000,
+        },
+    }
+
+
+def sqlite_replica(path, pragmas=None, conn_max_age=None):
+    """
+    Возвращает настройки реплики для чтения - копии базы в файле path. Файл открывается
+    только для чтения, поэтому отсутствующая реплика не создаётся пустой, а считается
+    недоступной (bboard.routers). В тестах реплика - зеркало основной базы.
+    """
+    # Режим журнала хранится в файле базы и задаётся при создании копии
+    pragmas = {'journal_mode': None, **(pragmas or {})}
+    database = sqlite_database('file:%s?mode=ro' % path, pragmas, conn_max_age, transaction_mode=None)
+    database['TEST'] = {'MIRROR': 'default'}
+    return database
@@ -0,0 +1,67 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Чтение с реплик разрешается только на время обработки безопасного запроса
+# (main.middlewares.ReplicaMiddleware). Команды, фоновые задания, запросы после записи
+# пользователя и транзакции работают с основной базой, поэтому всегда видят свои изменения
+# Значение - глубина вложенности транзакций основной базы в момент разрешения, None - запрещено
+_replica_reads = ContextVar('bboard_replica_reads', default=None)
+# Псевдоним реплики -> время (time.monotonic), до которого она считается недоступной
+_unavailable = {}
+
+
+@contextmanager
+def replica_reads(enabled=True, depth=None):
+    # depth - глубина транзакций, от которой отсчитываются собственные транзакции запроса
+    if enabled and depth is None:
+        depth = len(connections[DEFAULT_DB_ALIAS].atomic_blocks)
+    token = _replica_reads.set(depth if enabled else None)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def is_available(alias):
+    if _unavailable.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connections[alias].ensure_connection()  # у постоянного соединения - без обращения к базе
+    except DatabaseError:
+        logger.warning('Реплика %s недоступна, чтение с основной базы', alias, exc_info=True)
+        _unavailable[alias] = time.monotonic() + settings.REPLICA_RETRY_INTERVAL
+        return False
+    return True
+
+
+class PrimaryReplicaRouter:
+    """
+    Запись - в основную базу, чтение при разрешённом чтении с реплик - со случайной
+    доступной реплики из DATABASE_REPLICAS, иначе тоже из основной базы.
+    """
+
+    def db_for_read(self, model, **hints):
+        depth = _replica_reads.get()
+        # Внутри транзакции, начатой при обработке запроса, читаются её собственные изменения
+        if depth is None or len(connections[DEFAULT_DB_ALIAS].atomic_blocks) > depth:
+            return DEFAULT_DB_ALIAS
+        replicas = [alias for alias in settings.DATABASE_REPLICAS if is_available(alias)]
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Все базы содержат одни и те же данные
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 import os.path
 from pathlib import Path
 
+from .database import sqlite_database, sqlite_replica
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -46,6 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middlewares.InstrumentationMiddleware',
+    'main.middlewares.ProfilingMiddleware',
+    'main.middlewares.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -60,7 +65,7 @@ ROOT_URLCONF = 'bboard.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'main.instrumentation.DjangoTemplates',  # с замером времени вывода
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -77,16 +82,50 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'bboard.wsgi.application'
 
+# Под ASGI (bboard.asgi включает BBOARD_ASYNC_VIEWS) общедоступные страницы и чтение API
+# обслуживаются асинхронными контроллерами (main.async_views, api.async_views), которые
+# выполняют независимые запросы к базе одновременно, если ASYNC_PARALLEL_QUERIES
+ASYNC_VIEWS = os.environ.get('BBOARD_ASYNC_VIEWS') == '1'
+ASYNC_PARALLEL_QUERIES = True
+
+# Поток новых комментариев объявления (main.events, только под ASGI). Бэкенд LocalBackend
+# годится для одного процесса, DatabasePollingBackend - для нескольких: каждый процесс раз
+# в COMMENT_EVENTS_POLL_INTERVAL секунд выбирает новые комментарии одним запросом
+COMMENT_EVENTS_BACKEND = 'main.events.DatabasePollingBackend'
+COMMENT_EVENTS_POLL_INTERVAL = 1
+COMMENT_EVENTS_POLL_OVERLAP = 5
+# Событий в очереди соединения, после которых медленный клиент отключается
+COMMENT_EVENTS_QUEUE_SIZE = 100
+COMMENT_EVENTS_MAX_SUBSCRIBERS = 10000
+# Пропущенных комментариев, которые досылаются при переподключении (при большем числе
+# клиент перезагружает страницу)
+COMMENT_EVENTS_CATCHUP = 100
+COMMENT_EVENTS_HEARTBEAT = 15  # секунды
+COMMENT_EVENTS_RETRY = 3000  # миллисекунды до переподключения клиента
+
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Режим WAL, постоянные соединения и BEGIN IMMEDIATE (bboard.database).
+# Файл базы можно заменить переменной окружения BBOARD_DB_PATH, например базой с данными
+# generate_board_data (файлы *.data, кроме bboard.data, в git не попадают)
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'bboard.data',
-    }
+    'default': sqlite_database(os.environ.get('BBOARD_DB_PATH') or BASE_DIR / 'bboard.data'),
 }
 
+# Реплики для чтения (bboard.routers): пути к копиям базы через запятую в переменной окружения
+# BBOARD_DB_REPLICAS. Гости читают с реплик, пользователь после записи - REPLICA_STICKY_SECONDS
+# секунд с основной базы; недоступная реплика не используется REPLICA_RETRY_INTERVAL секунд
+# (в тестах bboard.testing.TestRunner добавляет зеркало основной базы 'replica')
+DATABASE_REPLICAS = []
+for number, path in enumerate(filter(None, os.environ.get('BBOARD_DB_REPLICAS', '').split(',')), 1):
+    DATABASES['replica%s' % number] = sqlite_replica(path.strip())
+    DATABASE_REPLICAS.append('replica%s' % number)
+DATABASE_ROUTERS = ['bboard.routers.PrimaryReplicaRouter']
+REPLICA_STICKY_SECONDS = 30
+REPLICA_RETRY_INTERVAL = 30
+TEST_RUNNER = 'bboard.testing.TestRunner'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -122,6 +161,19 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+# Сколько секунд клиенты кэшируют статические файлы без хэша в имени и загруженные файлы
+# без хэша содержимого в имени (main.serving); файлы с хэшем - навсегда
+STATIC_MAX_AGE = 60 * 60
+MEDIA_MAX_AGE = 60 * 60 * 24
+# Передача загруженных файлов веб-серверу: None (файл отдаёт сайт), 'x-sendfile' (Apache,
+# lighttpd) или 'x-accel-redirect' (nginx, внутренний location MEDIA_ACCEL_REDIRECT_PREFIX
+# с каталогом MEDIA_ROOT)
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+# Сколько секунд после повторной загрузки уже имеющегося файла он не удаляется, даже если на него
+# ещё не ссылается ни одна запись (main.storage)
+MEDIA_DELETE_GRACE = 600
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -131,6 +183,16 @@ EMAIL_PORT = 1025
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Загруженные файлы хранятся под именами по содержимому (main.storage), производные
+# файлы - миниатюры easy_thumbnails и уменьшенные копии main.images - под вычисляемыми именами
+STORAGES = {
+    'default': {'BACKEND': 'main.storage.ContentAddressedStorage'},
+    'derived': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    # Имена с хэшем содержимого и сжатые копии, создаваемые collectstatic
+    'staticfiles': {'BACKEND': 'main.storage.CompressedManifestStaticFilesStorage'},
+}
+THUMBNAIL_DEFAULT_STORAGE_ALIAS = 'derived'
+
 THUMBNAIL_ALIASES = {
     '': {
         'default': {
@@ -142,3 +204,71 @@ THUMBNAIL_ALIASES = {
 THUMBNAIL_BASEDIR = 'thumbnails'
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'
+
+# Поиск объявлений: main.search.SQLiteFTSBackend (FTS5) или main.search.IcontainsSearchBackend
+SEARCH_BACKEND = 'main.search.SQLiteFTSBackend'
+
+# Превышение бюджета запросов контроллером (main.decorators.query_budget) вызывает исключение,
+# иначе только пишется предупреждение в журнал
+QUERY_BUDGET_RAISE = False
+
+# Число процессов пула обработки изображений (main.workers) для импорта, команд process_images
+# и pregenerate_thumbnails и заданий process_upload и create_thumbnails. 0 - изображения
+# обрабатываются в текущем процессе
+MEDIA_WORKERS = 2
+
+# Обработка загруженных изображений (main.images): каталог обработанных файлов, наибольший
+# размер стороны, формат (JPEG или WEBP), качество и ширины уменьшенных копий для srcset
+IMAGE_BASEDIR = 'images'
+IMAGE_MAX_SIZE = 1600
+IMAGE_FORMAT = 'JPEG'
+IMAGE_QUALITY = 82
+IMAGE_WIDTHS = (320, 640, 1024)
+
+# Очередь фоновых заданий (main.jobs): число попыток до переноса в DeadJob,
+# начальная задержка повтора, время захвата задания обработчиком и наибольшее время,
+# на которое enqueue_unique запоминает поставленное задание, секунды
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_DELAY = 60
+JOBS_LEASE = 300
+JOBS_UNIQUE_TIMEOUT = 3600
+
+# Импорт объявлений (main.importer): наибольший размер стороны копируемого изображения
+# и каталог, относительно которого ищутся изображения файлов, загруженных через администрирование
+IMPORT_MAX_IMAGE_SIZE = 1600
+IMPORT_SOURCE_DIR = os.path.join(BASE_DIR, 'import')
+
+# Время хранения страниц в кэше для гостей (main.pagecache), секунд. 0 - кэш страниц отключён.
+# Устаревание по изменению данных от этого срока не зависит, если кэш общий для всех процессов
+# (проверка main.W001)
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Кэш по умолчанию, с подсчётом попаданий и промахов (main.instrumentation) поверх движка
+# OPTIONS['BACKEND']. Версии данных, кэш страниц и дерево рубрик должны быть общими для всех
+# процессов сайта, поэтому на рабочем сервере движок и адрес общего кэша задаются переменными
+# окружения BBOARD_CACHE_BACKEND (например django.core.cache.backends.redis.RedisCache)
+# и BBOARD_CACHE_LOCATION. Кэш в памяти процесса - только для разработки (main.checks)
+CACHES = {
+    'default': {
+        'BACKEND': 'main.instrumentation.InstrumentedCache',
+        'LOCATION': os.environ.get('BBOARD_CACHE_LOCATION', ''),
+        'OPTIONS': {
+            'BACKEND': os.environ.get('BBOARD_CACHE_BACKEND') or 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    },
+}
+
+# Замеры запросов (main.middlewares.InstrumentationMiddleware): заголовок Server-Timing,
+# гистограммы по контроллерам (/admin/metrics/) и журнал медленных запросов bboard.slow
+INSTRUMENTATION = True
+# Запросы дольше этого времени, миллисекунд, записываются в журнал вместе с SQL
+SLOW_REQUEST_THRESHOLD = 500
+
+# Выборочное профилирование (main.profiling): профилируется один запрос из PROFILING_SAMPLE_RATE
+# (0 - только запросы с заголовком X-Bboard-Profile, выданным на странице /admin/profiles/),
+# стеки снимаются раз в PROFILING_INTERVAL секунд и копятся в каталоге PROFILES_DIR.
+# Под ASGI запросы не профилируются
+PROFILING_SAMPLE_RATE = 0
+PROFILING_INTERVAL = 0.005
+PROFILING_TOKEN_MAX_AGE = 60 * 60 * 24
+PROFILES_DIR = os.path.join(BASE_DIR, 'profiles')
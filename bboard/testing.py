@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.db import connections
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+from .database import sqlite_replica
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Запускает тесты с единственной репликой 'replica' - зеркалом основной базы (TEST MIRROR),
+    которое тесты маршрутизации включают в DATABASE_REPLICAS. Реплики из BBOARD_DB_REPLICAS
+    в тестах не используются. Статические файлы хранятся без манифеста имён с хэшем:
+    collectstatic в тестах не выполняется. Тесты выполняются в одном процессе, поэтому
+    предупреждения о кэше в памяти процесса (main.checks) не выводятся, а изображения
+    обрабатываются без пула процессов (MEDIA_WORKERS): дочерние процессы не видят
+    настройки, изменённые тестами.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        databases = connections.settings  # прочитанный DATABASES, соединений ещё нет
+        for alias in settings.DATABASE_REPLICAS:
+            del databases[alias]
+        settings.DATABASE_REPLICAS = []
+        databases['replica'] = sqlite_replica(databases['default']['NAME'])
+        connections.configure_settings(databases)  # значения по умолчанию для добавленной базы
+        self.test_settings = override_settings(
+            STORAGES={
+                **settings.STORAGES,
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            SILENCED_SYSTEM_CHECKS=[*settings.SILENCED_SYSTEM_CHECKS, 'main.W001', 'main.W002'],
+            MEDIA_WORKERS=0,
+        )
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -14,21 +14,25 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
-from django.contrib.staticfiles.views import serve
-from django.views.decorators.cache import never_cache
+
+from main.admin import metrics_view, profiles_view, profile_view
+from main.serving import static_file, media_file
 
 urlpatterns = [
+    path('admin/metrics/', admin.site.admin_view(metrics_view), name='metrics'),
+    path('admin/profiles/', admin.site.admin_view(profiles_view), name='profiles'),
+    path('admin/profiles/<str:name>/', admin.site.admin_view(profile_view), name='profile'),
     path('admin/', admin.site.urls),
     path('captcha/', include('captcha.urls')),
     path('api/', include('api.urls')),
+    # Статические и загруженные файлы (main.serving), если их не отдаёт веб-сервер перед сайтом
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.STATIC_URL.lstrip('/')), static_file),
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media_file),
     path('', include('main.urls')),
 ]
-
-if settings.DEBUG:
-    urlpatterns.append(path('static/<path:path>', never_cache(serve)))
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 # Приложение main установлено в качестве корневого
@@ -1,9 +1,24 @@
 from django.contrib import admin
+from django.conf import settings
+from django.contrib.admin import helpers
+from django.core.exceptions import PermissionDenied
+from django.urls import path
+from django.db import transaction
+from django.http import Http404
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.utils.safestring import mark_safe
+from django.utils import timezone
 import datetime
 
-from .models import AdvUser, SuperRubric, SubRubric, Bb, AdditionalImage
-from .utilities import send_activation_notification
-from .forms import SubRubricForm
+from .deletion import delete_bbs
+from .jobs import enqueue_many
+from .models import AdvUser, SuperRubric, SubRubric, Bb, AdditionalImage, Job, DeadJob
+from .utilities import activation_notification
+from .forms import SubRubricForm, ImportForm
+from .importer import import_bbs
+from .instrumentation import HISTOGRAM_BUCKETS, histograms, reset_histograms
+from .profiling import delete_profile, flamegraph_svg, list_profiles, profile_token, read_profile
 
 
 # Register your models here.
@@ -22,10 +37,9 @@ class SuperRubricAdmin(admin.ModelAdmin):
 
 
 def send_activation_notifications(modeladmin, request, queryset):
-    for rec in queryset:
-        if not rec.is_activated:
-            send_activation_notification(rec)
-    modeladmin.message_user(request, 'Письма с требованиями отправлены')
+    # Все письма ставятся в очередь одним запросом и отправляются обработчиком через одно соединение
+    enqueue_many('send_email', [activation_notification(rec) for rec in queryset.filter(is_activated=False)])
+    modeladmin.message_user(request, 'Письма с требованиями поставлены в очередь')
     send_activation_notifications.short_description = 'Отправка писем с требованиями активации'
 
 
@@ -52,10 +66,69 @@ class AdditionalImageInline(admin.TabularInline):
     model = AdditionalImage
 
 
+# В отличие от стандартного действия удаления, страница подтверждения не перечисляет все
+# связанные записи, а удаление выполняется несколькими запросами независимо от числа объявлений
+def delete_bbs_in_bulk(modeladmin, request, queryset):
+    if request.POST.get('post'):
+        count = delete_bbs(queryset)
+        modeladmin.message_user(request, 'Удалено объявлений: %s' % count)
+        return None
+    select_across = request.POST.get('select_across') == '1'
+    context = {
+        **modeladmin.admin_site.each_context(request),
+        'opts': modeladmin.model._meta,
+        'count': queryset.count(),
+        'select_across': select_across,
+        'pks': [] if select_across else list(queryset.values_list('pk', flat=True)),
+        'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+    }
+    return TemplateResponse(request, 'admin/main/bb/delete_bbs_confirmation.html', context)
+
+
+delete_bbs_in_bulk.short_description = 'Удалить выбранные объявления пакетно'
+
+
 class BbAdmin(admin.ModelAdmin):
     list_display = ('rubric', 'title', 'content', 'author', 'created_at')
     fields = (('rubric', 'author'), 'title', 'content', 'price', 'contacts', 'image', 'is_active')
     inlines = (AdditionalImageInline,)
+    actions = (delete_bbs_in_bulk,)
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='main_bb_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        result = None
+        if request.method == 'POST':
+            form = ImportForm(request.POST, request.FILES)
+            if form.is_valid():
+                file = form.cleaned_data['file']
+                format = 'csv' if file.name.lower().endswith('.csv') else 'jsonl'
+                # Загрузка изображений по адресам задержала бы запрос, она доступна только команде import_bbs
+                result = import_bbs(file, format, form.cleaned_data['author'], settings.IMPORT_SOURCE_DIR,
+                                    allow_urls=False)
+                self.message_user(request, 'Добавлено объявлений: %s, ошибок: %s' % (
+                    result.created, len(result.errors)))
+        else:
+            form = ImportForm(initial={'author': request.user.username})
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Импорт объявлений',
+            'form': form,
+            'result': result,
+        }
+        return TemplateResponse(request, 'admin/main/bb/import.html', context)
+
+    def delete_model(self, request, obj):
+        delete_bbs(Bb.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        delete_bbs(queryset)
 
 
 class AdvUserAdmin(admin.ModelAdmin):
@@ -67,8 +140,83 @@ class AdvUserAdmin(admin.ModelAdmin):
     readonly_fields = ('last_login', 'date_joined')
     actions = (send_activation_notifications,)
 
+    # queryset.delete() не вызывает AdvUser.delete(), поэтому объявления удаляются здесь
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            delete_bbs(Bb.objects.filter(author__in=queryset))
+            queryset.delete()
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'run_at', 'attempts', 'locked_until', 'created_at')
+    list_filter = ('name',)
+
+
+def requeue_dead_jobs(modeladmin, request, queryset):
+    Job.objects.bulk_create([Job(name=rec.name, payload=rec.payload, run_at=timezone.now()) for rec in queryset])
+    queryset.delete()
+    modeladmin.message_user(request, 'Задания возвращены в очередь')
+
+
+requeue_dead_jobs.short_description = 'Вернуть в очередь'
+
+
+class DeadJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'attempts', 'created_at', 'failed_at')
+    list_filter = ('name',)
+    actions = (requeue_dead_jobs,)
+
 
 admin.site.register(AdvUser)
 admin.site.register(SuperRubric, SuperRubricAdmin)
 admin.site.register(SubRubric, SubrubricAdmin)
 admin.site.register(Bb, BbAdmin)
+admin.site.register(Job, JobAdmin)
+admin.site.register(DeadJob, DeadJobAdmin)
+
+
+def metrics_view(request):
+    """
+    Гистограммы времени выполнения контроллеров в текущем процессе (main.instrumentation).
+    """
+    if request.method == 'POST':
+        reset_histograms()
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Время выполнения контроллеров',
+        'histograms': histograms(),
+        'buckets': ['≤ %s' % bound for bound in HISTOGRAM_BUCKETS] + ['> %s' % HISTOGRAM_BUCKETS[-1]],
+    }
+    return TemplateResponse(request, 'admin/metrics.html', context)
+
+
+def profiles_view(request):
+    """
+    Профили контроллеров (main.profiling) и заголовок для профилирования своих запросов.
+    """
+    if request.method == 'POST':
+        delete_profile(request.POST.get('name', ''))
+        return redirect('profiles')
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Профили контроллеров',
+        'profiles': [dict(profile, modified=datetime.datetime.fromtimestamp(profile['modified']))
+                     for profile in list_profiles()],
+        'token': profile_token(request.user),
+        'sample_rate': settings.PROFILING_SAMPLE_RATE,
+    }
+    return TemplateResponse(request, 'admin/profiles.html', context)
+
+
+def profile_view(request, name):
+    stacks = read_profile(name)
+    if not stacks:
+        raise Http404
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Профиль %s' % name,
+        'name': name,
+        'samples': sum(stacks.values()),
+        'flamegraph': mark_safe(flamegraph_svg(stacks)),  # имена кадров экранированы
+    }
+    return TemplateResponse(request, 'admin/profile.html', context)
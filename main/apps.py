@@ -17,3 +17,7 @@ class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
     verbose_name = 'Доска объявлений'
+
+    def ready(self):
+        from . import signals  # noqa: F401 - подключение обработчиков сигналов моделей
+        from . import checks  # noqa: F401 - регистрация проверок
@@ -0,0 +1,124 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.db import close_old_connections
+from django.http import Http404
+from django.shortcuts import render
+
+from .cards import LISTING_FIELDS
+from .decorators import query_budget, conditional
+from .forms import SearchForm, UserCommentForm, GuestCommentForm
+from .models import SubRubric, Bb, AdditionalImage, Comment
+from .pagecache import page_cache
+from .pagination import KeysetPaginator, BB_ORDERINGS
+from .search import get_search_backend
+from .views import COMMENT_FORM_HOLE, render_comment_form
+
+# Асинхронные варианты общедоступных страниц для работы под ASGI (ASYNC_VIEWS).
+# Ответы совпадают с main.views. Независимые запросы страницы выполняются одновременно:
+# асинхронный ORM Django выполняет все запросы запроса клиента в одном потоке по очереди,
+# поэтому остальные запросы отдаются в потоки sync_to_async(thread_sensitive=False),
+# и у каждого потока своё соединение с базой.
+# В цикле событий к django.db.connections обращаться нельзя: созданное здесь соединение
+# получили бы все такие потоки сразу
+async_render = sync_to_async(render)  # шаблоны и обработчики контекста обращаются к кэшу и базе
+
+
+def in_thread(function, *args, **kwargs):
+    """
+    Возвращает сопрограмму, выполняющую function в отдельном потоке со своим соединением
+    с базой данных. При ASYNC_PARALLEL_QUERIES = False (в тестах, где данные видны только
+    в транзакции теста) - в общем потоке запроса, по очереди.
+    """
+    if not settings.ASYNC_PARALLEL_QUERIES:
+        return sync_to_async(function)(*args, **kwargs)
+
+    def run():
+        # Потоки живут дольше запроса, поэтому устаревшие соединения закрываются, как в начале запроса
+        close_old_connections()
+        return function(*args, **kwargs)
+    return sync_to_async(run, thread_sensitive=False)()
+
+
+async def aget_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404('No %s matches the given query.' % queryset.model._meta.object_name)
+
+
+def save_comment(form_class, data):
+    form = form_class(data)
+    if form.is_valid():  # проверка CAPTCHA обращается к базе
+        form.save()
+    return form
+
+
+@conditional(lambda request, rubric_pk, pk: ['rubrics', 'bb:%s' % pk], form=True)
+@page_cache(lambda request, rubric_pk, pk: ['rubrics', 'bb:%s' % pk], holes={COMMENT_FORM_HOLE: render_comment_form})
+@query_budget(8)
+async def detail(request, rubric_pk, pk):
+    initial = {'bb': pk}
+    if request.user.is_authenticated:
+        initial['author'] = request.user.username
+        form_class = UserCommentForm
+    else:
+        form_class = GuestCommentForm
+    form = form_class(initial=initial)
+    if request.method == 'POST':
+        c_form = await sync_to_async(save_comment)(form_class, request.POST)
+        if c_form.is_valid():  # ошибки уже получены при сохранении
+            messages.add_message(request, messages.WARNING, 'Комментарий добавлен')
+        else:
+            form = c_form
+            messages.add_message(request, messages.WARNING, 'Комментарий не добавлен')
+    # Объявление, иллюстрации и комментарии выбираются одновременно
+    bb, ais, comments = await asyncio.gather(
+        aget_or_404(Bb.objects.select_related('rubric', 'rubric__super_rubric', 'author'), pk=pk),
+        in_thread(list, AdditionalImage.objects.filter(bb=pk)),
+        in_thread(list, Comment.objects.filter(is_active=True, bb=pk)))
+    bb.active_comments = comments
+    context = {'bb': bb, 'ais': ais, 'comments': comments, 'form': form}
+    if getattr(request, 'page_cache_holes', False):
+        context['comment_form_hole'] = COMMENT_FORM_HOLE
+    return await async_render(request, 'main/detail.html', context)
+
+
+@conditional(lambda request, pk: ['rubrics', 'rubric:%s' % pk])
+@page_cache(lambda request, pk: ['rubrics', 'rubric:%s' % pk])
+@query_budget(7)
+async def by_rubric(request, pk):
+    sort = request.GET.get('sort', '')
+    ordering = BB_ORDERINGS.get(sort, BB_ORDERINGS['new'])
+    fields = set(LISTING_FIELDS) | {name.lstrip('-') for name in ordering}
+    bbs = Bb.objects.filter(is_active=True, rubric=pk).only(*fields)
+    keyword = request.GET.get('keyword', '')
+    bbs = get_search_backend().filter(bbs, keyword)
+    form = SearchForm(initial={'keyword': keyword})
+    paginator = KeysetPaginator(bbs, 2, ordering)
+    # Рубрика, страница и общее число объявлений (только на первой странице без поиска,
+    # как в main.views.by_rubric) выбираются одновременно
+    with_count = not keyword and not request.GET.get('page')
+    rubric, page, count = await asyncio.gather(
+        aget_or_404(SubRubric.objects.all(), pk=pk),
+        in_thread(paginator.get_page, request.GET.get('page')),
+        in_thread(lambda: paginator.count if with_count else None))
+    context = {'rubric': rubric, 'page': page, 'bbs': page.object_list, 'form': form, 'count': count,
+               'sort': sort if sort in BB_ORDERINGS else ''}
+    return await async_render(request, 'main/by_rubric.html', context)
+
+
+@conditional(lambda request: ['rubrics', 'index'])
+@page_cache(lambda request: ['rubrics', 'index'])
+@query_budget(5)
+async def index(request):
+    keyword = request.GET.get('keyword', '')
+    bbs = Bb.objects.filter(is_active=True).only(*LISTING_FIELDS)
+    if keyword:
+        bbs = get_search_backend().rank(bbs, keyword)
+    bbs = [bb async for bb in bbs[:10]]
+    form = SearchForm(initial={'keyword': keyword})
+    context = {'bbs': bbs, 'form': form}
+    return await async_render(request, 'main/index.html', context)
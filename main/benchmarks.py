@@ -0,0 +1,116 @@
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test import Client
+
+from .decorators import QueryCounter
+from .models import AdvUser, SubRubric, Bb
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def default_targets():
+    """
+    Набор адресов для замеров, построенный по данным в базе: последняя рубрика,
+    самое свежее активное объявление и ключевое слово из его заголовка.
+    """
+    targets = [('index', '/', False)]
+    rubric = SubRubric.objects.order_by('-pk').first()
+    bb = Bb.objects.filter(is_active=True).order_by('-created_at').first()
+    if rubric:
+        targets.append(('by_rubric', '/%s/' % rubric.pk, False))
+    if bb:
+        keyword = bb.title.split()[0]
+        targets += [
+            ('by_rubric_keyword', '/%s/?keyword=%s' % (bb.rubric_id, keyword), False),
+            ('detail', '/%s/%s' % (bb.rubric_id, bb.pk), False),
+            ('api_bbs', '/api/bbs/', False),
+            ('api_bb_detail', '/api/bbs/%s' % bb.pk, False),
+            ('api_comments', '/api/bbs/%s/comments' % bb.pk, False),
+        ]
+    targets += [
+        ('admin_bb_changelist', '/admin/main/bb/', True),
+        ('admin_advuser_changelist', '/admin/main/advuser/', True),
+        ('admin_subrubric_changelist', '/admin/main/subrubric/', True),
+    ]
+    return targets
+
+
+def measure(client, url, iterations, warmup=3):
+    for _ in range(warmup):
+        response = client.get(url)
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        client.get(url)
+
+    # Трассировка памяти сильно замедляет код, поэтому выполняется отдельным проходом
+    tracemalloc.start()
+    client.get(url)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'url': url,
+        'status': response.status_code,
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'queries': counter.count,
+        'peak_alloc_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(iterations=50, targets=None, admin_user=None):
+    client = Client(SERVER_NAME='localhost')
+    admin_client = None
+    if admin_user is None:
+        admin_user = AdvUser.objects.filter(is_superuser=True).first()
+    if admin_user:
+        admin_client = Client(SERVER_NAME='localhost')
+        admin_client.force_login(admin_user)
+    results = {}
+    for name, url, needs_admin in targets or default_targets():
+        if needs_admin and admin_client is None:
+            continue  # без суперпользователя списки администратора не замеряются
+        results[name] = measure(admin_client if needs_admin else client, url, iterations)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Сравнивает результаты с базовыми. Регрессией считается рост p95 больше чем на tolerance
+    или увеличение числа запросов. Возвращает список описаний регрессий.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append('%s: p95 %.2f мс, было %.2f мс' % (name, result['p95_ms'], base['p95_ms']))
+        if result['queries'] > base['queries']:
+            regressions.append('%s: запросов %s, было %s' % (name, result['queries'], base['queries']))
+    return regressions
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
@@ -0,0 +1,62 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Bb
+from .thumbnails import get_thumbnail_url
+
+# Карточки объявлений в списках кэшируются готовым HTML. Ключ включает дату изменения
+# объявления, поэтому правка объявления или его иллюстраций сама делает старую карточку
+# недоступной. CARD_VERSION меняется вместе с шаблоном карточки
+CARD_VERSION = 2
+CARD_KEY = 'bb_card:%s:%s:%s'
+CARD_TIMEOUT = 60 * 60 * 24
+CARD_TEMPLATE = 'main/includes/bb_card.html'
+
+# Поля, достаточные для выборки страницы списка, остальное берётся из кэша карточек
+LISTING_FIELDS = ('pk', 'created_at', 'updated_at')
+
+# GET-параметры в ссылках карточки зависят от запроса, поэтому в кэше вместо них метка
+ALL_PLACEHOLDER = 'BBOARD-CARD-QUERY-STRING'
+
+
+def card_key(bb):
+    return CARD_KEY % (CARD_VERSION, bb.pk, bb.updated_at.timestamp())
+
+
+def render_card(bb):
+    """
+    Возвращает HTML карточки и признак того, что её можно кэшировать: карточка
+    с заглушкой вместо ещё не созданной миниатюры в кэш не попадает.
+    """
+    thumbnail_url = get_thumbnail_url(bb.image)
+    html = render_to_string(CARD_TEMPLATE, {'bb': bb, 'thumbnail_url': thumbnail_url, 'all': ALL_PLACEHOLDER})
+    return html, thumbnail_url is not None or not bb.image
+
+
+def render_cards(bbs, all_params=''):
+    """
+    Возвращает HTML карточек объявлений в порядке bbs за одно обращение к кэшу.
+    Для отсутствующих в кэше карточек недостающие поля объявлений загружаются одним запросом.
+    """
+    bbs = list(bbs)
+    keys = {bb.pk: card_key(bb) for bb in bbs}
+    cards = cache.get_many(keys.values())
+    missing = [bb for bb in bbs if keys[bb.pk] not in cards]
+    if missing:
+        deferred = [bb.pk for bb in missing if bb.get_deferred_fields()]
+        loaded = Bb.objects.in_bulk(deferred) if deferred else {}
+        fresh = {}
+        for bb in missing:
+            html, cacheable = render_card(loaded.get(bb.pk, bb))
+            cards[keys[bb.pk]] = html
+            if cacheable:
+                fresh[keys[bb.pk]] = html
+        cache.set_many(fresh, CARD_TIMEOUT)
+    suffix = escape(all_params)
+    return [mark_safe(cards[keys[bb.pk]].replace(ALL_PLACEHOLDER, suffix)) for bb in bbs]
+
+
+def invalidate_card(bb):
+    cache.delete(card_key(bb))
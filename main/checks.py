@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+
+# Версии данных (main.versions), по которым сбрасывается кэш страниц и вычисляются ETag
+# и Last-Modified условных запросов, хранятся в кэше по умолчанию. На рабочем сервере с несколькими процессами он должен быть общим для них:
+# изменение в одном процессе не доходит до кэша в памяти другого. При DEBUG (разработка
+# в одном процессе) проверки не выполняются
+
+
+def is_process_local(alias='default'):
+    return isinstance(caches[alias], LocMemCache)
+
+
+@register(Tags.caches)
+def check_page_cache(app_configs, **kwargs):
+    if settings.DEBUG or not settings.PAGE_CACHE_TIMEOUT or not is_process_local():
+        return []
+    return [Warning(
+        'Кэш страниц включён, а кэш по умолчанию хранится в памяти процесса: страница, сброшенная '
+        'в одном процессе, выдаётся остальными устаревшей до PAGE_CACHE_TIMEOUT секунд.',
+        hint='Задайте общий кэш переменными окружения BBOARD_CACHE_BACKEND и BBOARD_CACHE_LOCATION '
+             'или отключите кэш страниц (PAGE_CACHE_TIMEOUT = 0).',
+        id='main.W001',
+    )]
+
+
+@register(Tags.caches)
+def check_conditional_requests(app_configs, **kwargs):
+    if settings.DEBUG or not is_process_local():
+        return []
+    return [Warning(
+        'Версии данных для ETag и Last-Modified (main.versions) хранятся в кэше в памяти процесса: '
+        'разные процессы выдают разные ETag одной страницы, а процесс, не получивший новую версию, '
+        'отвечает 304 на запрос изменившейся страницы.',
+        hint='Задайте общий кэш переменными окружения BBOARD_CACHE_BACKEND и BBOARD_CACHE_LOCATION.',
+        id='main.W002',
+    )]
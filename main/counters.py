@@ -0,0 +1,62 @@
+from django.db.models import Count, F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Bb, Comment
+from .versions import bump
+
+# Счётчики активных комментариев объявления (Bb.comment_count, Bb.last_comment_at).
+# Меняются одной командой UPDATE с выражениями F(), поэтому одновременные комментарии
+# к одному объявлению не теряют приращений. Вместе со счётчиком меняется updated_at:
+# карточка объявления в кэше выводит число комментариев
+
+
+def last_comment_subquery():
+    return Subquery(Comment.objects.filter(bb=OuterRef('pk'), is_active=True).order_by().values('bb')
+                    .annotate(last=Max('created_at')).values('last'))
+
+
+def comment_added(bb_id, created_at):
+    # Greatest возвращает NULL, если NULL хотя бы один аргумент, поэтому пустое значение заменяется
+    Bb.objects.filter(pk=bb_id).update(
+        comment_count=F('comment_count') + 1,
+        last_comment_at=Greatest(Coalesce(F('last_comment_at'), Value(created_at)), Value(created_at)),
+        updated_at=timezone.now())
+
+
+def comment_removed(bb_id):
+    # Время последнего комментария пересчитывается подзапросом в той же команде UPDATE
+    Bb.objects.filter(pk=bb_id).update(
+        comment_count=Greatest(F('comment_count') - 1, Value(0)),
+        last_comment_at=last_comment_subquery(),
+        updated_at=timezone.now())
+
+
+def repair_counters(queryset, batch_size=1000):
+    """
+    Пересчитывает счётчики объявлений queryset порциями по batch_size. Записываются
+    только расходящиеся значения. Возвращает число исправленных объявлений.
+    """
+    repaired = 0
+    last_pk = 0
+    queryset = queryset.order_by('pk')
+    while True:
+        bbs = list(queryset.filter(pk__gt=last_pk)
+                   .only('pk', 'rubric_id', 'comment_count', 'last_comment_at')[:batch_size])
+        if not bbs:
+            return repaired
+        last_pk = bbs[-1].pk
+        actual = {row['bb']: row for row in Comment.objects.filter(bb__in=[bb.pk for bb in bbs], is_active=True)
+                  .order_by().values('bb').annotate(count=Count('pk'), last=Max('created_at'))}
+        now = timezone.now()
+        changed = []
+        for bb in bbs:
+            row = actual.get(bb.pk, {'count': 0, 'last': None})
+            if (bb.comment_count, bb.last_comment_at) != (row['count'], row['last']):
+                bb.comment_count, bb.last_comment_at, bb.updated_at = row['count'], row['last'], now
+                changed.append(bb)
+        if changed:
+            Bb.objects.bulk_update(changed, ('comment_count', 'last_comment_at', 'updated_at'))
+            bump('index', *['bb:%s' % bb.pk for bb in changed],
+                 *['rubric:%s' % pk for pk in {bb.rubric_id for bb in changed}])
+            repaired += len(changed)
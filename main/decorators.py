@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .instrumentation import execute_wrapper
+from .versions import get_versions, aget_versions, version_datetime
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    # Считает запросы через execute_wrapper, не включая отладочный курсор
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def query_budget(max_queries):
+    """
+    Ограничивает число запросов к базе данных, выполняемых контроллером. При превышении
+    пишет предупреждение в журнал, а при QUERY_BUDGET_RAISE = True (в тестах) возбуждает
+    QueryBudgetExceeded, так что новая проблема N+1 сразу обнаруживается.
+    """
+    def check(view, counter):
+        if counter.count > max_queries:
+            message = '%s: выполнено запросов %s при допустимых %s' % (view.__qualname__, counter.count,
+                                                                      max_queries)
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                counter = QueryCounter()
+                with execute_wrapper(counter):
+                    response = await view(request, *args, **kwargs)
+                check(view, counter)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            counter = QueryCounter()
+            with execute_wrapper(counter):
+                response = view(request, *args, **kwargs)
+            check(view, counter)
+            return response
+        return wrapper
+    return decorator
+
+
+async def load_user(request):
+    """
+    Для асинхронных контроллеров: загружает сессию и пользователя за один переход в поток,
+    после чего request.user, request.session и сообщения доступны в цикле событий без
+    обращения к базе данных. У гостя без cookie сессии загружать нечего.
+    """
+    if settings.SESSION_COOKIE_NAME in request.COOKIES and not hasattr(request, '_cached_user'):
+        await sync_to_async(lambda: request.user.pk)()
+
+
+def has_pending_messages(request):
+    # len() не помечает сообщения прочитанными, в отличие от перебора
+    return bool(len(get_messages(request)))
+
+
+def conditional(scopes, per_user=True, form=False):
+    """
+    Условные запросы по версиям данных (main.versions): ETag и Last-Modified вычисляются
+    без выборки данных и формирования страницы, и на повторный запрос с совпадающим
+    валидатором возвращается ответ 304. Версии должны храниться в общем для всех процессов
+    кэше (проверка main.W002), иначе процесс, не получивший новую версию, ответит 304
+    на запрос изменившейся страницы. scopes(request, *args, **kwargs) возвращает список
+    областей, от которых зависит страница.
+    При per_user ETag включает ключ пользователя (страница содержит его меню), а Last-Modified
+    выдаётся только гостям. Страница с формой (form) зависит ещё и от cookie CSRF
+    и устаревает вместе с CAPTCHA. Ответы с ожидающими вывода сообщениями не кэшируются.
+    """
+    def get_state(request, *args, **kwargs):
+        # Вызывается для ETag и для Last-Modified, версии читаются из кэша один раз
+        if not hasattr(request, '_conditional_state'):
+            request._conditional_state = compute_state(request, *args, **kwargs)
+        return request._conditional_state
+
+    def compute_state(request, *args, **kwargs):
+        if has_pending_messages(request):
+            return None
+        return state(request, get_versions(*scopes(request, *args, **kwargs)))
+
+    async def acompute_state(request, *args, **kwargs):
+        if has_pending_messages(request):
+            return None
+        return state(request, await aget_versions(*scopes(request, *args, **kwargs)))
+
+    def state(request, versions):
+        parts = [str(version) for version in versions] + [request.META.get('HTTP_ACCEPT', '')]
+        if per_user:
+            parts.append(str(request.user.pk or 0))
+        if form:
+            from captcha.conf import settings as captcha_settings
+            parts.append(request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+            # За половину срока действия CAPTCHA страница с её изображением успевает устареть
+            parts.append(str(int(time.time() // (captcha_settings.CAPTCHA_TIMEOUT * 30))))
+        return versions, parts
+
+    def etag(request, *args, **kwargs):
+        state = get_state(request, *args, **kwargs)
+        if state is None:
+            return None
+        return hashlib.md5('|'.join(state[1]).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        if per_user and request.user.is_authenticated or form:
+            return None
+        state = get_state(request, *args, **kwargs)
+        if state is None:
+            return None
+        return version_datetime(max(state[0]))
+
+    def patch_response(request, response):
+        if request.method in ('GET', 'HEAD') and response.has_header('ETag'):
+            # Кэш может хранить ответ, но обязан сверять его с сервером при каждом запросе
+            patch_cache_control(response, no_cache=True, private=per_user and request.user.is_authenticated)
+            patch_vary_headers(response, ('Cookie', 'Accept') if per_user else ('Accept',))
+        return response
+
+    def decorator(view):
+        # condition из Django поддерживает и асинхронные контроллеры, но вызывает etag_func
+        # синхронно, поэтому асинхронный контроллер читает версии из кэша заранее
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                await load_user(request)
+                if not hasattr(request, '_conditional_state'):
+                    request._conditional_state = await acompute_state(request, *args, **kwargs)
+                return patch_response(request, await conditional_view(request, *args, **kwargs))
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            return patch_response(request, conditional_view(request, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,71 @@
+from django.core.files.storage import default_storage
+from django.db import transaction, router
+from django.dispatch import Signal
+
+from .images import delete_variants
+from .jobs import register, enqueue
+from .models import Bb, AdditionalImage, Comment
+from .thumbnails import delete_thumbnails
+
+# Объявления удаляются не по одному с отправкой post_delete для каждой записи, а несколькими
+# командами DELETE ... WHERE bb_id IN (...) в одной транзакции. Вместо post_delete отправляется
+# один сигнал bbs_deleted со списками ключей удалённых объявлений и их рубрик.
+# Файлы удаляет фоновое задание delete_files после фиксации транзакции
+bbs_deleted = Signal()
+
+# Ключей в одной команде: SQLite ограничивает число параметров запроса
+CHUNK_SIZE = 500
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _raw_delete(queryset):
+    # Удаление одной командой без выборки записей и без сигналов pre_delete/post_delete,
+    # на которые подписаны django_cleanup и main.signals. Так же поступает сборщик
+    # связанных записей Django, когда сигналов нет
+    return queryset._raw_delete(queryset.db)
+
+
+def delete_bbs(queryset):
+    """
+    Удаляет объявления queryset вместе с комментариями и дополнительными иллюстрациями.
+    Возвращает число удалённых объявлений.
+    """
+    using = router.db_for_write(Bb)
+    with transaction.atomic(using=using):
+        rows = list(queryset.values_list('pk', 'rubric_id', 'image'))
+        if not rows:
+            return 0
+        ids = [pk for pk, rubric_id, image in rows]
+        names = {image for pk, rubric_id, image in rows if image}
+        for chunk in _chunks(ids):
+            names.update(AdditionalImage.objects.filter(bb_id__in=chunk).values_list('image', flat=True))
+            _raw_delete(Comment.objects.filter(bb_id__in=chunk))
+            _raw_delete(AdditionalImage.objects.filter(bb_id__in=chunk))
+            _raw_delete(Bb.objects.filter(pk__in=chunk))
+        if names:
+            # Задание пишется в той же транзакции: при откате не будет и его
+            enqueue('delete_files', {'names': sorted(names)})
+        bbs_deleted.send(sender=Bb, ids=ids, rubric_ids=sorted({rubric_id for pk, rubric_id, image in rows}))
+    return len(ids)
+
+
+@register('delete_files')
+def delete_files(payload):
+    """
+    Удаляет файлы, их миниатюры и уменьшенные копии (main.images). Один файл может использоваться несколькими записями
+    (например, после копирования объявления), поэтому удаляются только файлы, на которые
+    больше не ссылается ни одно объявление и ни одна иллюстрация, как и в django_cleanup.
+    """
+    for names in _chunks(payload['names']):
+        referenced = set(Bb.objects.filter(image__in=names).values_list('image', flat=True))
+        referenced.update(AdditionalImage.objects.filter(image__in=names).values_list('image', flat=True))
+        for name in names:
+            if name not in referenced:
+                default_storage.delete(name)
+                if not default_storage.exists(name):
+                    delete_thumbnails(name)
+                    delete_variants(name)
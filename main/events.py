@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .async_views import in_thread
+from .models import Bb, Comment
+
+logger = logging.getLogger(__name__)
+
+# Поток новых комментариев объявления в формате Server-Sent Events (/events/bbs/<pk>).
+# Обработчик post_save комментария после фиксации транзакции публикует событие через
+# бэкенд (COMMENT_EVENTS_BACKEND), бэкенд передаёт его брокеру процесса, а брокер - в очереди
+# подписчиков этого объявления. Подписчик - это одна сопрограмма и очередь без потоков
+# и без запросов к базе, поэтому процесс держит тысячи открытых соединений.
+# Поток обслуживается ASGI-приложением events_application (bboard.asgi) в обход
+# промежуточного слоя Django: обработчик ASGI Django держит поток на каждый запрос,
+# пока тот не завершится.
+# Идентификатор события - время создания комментария в микросекундах и его ключ; клиент,
+# переподключаясь, присылает последний полученный в заголовке Last-Event-ID и получает
+# пропущенные комментарии из базы. Клиент, не успевающий принимать события (очередь
+# длиннее COMMENT_EVENTS_QUEUE_SIZE), отключается и так же догоняет после переподключения
+EVENTS_PATH = re.compile(r'^/events/bbs/(\d+)$')
+EVENT_ID = re.compile(r'^(\d+)-(\d+)$')
+CLOSE = object()  # метка в очереди: соединение нужно закрыть
+RECENT_EVENTS = 256  # столько последних событий каждого объявления помнит брокер, чтобы не повторять их
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def event_id(comment):
+    return '%d-%d' % ((comment.created_at - EPOCH) // MICROSECOND, comment.pk)
+
+
+def parse_event_id(value):
+    """
+    Возвращает пару (время создания, ключ) из идентификатора события или None.
+    """
+    match = EVENT_ID.match(value or '')
+    if not match:
+        return None
+    return EPOCH + int(match.group(1)) * MICROSECOND, int(match.group(2))
+
+
+def comment_event(comment):
+    data = {'id': comment.pk, 'bb': comment.bb_id, 'author': comment.author, 'content': comment.content,
+            'created_at': timezone.localtime(comment.created_at).isoformat()}
+    return {'bb': comment.bb_id, 'id': event_id(comment), 'data': json.dumps(data, ensure_ascii=False)}
+
+
+def format_event(event, name='comment'):
+    return ('id: %s\nevent: %s\ndata: %s\n\n' % (event['id'], name, event['data'])).encode()
+
+
+class Subscription:
+    def __init__(self, bb_id, limit):
+        self.bb_id = bb_id
+        self.limit = limit
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.overflowed = False
+
+    def push(self, event):
+        # Выполняется в цикле событий подписчика
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= self.limit:
+            self.overflowed = True
+            self.queue.put_nowait(CLOSE)
+        else:
+            self.queue.put_nowait(event)
+
+    def close(self):
+        self.queue.put_nowait(CLOSE)
+
+
+class Broker:
+    """
+    Подписчики процесса по объявлениям. publish можно вызывать из любого потока.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}  # ключ объявления -> множество подписок
+        self.recent = {}  # ключ объявления -> OrderedDict последних идентификаторов событий
+
+    def subscribe(self, bb_id, limit):
+        subscription = Subscription(bb_id, limit)
+        with self.lock:
+            self.subscriptions.setdefault(bb_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.bb_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.bb_id]
+                    self.recent.pop(subscription.bb_id, None)
+
+    def count(self):
+        with self.lock:
+            return sum(len(subscriptions) for subscriptions in self.subscriptions.values())
+
+    def bb_ids(self):
+        with self.lock:
+            return list(self.subscriptions)
+
+    def publish(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(event['bb'], ()))
+            if not subscriptions:
+                return
+            # Одно событие может прийти и от обработчика сигнала, и из опроса базы
+            recent = self.recent.setdefault(event['bb'], OrderedDict())
+            if event['id'] in recent:
+                return
+            recent[event['id']] = True
+            if len(recent) > RECENT_EVENTS:
+                recent.popitem(last=False)
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.push, event)
+
+
+broker = Broker()
+
+
+class LocalBackend:
+    """
+    Один процесс: событие передаётся брокеру сразу после фиксации транзакции.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, event):
+        self.broker.publish(event)
+
+    def subscribed(self):
+        # Вызывается в цикле событий при каждой новой подписке
+        pass
+
+
+class DatabasePollingBackend(LocalBackend):
+    """
+    Несколько процессов: кроме немедленной передачи в своём процессе, каждый процесс
+    раз в COMMENT_EVENTS_POLL_INTERVAL секунд выбирает одним запросом новые комментарии
+    объявлений, на которые у него есть подписчики. Выборка перекрывает предыдущую на
+    COMMENT_EVENTS_POLL_OVERLAP секунд, чтобы не пропустить транзакции, зафиксированные
+    позже начала следующих. Комментарии, включённые модератором после создания, другие
+    процессы не получают - их клиенты увидят при следующей загрузке страницы.
+    """
+
+    def __init__(self, broker):
+        super().__init__(broker)
+        self.task = None
+
+    def subscribed(self):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run())
+
+    async def run(self):
+        since = timezone.now()
+        while True:
+            await asyncio.sleep(settings.COMMENT_EVENTS_POLL_INTERVAL)
+            bb_ids = self.broker.bb_ids()
+            if not bb_ids:
+                return  # опрос возобновится со следующей подпиской
+            started = timezone.now()
+            try:
+                comments = await in_thread(self.poll, bb_ids, since)
+            except Exception:
+                logger.exception('Ошибка опроса новых комментариев')
+                continue
+            for comment in comments:
+                self.broker.publish(comment_event(comment))
+            since = started - timedelta(seconds=settings.COMMENT_EVENTS_POLL_OVERLAP)
+
+    def poll(self, bb_ids, since):
+        return list(Comment.objects.filter(is_active=True, bb__in=bb_ids, created_at__gt=since)
+                    .order_by('created_at', 'pk'))
+
+
+@lru_cache(maxsize=None)
+def get_events_backend():
+    return import_string(settings.COMMENT_EVENTS_BACKEND)(broker)
+
+
+def publish_comment(comment):
+    """
+    Публикует комментарий подписчикам его объявления после фиксации транзакции.
+    """
+    event = comment_event(comment)
+    transaction.on_commit(lambda: get_events_backend().publish(event))
+
+
+def missed_comments(bb_id, last):
+    """
+    Проверяет объявление и возвращает список комментариев, созданных после события last
+    (или None, если объявления нет). Комментариев больше COMMENT_EVENTS_CATCHUP - список
+    из одного None: клиенту проще загрузить страницу заново.
+    """
+    if not Bb.objects.filter(pk=bb_id, is_active=True).exists():
+        return None
+    if last is None:
+        return []
+    created_at, pk = last
+    comments = list(Comment.objects.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk),
+                                           is_active=True, bb=bb_id)
+                    .order_by('created_at', 'pk')[:settings.COMMENT_EVENTS_CATCHUP + 1])
+    if len(comments) > settings.COMMENT_EVENTS_CATCHUP:
+        return [None]
+    return comments
+
+
+# ASGI
+async def send_text(send, status, text):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': text.encode()})
+
+
+async def wait_disconnect(receive, subscription):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    subscription.close()
+
+
+async def stream_comments(scope, receive, send, bb_id):
+    if scope['method'] not in ('GET', 'HEAD'):
+        return await send_text(send, 405, 'Метод не поддерживается')
+    if broker.count() >= settings.COMMENT_EVENTS_MAX_SUBSCRIBERS:
+        return await send_text(send, 503, 'Слишком много подписчиков')
+    headers = dict(scope['headers'])
+    query = dict(part.split('=', 1) for part in scope['query_string'].decode('latin-1').split('&') if '=' in part)
+    # При первом подключении последний показанный на странице комментарий передаётся в адресе
+    last = parse_event_id(headers.get(b'last-event-id', b'').decode('latin-1')) or \
+        parse_event_id(query.get('last_event_id'))
+
+    # Подписка до выборки пропущенного: событие, опубликованное между ними, не теряется
+    subscription = broker.subscribe(bb_id, settings.COMMENT_EVENTS_QUEUE_SIZE)
+    get_events_backend().subscribed()
+    disconnect = asyncio.ensure_future(wait_disconnect(receive, subscription))
+    try:
+        comments = await in_thread(missed_comments, bb_id, last)
+        if comments is None:
+            return await send_text(send, 404, 'Объявление не найдено')
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')]})
+        body = b'retry: %d\n\n' % settings.COMMENT_EVENTS_RETRY
+        reload = comments == [None]
+        if reload:
+            body += b'event: reload\ndata: \n\n'
+        elif comments:
+            body += b''.join(format_event(comment_event(comment)) for comment in comments)
+            last = (comments[-1].created_at, comments[-1].pk)
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        while not reload and scope['method'] == 'GET':
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), settings.COMMENT_EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                # Комментарий SSE не даёт промежуточным серверам закрыть простаивающее соединение
+                await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                continue
+            if event is CLOSE:
+                break
+            if last and parse_event_id(event['id']) <= last:
+                continue  # уже отправлено из базы
+            await send({'type': 'http.response.body', 'body': format_event(event), 'more_body': True})
+        if not disconnect.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        broker.unsubscribe(subscription)
+        disconnect.cancel()
+
+
+def events_application(application):
+    """
+    Оборачивает ASGI-приложение Django: запросы к /events/bbs/<pk> обслуживает поток
+    комментариев, остальные - Django.
+    """
+    async def events(scope, receive, send):
+        if scope['type'] == 'http':
+            match = EVENTS_PATH.match(scope['path'])
+            if match:
+                return await stream_comments(scope, receive, send, int(match.group(1)))
+        return await application(scope, receive, send)
+    return events
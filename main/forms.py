@@ -19,6 +19,25 @@ class BbForm(forms.ModelForm):
 AIFormSet = inlineformset_factory(Bb, AdditionalImage, fields='__all__')
 
 
+# Проверка строк импорта (main.importer) по тем же правилам, что и BbForm. Рубрика ищется
+# по названию, автор один на весь файл, а изображения копируются отдельно
+class BbImportForm(BbForm):
+    class Meta(BbForm.Meta):
+        fields = ('title', 'content', 'price', 'contacts', 'is_active')
+        widgets = {}
+
+
+class ImportForm(forms.Form):
+    file = forms.FileField(label='Файл CSV или JSONL')
+    author = forms.CharField(label='Имя автора объявлений')
+
+    def clean_author(self):
+        try:
+            return AdvUser.objects.get(username=self.cleaned_data['author'])
+        except AdvUser.DoesNotExist:
+            raise ValidationError('Пользователь не найден', code='invalid')
+
+
 class SubRubricForm(forms.ModelForm):
     super_rubric = forms.ModelChoiceField(queryset=SuperRubric.objects.all(), empty_label=None, label='Надрубрика',
                                           required=True)
@@ -94,5 +113,6 @@ class GuestCommentForm(forms.ModelForm):
     captcha = CaptchaField(label='Введите текст с картинки', error_messages={'invalid': 'Неправильный текст'})
 
     class Meta:
+        model = Comment
         exclude = {'is_active', }
         widgets = {'bb': forms.HiddenInput}
@@ -0,0 +1,211 @@
+import io
+import logging
+import os
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, storages
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .jobs import register, enqueue, enqueue_unique
+from .models import Bb, AdditionalImage
+from .thumbnails import enqueue_thumbnails
+from .versions import bump
+from .workers import submit
+
+logger = logging.getLogger(__name__)
+
+# Обработка загруженных изображений фоновым заданием process_upload (main.jobs) в пуле
+# процессов (main.workers): поворот по EXIF, уменьшение до IMAGE_MAX_SIZE точек по большей
+# стороне, удаление метаданных и сжатие в прогрессивный JPEG (или WebP, IMAGE_FORMAT),
+# а также уменьшенные копии шириной IMAGE_WIDTHS для атрибута srcset (в хранилище
+# производных файлов 'derived').
+# Обработанный файл сохраняется в каталог IMAGE_BASEDIR и заменяет исходный во всех
+# объявлениях и иллюстрациях (replace_original), исходный удаляется заданием delete_files.
+# Файлы вне IMAGE_BASEDIR ещё не обработаны (см. команду process_images)
+EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+
+
+def is_processed(name):
+    return name.startswith(settings.IMAGE_BASEDIR + '/')
+
+
+def processed_name(name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return '%s/%s%s' % (settings.IMAGE_BASEDIR, stem, EXTENSIONS[settings.IMAGE_FORMAT])
+
+
+def variant_name(name, width):
+    # images/ab/cd/<хэш>.jpg -> images/ab/cd/<хэш>.<ширина>w.jpg
+    stem, extension = os.path.splitext(name)
+    return '%s.%dw%s' % (stem, width, extension)
+
+
+def encode(image):
+    output = io.BytesIO()
+    # Метаданные (EXIF с координатами съёмки и т. п.) не передаются, профиль цвета сохраняется
+    icc_profile = image.info.get('icc_profile')
+    if settings.IMAGE_FORMAT == 'WEBP':
+        image.save(output, 'WEBP', quality=settings.IMAGE_QUALITY, method=6, icc_profile=icc_profile)
+    else:
+        image.save(output, 'JPEG', quality=settings.IMAGE_QUALITY, optimize=True, progressive=True,
+                   icc_profile=icc_profile)
+    return output.getvalue()
+
+
+def flatten(image):
+    if image.mode in ('RGB', 'L'):
+        return image
+    if settings.IMAGE_FORMAT == 'WEBP' and image.mode == 'RGBA':
+        return image
+    image = image.convert('RGBA')
+    if settings.IMAGE_FORMAT == 'WEBP':
+        return image
+    # В JPEG нет прозрачности: прозрачные области становятся белыми
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def process_image(name):
+    """
+    Читает файл name и возвращает кортеж (name, байты
+    обработанного файла, список пар (ширина, байты копии), размер исходного файла).
+    Анимированные изображения не обрабатываются - вместо байтов None.
+    """
+    with default_storage.open(name) as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as source:
+        if getattr(source, 'is_animated', False):
+            return name, None, [], len(data)
+        icc_profile = source.info.get('icc_profile')
+        image = flatten(ImageOps.exif_transpose(source))
+        image.thumbnail((settings.IMAGE_MAX_SIZE, settings.IMAGE_MAX_SIZE), Image.LANCZOS)
+        image.info = {'icc_profile': icc_profile} if icc_profile else {}
+        variants = []
+        for width in sorted(settings.IMAGE_WIDTHS):
+            if width >= image.width:
+                break
+            variant = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            variant.info = image.info
+            variants.append((width, encode(variant)))
+        return name, encode(image), variants, len(data)
+
+
+def replace_file(old_name, name, width=None, variants=()):
+    """
+    Заменяет файл old_name файлом name во всех объявлениях и иллюстрациях. Возвращает False,
+    если на old_name уже никто не ссылается. Ширина обработанного файла и ширины его копий
+    (width, variants) сохраняются в записях, если переданы. Обработка и миниатюры нового
+    файла ставятся в очередь.
+    """
+    with transaction.atomic():
+        bb_ids = set(Bb.objects.filter(image=old_name).values_list('pk', flat=True))
+        bb_ids.update(AdditionalImage.objects.filter(image=old_name).values_list('bb_id', flat=True))
+        if not bb_ids:
+            return False
+        # update не отправляет сигналы: django_cleanup не удалит исходный файл,
+        # а карточки и страницы обновляются по дате изменения и версиям
+        fields = {'image': name}
+        if width:
+            fields.update(image_width=width, image_variants=sorted(variants))
+        Bb.objects.filter(image=old_name).update(**fields)
+        AdditionalImage.objects.filter(image=old_name).update(**fields)
+        Bb.objects.filter(pk__in=bb_ids).update(updated_at=timezone.now())
+        rubric_ids = set(Bb.objects.filter(pk__in=bb_ids).values_list('rubric_id', flat=True))
+        bump('index', *['rubric:%s' % pk for pk in rubric_ids], *['bb:%s' % pk for pk in bb_ids])
+        # Прежний файл удаляется, только если на него больше ничего не ссылается
+        enqueue('delete_files', {'names': [old_name]})
+        enqueue_image(name)
+    return True
+
+
+def replace_original(result):
+    """
+    Сохраняет результат process_image и заменяет исходный файл обработанным в объявлениях
+    и иллюстрациях. Возвращает число сэкономленных байтов (без учёта копий).
+    """
+    old_name, data, variants, size = result
+    if data is None:
+        enqueue_thumbnails(old_name)
+        return 0
+    name = default_storage.save(processed_name(old_name), ContentFile(data))
+    derived_storage = storages['derived']
+    for width, variant in variants:
+        derived_storage.delete(variant_name(name, width))
+        derived_storage.save(variant_name(name, width), ContentFile(variant))
+    with Image.open(io.BytesIO(data)) as image:
+        image_width = image.width
+    if not replace_file(old_name, name, image_width, [width for width, variant in variants]):
+        # Пока файл обрабатывался, его заменили или удалили вместе с объявлением
+        delete_image(name)
+        return 0
+    return size - len(data)
+
+
+def delete_variants(name):
+    if is_processed(name):
+        for width in settings.IMAGE_WIDTHS:
+            storages['derived'].delete(variant_name(name, width))
+
+
+def delete_image(name):
+    # Копии удаляются вместе с файлом, а одинаковый файл другого объявления остаётся (main.storage)
+    default_storage.delete(name)
+    if not default_storage.exists(name):
+        delete_variants(name)
+
+
+def enqueue_image(name):
+    """
+    Ставит в очередь обработку файла name. Миниатюры обработанного файла создаются сразу,
+    необработанного - после замены его обработанным.
+    """
+    if not name:
+        return
+    if is_processed(name):
+        return enqueue_thumbnails(name)
+    return enqueue_unique('process_upload', {'name': name})
+
+
+@register('process_upload')
+def process_upload(payload):
+    name = payload['name']
+    # Файл могли заменить или удалить вместе с объявлением, пока задание ждало очереди
+    if not default_storage.exists(name) or not (Bb.objects.filter(image=name).exists() or
+                                                AdditionalImage.objects.filter(image=name).exists()):
+        return
+    # Изображение обрабатывается в пуле процессов (main.workers), а результат сохраняется
+    # в текущем процессе, когда готова вся пачка заданий
+    return submit(process_image, name), partial(finish_upload, name)
+
+
+def finish_upload(name, future):
+    try:
+        result = future.result()
+    except UnidentifiedImageError:
+        # Повтор не поможет: файл остаётся как есть, миниатюры выведет заглушка
+        logger.warning('Файл %s не является изображением', name)
+        return
+    replace_original(result)
+
+
+def image_srcset(fieldfile):
+    """
+    Значение атрибута srcset обработанного изображения: уменьшенные копии и сам файл
+    с шириной. Пустая строка, если копий нет. Ширины берутся из записи (image_width,
+    image_variants), а не из хранилища и не из самого файла.
+    """
+    if not fieldfile or not is_processed(fieldfile.name):
+        return ''
+    instance = fieldfile.instance
+    if not instance.image_width or not instance.image_variants:
+        return ''
+    derived_storage = storages['derived']
+    candidates = ['%s %dw' % (derived_storage.url(variant_name(fieldfile.name, width)), width)
+                  for width in instance.image_variants]
+    candidates.append('%s %dw' % (fieldfile.url, instance.image_width))
+    return ', '.join(candidates)
@@ -0,0 +1,259 @@
+import csv
+import io
+import ipaddress
+import json
+import os
+import socket
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import wait
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .forms import BbImportForm
+from .images import enqueue_image
+from .models import SubRubric, Bb, AdditionalImage
+from .search import get_search_backend
+from .versions import bump
+from .workers import get_executor
+
+# Импорт объявлений из CSV или JSONL. Файл читается построчно, строки проверяются
+# порциями по CHUNK_SIZE формой BbImportForm, объявления и доп. иллюстрации каждой
+# порции добавляются двумя запросами bulk_create в одной транзакции.
+# Изображения копируются (и при необходимости уменьшаются) в пуле процессов main.workers,
+# их обработка и миниатюры ставятся в очередь фоновых заданий.
+# Ошибочная строка попадает в отчёт и не прерывает импорт остальных
+CHUNK_SIZE = 500
+# Разделитель имён доп. иллюстраций в столбце images файла CSV
+IMAGES_SEPARATOR = ';'
+FALSE_VALUES = ('0', 'false', 'no', 'нет', 'off', '')
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []  # пары (номер строки, сообщение)
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+
+def read_rows(file, format):
+    """
+    Генератор пар (номер строки, словарь значений) из двоичного файла.
+    Строки JSONL, которые не удалось разобрать, выдаются как (номер, None).
+    """
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    if format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            images = row.get('images') or ''
+            row['images'] = [name.strip() for name in images.split(IMAGES_SEPARATOR) if name.strip()]
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_num, row if isinstance(row, dict) else None
+
+
+def check_public_url(url):
+    """
+    Возбуждает ValueError, если адрес url не http(s) или его узел разрешается в адрес
+    внутренней сети (localhost, частные сети, служебные адреса облаков и т. п.).
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError('Недопустимый адрес %s' % url)
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, parts.port or parts.scheme, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, ValueError):
+        raise ValueError('Узел %s не найден' % parts.hostname)
+    for family, type, proto, canonname, sockaddr in addresses:
+        if not ipaddress.ip_address(sockaddr[0].split('%')[0]).is_global:
+            raise ValueError('Адрес %s ведёт во внутреннюю сеть' % url)
+
+
+class PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # Перенаправление проверяется так же, как исходный адрес
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_public_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def load_image(source, max_size):
+    """
+    Выполняется в дочернем процессе: читает изображение из файла или по адресу http(s)
+    и уменьшает его до max_size точек по большей стороне. Возвращает байты файла.
+    Адреса загружаются только с узлов интернета, не из внутренней сети.
+    """
+    if source.startswith(('http://', 'https://')):
+        check_public_url(source)
+        with urllib.request.build_opener(PublicRedirectHandler).open(source, timeout=30) as response:
+            data = response.read()
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image.verify()  # файл действительно является изображением
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_size:
+            return data
+        format = image.format
+        image.thumbnail((max_size, max_size))
+        output = io.BytesIO()
+        image.save(output, format)
+        return output.getvalue()
+
+
+class Importer:
+    def __init__(self, author, source_dir='', max_image_size=None, allow_urls=True):
+        self.author = author
+        self.source_dir = source_dir
+        self.allow_urls = allow_urls
+        self.max_image_size = max_image_size or settings.IMPORT_MAX_IMAGE_SIZE
+        # Названия рубрик загружаются один раз, а не запросом на каждую строку
+        self.rubrics = {name.casefold(): pk for name, pk in SubRubric.objects.values_list('name', 'pk')}
+        self.result = ImportResult()
+
+    def run(self, rows):
+        chunk = []
+        for line, row in rows:
+            chunk.append((line, row))
+            if len(chunk) >= CHUNK_SIZE:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        self.result.errors.sort(key=lambda error: error[0])
+        return self.result
+
+    def source_path(self, name):
+        if name.startswith(('http://', 'https://')):
+            if not self.allow_urls:
+                raise ValueError('Адреса изображений не поддерживаются: %s' % name)
+            return name
+        if not self.source_dir:
+            return os.path.normpath(name)
+        # Пути вида ../../etc/passwd и символические ссылки не выходят за пределы каталога с изображениями
+        root = os.path.realpath(self.source_dir)
+        path = os.path.realpath(os.path.join(root, name))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError('Недопустимый путь к изображению %s' % name)
+        return path
+
+    def validate(self, line, row):
+        if row is None:
+            self.result.error(line, 'Строку не удалось разобрать')
+            return None
+        data = dict(row)
+        data['is_active'] = str(data.get('is_active', '1')).strip().lower() not in FALSE_VALUES
+        form = BbImportForm(data)
+        errors = []
+        if not form.is_valid():
+            errors = ['%s: %s' % (field, ' '.join(messages)) for field, messages in form.errors.items()]
+        rubric_id = self.rubrics.get(str(row.get('rubric') or '').strip().casefold())
+        if rubric_id is None:
+            errors.append('rubric: Рубрика "%s" не найдена' % row.get('rubric', ''))
+        images = row.get('images') or []
+        if not isinstance(images, list):
+            errors.append('images: Ожидается список')
+            images = []
+        try:
+            sources = [self.source_path(name) for name in [row.get('image') or ''] + images if name]
+        except ValueError as e:
+            errors.append('images: %s' % e)
+            sources = []
+        if errors:
+            self.result.error(line, '; '.join(errors))
+            return None
+        bb = form.save(commit=False)
+        bb.rubric_id = rubric_id
+        bb.author = self.author
+        return bb, bool(row.get('image')), sources
+
+    def copy_images(self, sources):
+        """
+        Копирует изображения в хранилище. Возвращает словарь {источник: имя в хранилище}
+        и словарь {источник: текст ошибки}.
+        """
+        executor = get_executor() if settings.MEDIA_WORKERS else None
+        pending = {}
+        errors = {}
+        for source in sources:
+            if executor:
+                pending[source] = executor.submit(load_image, source, self.max_image_size)
+            else:
+                try:
+                    pending[source] = load_image(source, self.max_image_size)
+                except Exception as e:
+                    errors[source] = str(e) or e.__class__.__name__
+        if executor:
+            wait(pending.values())
+        names = {}
+        for source, result in pending.items():
+            if executor:
+                try:
+                    result = result.result()
+                except Exception as e:
+                    errors[source] = str(e) or e.__class__.__name__
+                    continue
+            extension = os.path.splitext(source.split('?')[0])[1].lower() or '.jpg'
+            names[source] = default_storage.save(uuid.uuid4().hex + extension, ContentFile(result))
+        return names, errors
+
+    def import_chunk(self, chunk):
+        valid = []
+        for line, row in chunk:
+            item = self.validate(line, row)
+            if item:
+                valid.append((line,) + item)
+        names, errors = self.copy_images({source for line, bb, has_image, sources in valid for source in sources})
+
+        bbs = []
+        images = []
+        for line, bb, has_image, sources in valid:
+            failed = [source for source in sources if source in errors]
+            if failed:
+                self.result.error(line, '; '.join('image: %s: %s' % (source, errors[source]) for source in failed))
+                continue
+            if has_image:
+                bb.image = names[sources[0]]
+                sources = sources[1:]
+            bbs.append(bb)
+            images.append(sources)
+        used = {bb.image.name for bb in bbs if bb.image} | {names[source] for sources in images for source in sources}
+        for name in set(names.values()) - used:
+            default_storage.delete(name)  # изображения строк, отклонённых из-за других файлов
+        if not bbs:
+            return
+
+        with transaction.atomic():
+            Bb.objects.bulk_create(bbs)
+            AdditionalImage.objects.bulk_create([AdditionalImage(bb=bb, image=names[source])
+                                                 for bb, sources in zip(bbs, images) for source in sources])
+            # bulk_create не отправляет post_save, поэтому индекс, обработка изображений и миниатюры - здесь
+            get_search_backend().index(bbs)
+            bump('index', *['rubric:%s' % pk for pk in {bb.rubric_id for bb in bbs}])
+            for name in sorted(used):
+                enqueue_image(name)
+        self.result.created += len(bbs)
+
+
+def import_bbs(file, format, author, source_dir='', max_image_size=None, allow_urls=True):
+    """
+    Импортирует объявления из двоичного файла file в формате 'csv' или 'jsonl'. При allow_urls = False
+    изображения берутся только из файлов каталога source_dir.
+    Возвращает ImportResult с числом добавленных объявлений и ошибками по строкам.
+    """
+    return Importer(author, source_dir, max_image_size, allow_urls).run(read_rows(file, format))
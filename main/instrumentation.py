@@ -0,0 +1,272 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cache, partial, wraps
+
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+from django.utils.module_loading import import_string
+
+# Замеры запросов: общее время, число и время запросов к базе данных, время вывода шаблонов
+# и обработчиков контекста, попадания и промахи кэша. Замеры текущего запроса хранятся
+# в переменной контекста, которую устанавливает InstrumentationMiddleware (main.middlewares),
+# вне запроса (команды, фоновые задания) ничего не замеряется.
+# Каждый замер - это пара вызовов perf_counter, поэтому замеры можно не отключать на рабочем сервере
+_metrics = ContextVar('bboard_metrics', default=None)
+
+# Число последних запросов к каждому контроллеру, по которым строится гистограмма
+HISTOGRAM_SIZE = 1000
+# Границы интервалов гистограммы, миллисекунды
+HISTOGRAM_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Для журнала медленных запросов запоминаются только первые запросы к базе данных
+MAX_LOGGED_QUERIES = 100
+
+
+# Обёртки выполнения запросов к базе данных, действующие в текущем контексте. Обёртка
+# execute устанавливается на каждое соединение при его открытии (main.signals) и вызывает
+# обёртки контекста. В отличие от connection.execute_wrapper это работает и для соединений
+# других потоков: асинхронный контроллер выполняет запросы в потоках sync_to_async,
+# которые получают копию контекста, но свои соединения
+_execute_wrappers = ContextVar('bboard_execute_wrappers', default=())
+
+
+def execute(execute, sql, params, many, context):
+    for wrapper in reversed(_execute_wrappers.get()):
+        execute = partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def install_execute_wrapper(connection):
+    if execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute)
+
+
+@contextmanager
+def execute_wrapper(wrapper):
+    """
+    Как connection.execute_wrapper, но для всех соединений, через которые выполняются
+    запросы в текущем контексте, в том числе из потоков sync_to_async.
+    """
+    token = _execute_wrappers.set(_execute_wrappers.get() + (wrapper,))
+    try:
+        yield
+    finally:
+        _execute_wrappers.reset(token)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        self.queries = []  # пары (SQL, время) для журнала медленных запросов
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.context_processor_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_time = 0.0
+        self.cache_depth = 0
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обёртка выполнения запросов (execute_wrapper)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.db_count += 1
+            self.db_time += duration
+            if len(self.queries) < MAX_LOGGED_QUERIES:
+                self.queries.append((sql, duration))
+
+    def server_timing(self, total):
+        return ', '.join((
+            'db;dur=%.1f;desc="%s queries"' % (self.db_time * 1000, self.db_count),
+            'tpl;dur=%.1f' % (self.template_time * 1000),
+            'cp;dur=%.1f' % (self.context_processor_time * 1000),
+            'cache;dur=%.1f;desc="%s hits / %s misses"' % (self.cache_time * 1000, self.cache_hits,
+                                                          self.cache_misses),
+            'total;dur=%.1f' % (total * 1000),
+        ))
+
+
+def current():
+    return _metrics.get()
+
+
+def start():
+    metrics = RequestMetrics()
+    return metrics, _metrics.set(metrics)
+
+
+def finish(token):
+    _metrics.reset(token)
+
+
+class Histogram:
+    """
+    Скользящая гистограмма времени выполнения: хранит последние HISTOGRAM_SIZE значений.
+    """
+
+    def __init__(self, size=HISTOGRAM_SIZE):
+        self.samples = deque(maxlen=size)
+        self.total = 0
+
+    def add(self, duration, queries):
+        # deque.append потокобезопасна, блокировка не нужна
+        self.samples.append((duration, queries))
+        self.total += 1
+
+    def summary(self):
+        samples = list(self.samples)
+        durations = sorted(duration * 1000 for duration, queries in samples)
+        if not durations:
+            return None
+
+        def percentile(p):
+            return durations[min(len(durations) - 1, int(len(durations) * p))]
+
+        buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for duration in durations:
+            buckets[sum(1 for bound in HISTOGRAM_BUCKETS if duration > bound)] += 1
+        return {'count': len(durations), 'total': self.total, 'p50': percentile(0.5), 'p90': percentile(0.9),
+                'p99': percentile(0.99), 'max': durations[-1],
+                'queries': sum(queries for duration, queries in samples) / len(samples), 'buckets': buckets}
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def record(view_name, duration, queries):
+    histogram = _histograms.get(view_name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(view_name, Histogram())
+    histogram.add(duration, queries)
+
+
+def histograms():
+    """
+    Возвращает список пар (имя контроллера, сводка) по гистограммам текущего процесса,
+    самые медленные (по 90-му процентилю) первыми.
+    """
+    summaries = [(name, histogram.summary()) for name, histogram in list(_histograms.items())]
+    return sorted([item for item in summaries if item[1]], key=lambda item: -item[1]['p90'])
+
+
+def reset_histograms():
+    with _histograms_lock:
+        _histograms.clear()
+
+
+# Шаблоны. Вложенный вывод (карточки объявлений внутри страницы) уже входит во время
+# внешнего шаблона и отдельно не учитывается
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        metrics = _metrics.get()
+        if metrics is None or metrics.template_depth:
+            return super().render(context, request)
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+            metrics.template_depth -= 1
+
+
+def timed_context_processor(processor):
+    @wraps(processor)
+    def wrapper(request):
+        metrics = _metrics.get()
+        if metrics is None:
+            return processor(request)
+        start = time.perf_counter()
+        try:
+            return processor(request)
+        finally:
+            metrics.context_processor_time += time.perf_counter() - start
+    return wrapper
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """
+    Шаблонизатор Django с замером времени вывода шаблонов и обработчиков контекста.
+    """
+
+    def __init__(self, params):
+        super().__init__(params)
+        # Список обработчиков контекста движок строит один раз (cached_property)
+        processors = self.engine.template_context_processors
+        self.engine.__dict__['template_context_processors'] = tuple(timed_context_processor(processor)
+                                                                    for processor in processors)
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+# Кэш. Промахом считается отсутствие ключа
+class CacheMetricsMixin:
+    def _measure(self, method, *args):
+        metrics = _metrics.get()
+        # get_many базового класса вызывает get для каждого ключа, считаем только внешний вызов
+        if metrics is None or metrics.cache_depth:
+            return method(*args), None
+        metrics.cache_depth += 1
+        start = time.perf_counter()
+        try:
+            return method(*args), metrics
+        finally:
+            metrics.cache_time += time.perf_counter() - start
+            metrics.cache_depth -= 1
+
+    def get(self, key, default=None, version=None):
+        sentinel = object()
+        value, metrics = self._measure(super().get, key, sentinel, version)
+        if metrics:
+            if value is sentinel:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return default if value is sentinel else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values, metrics = self._measure(super().get_many, keys, version)
+        if metrics:
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+        return values
+
+
+@cache
+def instrumented(backend):
+    return type('Instrumented%s' % backend.__name__, (CacheMetricsMixin, backend), {})
+
+
+class InstrumentedCache:
+    """
+    Кэш с подсчётом попаданий и промахов поверх движка OPTIONS['BACKEND'] (любого движка
+    кэша Django). Остальные параметры передаются этому движку:
+    {'BACKEND': 'main.instrumentation.InstrumentedCache', 'LOCATION': ...,
+     'OPTIONS': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', ...}}
+    """
+
+    def __new__(cls, location, params):
+        options = dict(params.get('OPTIONS', {}))
+        backend = import_string(options.pop('BACKEND'))
+        return instrumented(backend)(location, {**params, 'OPTIONS': options})
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import traceback
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import get_connection, EmailMessage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job, DeadJob
+
+logger = logging.getLogger(__name__)
+
+# Очередь фоновых заданий в базе данных. Задание - имя обработчика и параметры в JSON.
+# Обработчик может объявить общий контекст (например, соединение с SMTP-сервером),
+# который открывается один раз на всю пачку однотипных заданий. Обработчик может вернуть
+# пару (future, finish): тяжёлая часть выполняется в пуле процессов (main.workers.submit),
+# и задания пачки отправляются туда все сразу. Затем для каждого задания в текущем
+# процессе вызывается finish(future), задание выполнено, если finish не вызвал исключения
+handlers = {}
+# Отметка о поставленном задании enqueue_unique
+UNIQUE_KEY = 'job_queued:%s:%s'
+
+
+def register(name, context=None):
+    def decorator(func):
+        handlers[name] = (func, context)
+        return func
+    return decorator
+
+
+def enqueue(name, payload, run_at=None):
+    return Job.objects.create(name=name, payload=payload, run_at=run_at or timezone.now())
+
+
+def enqueue_many(name, payloads):
+    now = timezone.now()
+    return Job.objects.bulk_create([Job(name=name, payload=payload, run_at=now) for payload in payloads])
+
+
+def unique_key(name, payload):
+    return UNIQUE_KEY % (name, hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest())
+
+
+def enqueue_unique(name, payload):
+    """
+    Ставит задание, если такое же задание ещё не выполнено. Отметка о нём хранится в общем
+    кэше до выполнения, но не дольше JOBS_UNIQUE_TIMEOUT секунд, поэтому повторные вызовы
+    (например, при выводе каждой страницы с ещё не созданной миниатюрой) не обращаются
+    к базе данных. Обработчик такого задания должен допускать повторное выполнение.
+    """
+    if not cache.add(unique_key(name, payload), True, settings.JOBS_UNIQUE_TIMEOUT):
+        return None
+    return enqueue(name, payload)
+
+
+def claim(limit):
+    """
+    Захватывает до limit готовых к выполнению заданий. Захват - одна команда UPDATE
+    с уникальной меткой обработчика, поэтому несколько обработчиков не получат одно задание.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    available = Q(run_at__lte=now) & (Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+    ids = list(Job.objects.filter(available).values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    Job.objects.filter(available, pk__in=ids).update(locked_by=token, locked_until=now + timedelta(
+        seconds=settings.JOBS_LEASE))
+    return list(Job.objects.filter(locked_by=token).order_by('name', 'pk'))
+
+
+def fail(job, error):
+    job.attempts += 1
+    job.last_error = error
+    if job.attempts >= settings.JOBS_MAX_ATTEMPTS:
+        with transaction.atomic():
+            DeadJob.objects.create(name=job.name, payload=job.payload, attempts=job.attempts, last_error=error,
+                                   created_at=job.created_at)
+            job.delete()
+        cache.delete(unique_key(job.name, job.payload))
+        logger.error('Задание %s отклонено после %s попыток', job.name, job.attempts)
+        return
+    # Экспоненциальная задержка перед следующей попыткой
+    job.run_at = timezone.now() + timedelta(seconds=settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1))
+    job.locked_by = ''
+    job.locked_until = None
+    job.save(update_fields=('attempts', 'last_error', 'run_at', 'locked_by', 'locked_until'))
+
+
+def run_pending(limit=100):
+    """
+    Выполняет готовые задания. Возвращает пару (выполнено, с ошибкой).
+    """
+    done = failed = 0
+    for name, group in groupby(claim(limit), key=lambda job: job.name):
+        group = list(group)
+        if name not in handlers:
+            for job in group:
+                fail(job, 'Неизвестное задание %s' % name)
+            failed += len(group)
+            continue
+        func, context = handlers[name]
+        succeeded = set()
+        processed = set()
+        deferred = []
+        try:
+            with (context() if context else nullcontext()) as shared:
+                for job in group:
+                    processed.add(job.pk)
+                    try:
+                        if context:
+                            result = func(job.payload, shared)
+                        else:
+                            result = func(job.payload)
+                    except Exception:
+                        fail(job, traceback.format_exc())
+                        failed += 1
+                    else:
+                        if result is None:
+                            succeeded.add(job.pk)
+                        else:
+                            deferred.append((job, result))
+                for job, (future, finish) in deferred:
+                    try:
+                        finish(future)
+                    except Exception:
+                        fail(job, traceback.format_exc())
+                        failed += 1
+                    else:
+                        succeeded.add(job.pk)
+        except Exception:
+            # Не удалось открыть общий контекст: оставшиеся задания пачки будут повторены
+            error = traceback.format_exc()
+            for job in group:
+                if job.pk not in processed:
+                    fail(job, error)
+                    failed += 1
+        Job.objects.filter(pk__in=succeeded).delete()
+        cache.delete_many([unique_key(job.name, job.payload) for job in group if job.pk in succeeded])
+        done += len(succeeded)
+    return done, failed
+
+
+@contextmanager
+def mail_connection():
+    # Одно соединение с почтовым сервером на всю пачку писем, как в send_mass_mail()
+    connection = get_connection()
+    connection.open()
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+@register('send_email', context=mail_connection)
+def send_email(payload, connection):
+    EmailMessage(payload['subject'], payload['body'], payload.get('from_email'), payload['to'],
+                 connection=connection).send()
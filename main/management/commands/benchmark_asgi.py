@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import time
+from urllib.parse import unquote
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Сравнение пропускной способности и задержек сайта под ASGI (асинхронные контроллеры,
+# main.async_views) и под WSGI (синхронные контроллеры) при большом числе одновременных
+# клиентов. Каждый сервер запускается в отдельном процессе этой же командой (--serve),
+# нагрузку создаёт асинхронный клиент, открывающий соединение на каждый запрос.
+# Если установлен uvicorn, ASGI-приложение обслуживает он, иначе - простой встроенный
+# сервер HTTP/1.1; WSGI-приложение - wsgiref с потоком на соединение
+HOST = '127.0.0.1'
+READY_TIMEOUT = 30
+
+
+# Встроенный ASGI-сервер: разбирает запрос без тела или с Content-Length, потоковые ответы
+# передаёт частями (chunked)
+async def serve_asgi_connection(application, reader, writer, port):
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                break
+            request_line, *lines = head.decode('latin-1').split('\r\n')[:-2]
+            method, target, version = request_line.split(' ', 2)
+            headers = []
+            for line in lines:
+                name, _, value = line.partition(':')
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+            header_map = dict(headers)
+            length = int(header_map.get(b'content-length', 0))
+            body = await reader.readexactly(length) if length else b''
+            path, _, query = target.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': version[5:], 'method': method,
+                'scheme': 'http', 'path': unquote(path), 'raw_path': path.encode('latin-1'),
+                'query_string': query.encode('latin-1'), 'root_path': '', 'headers': headers,
+                'client': writer.get_extra_info('peername')[:2], 'server': (HOST, port),
+            }
+            keep_alive = version == 'HTTP/1.1' and header_map.get(b'connection', b'').lower() != b'close'
+            finished = asyncio.Event()
+            response = {'status': 500, 'headers': [], 'streaming': False}
+            received = False
+
+            async def receive():
+                nonlocal received
+                if not received:
+                    received = True
+                    return {'type': 'http.request', 'body': body, 'more_body': False}
+                # Отключение клиента: конец входного потока (конвейерные запросы не поддерживаются)
+                closed = asyncio.ensure_future(reader.read())
+                done = asyncio.ensure_future(finished.wait())
+                await asyncio.wait((closed, done), return_when=asyncio.FIRST_COMPLETED)
+                closed.cancel()
+                done.cancel()
+                return {'type': 'http.disconnect'}
+
+            def head(extra):
+                output = ['HTTP/1.1 %s %s' % (response['status'], 'OK' if response['status'] < 400 else 'Error')]
+                output += ['%s: %s' % (name.decode('latin-1'), value.decode('latin-1'))
+                           for name, value in response['headers'] if name.lower() != b'content-length']
+                output += extra + ['Connection: %s' % ('keep-alive' if keep_alive else 'close')]
+                return ('\r\n'.join(output) + '\r\n\r\n').encode('latin-1')
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    response['status'] = message['status']
+                    response['headers'] = message.get('headers', [])
+                    return
+                chunk = message.get('body', b'')
+                if message.get('more_body') or response['streaming']:
+                    # Потоковый ответ (события SSE, большие страницы) передаётся частями по мере готовности
+                    if not response['streaming']:
+                        response['streaming'] = True
+                        writer.write(head(['Transfer-Encoding: chunked']))
+                    if chunk:
+                        writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                    if not message.get('more_body'):
+                        writer.write(b'0\r\n\r\n')
+                else:
+                    writer.write(head(['Content-Length: %s' % len(chunk)]) + chunk)
+                await writer.drain()
+
+            try:
+                await application(scope, receive, send)
+            finally:
+                finished.set()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_asgi(application, port, ready=None):
+    server = await asyncio.start_server(
+        lambda reader, writer: serve_asgi_connection(application, reader, writer, port), HOST, port, backlog=4096)
+    if ready:
+        ready.set()
+    async with server:
+        await server.serve_forever()
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 4096
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+# Нагрузка
+async def fetch(port, path):
+    reader, writer = await asyncio.open_connection(HOST, port)
+    try:
+        writer.write(('GET %s HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n' % path).encode())
+        await writer.drain()
+        data = await reader.read()
+    finally:
+        writer.close()
+    return int(data.split(b' ', 2)[1]) if data.startswith(b'HTTP/') else 0
+
+
+async def generate_load(port, paths, requests, concurrency):
+    """
+    Выполняет requests запросов к адресам paths по кругу силами concurrency одновременных
+    клиентов. Возвращает время, отсортированный список задержек успешных запросов и число ошибок.
+    """
+    counter = iter(range(requests))
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        for number in counter:
+            start = time.perf_counter()
+            try:
+                status = await fetch(port, paths[number % len(paths)])
+            except OSError:
+                status = 0
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, sorted(latencies), errors
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(port, process):
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError('Сервер завершился с кодом %s' % process.returncode)
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError('Сервер не запустился за %s с' % READY_TIMEOUT)
+
+
+def default_paths():
+    from main.models import Bb
+    paths = ['/', '/api/bbs/']
+    bb = Bb.objects.filter(is_active=True).only('pk', 'rubric_id').first()
+    if bb:
+        paths += ['/%s/' % bb.rubric_id, '/%s/%s' % (bb.rubric_id, bb.pk), '/api/bbs/%s' % bb.pk]
+    return paths
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает число запросов в секунду и задержки сайта под ASGI (асинхронные контроллеры) ' \
+           'и под WSGI при большом числе одновременных клиентов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=200, help='Одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Адрес страницы, можно указать несколько раз (по умолчанию главная, '
+                                 'рубрика, объявление и API)')
+        parser.add_argument('--no-page-cache', action='store_true', help='Отключить кэш страниц (main.pagecache)')
+        parser.add_argument('--servers', default='asgi,wsgi', help='Сравниваемые серверы через запятую')
+        parser.add_argument('--serve', choices=('asgi', 'wsgi'), help=('Запустить сервер (используется '
+                                                                       'командой для дочерних процессов)'))
+        parser.add_argument('--port', type=int)
+
+    def handle(self, *args, **options):
+        if options['no_page_cache']:
+            settings.PAGE_CACHE_TIMEOUT = 0
+        if options['serve']:
+            return self.serve(options['serve'], options['port'])
+
+        paths = options['paths'] or default_paths()
+        self.stdout.write('Адреса: %s; клиентов: %s, запросов: %s' % (
+            ', '.join(paths), options['concurrency'], options['requests']))
+        self.stdout.write('%-5s %9s %8s %9s %9s %9s %9s %7s' % (
+            '', 'запросы', 'время, с', 'запр./с', 'p50, мс', 'p90, мс', 'p99, мс', 'ошибки'))
+        for kind in options['servers'].split(','):
+            port = free_port()
+            command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_asgi',
+                       '--serve', kind, '--port', str(port)]
+            if options['no_page_cache']:
+                command.append('--no-page-cache')
+            # Выбор контроллеров (ASYNC_VIEWS) читается при загрузке настроек дочернего процесса
+            env = dict(os.environ, BBOARD_ASYNC_VIEWS='1' if kind == 'asgi' else '0')
+            process = subprocess.Popen(command, env=env)
+            try:
+                wait_ready(port, process)
+                # Прогрев: шаблоны, кэши, соединения с базой
+                asyncio.run(generate_load(port, paths, len(paths) * 5, 1))
+                elapsed, latencies, errors = asyncio.run(generate_load(port, paths, options['requests'],
+                                                                       options['concurrency']))
+            finally:
+                process.terminate()
+                process.wait()
+            self.stdout.write('%-5s %9s %8.2f %9.0f %9.1f %9.1f %9.1f %7s' % (
+                kind, len(latencies), elapsed, len(latencies) / elapsed, percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.9) * 1000, percentile(latencies, 0.99) * 1000, errors))
+
+    def serve(self, kind, port):
+        # Под такой нагрузкой медленным оказывается почти каждый запрос
+        logging.getLogger('bboard.slow').disabled = True
+        if kind == 'wsgi':
+            from bboard.wsgi import application
+            make_server(HOST, port, application, server_class=ThreadingWSGIServer,
+                        handler_class=QuietWSGIRequestHandler).serve_forever()
+            return
+        from bboard.asgi import application
+        try:
+            import uvicorn
+        except ImportError:
+            asyncio.run(serve_asgi(application, port))
+        else:
+            uvicorn.run(application, host=HOST, port=port, log_level='warning', lifespan='off')
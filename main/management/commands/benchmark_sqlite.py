@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from bboard.database import PRAGMAS
+
+# Конфигурации для сравнения: настройки SQLite по умолчанию (как у Django без OPTIONS)
+# и настройки bboard.database
+CONFIGURATIONS = {
+    'default': {'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL'}, 'begin': 'BEGIN', 'timeout': 5},
+    'tuned': {'pragmas': PRAGMAS, 'begin': 'BEGIN IMMEDIATE', 'timeout': PRAGMAS['busy_timeout'] / 1000},
+}
+
+
+def connect(path, configuration):
+    connection = sqlite3.connect(path, timeout=configuration['timeout'], isolation_level=None,
+                                 check_same_thread=False)
+    for name, value in configuration['pragmas'].items():
+        connection.execute('PRAGMA %s = %s' % (name, value))
+    return connection
+
+
+def create_database(path, bbs):
+    with sqlite3.connect(path) as connection:
+        connection.executescript('''
+            CREATE TABLE bb (id INTEGER PRIMARY KEY, title TEXT, comment_count INTEGER NOT NULL DEFAULT 0);
+            CREATE TABLE comment (id INTEGER PRIMARY KEY, bb_id INTEGER NOT NULL REFERENCES bb (id),
+                                  author TEXT, content TEXT, created_at REAL);
+            CREATE INDEX comment_bb_idx ON comment (bb_id, created_at);
+        ''')
+        connection.executemany('INSERT INTO bb (id, title) VALUES (?, ?)', [(i, 'Товар %s' % i) for i in range(bbs)])
+
+
+def writer(path, configuration, transactions, bbs, number, results):
+    # Как добавление комментария: проверка объявления, запись комментария, обновление счётчика
+    connection = connect(path, configuration)
+    latencies = []
+    errors = 0
+    for i in range(transactions):
+        bb_id = (number * 7919 + i) % bbs
+        start = time.perf_counter()
+        try:
+            connection.execute(configuration['begin'])
+            connection.execute('SELECT id, comment_count FROM bb WHERE id = ?', (bb_id,)).fetchone()
+            connection.execute('INSERT INTO comment (bb_id, author, content, created_at) VALUES (?, ?, ?, ?)',
+                               (bb_id, 'Гость %s' % number, 'Комментарий %s' % i, time.time()))
+            connection.execute('UPDATE bb SET comment_count = comment_count + 1 WHERE id = ?', (bb_id,))
+            connection.execute('COMMIT')
+            latencies.append(time.perf_counter() - start)
+        except sqlite3.OperationalError:
+            # database is locked: в режиме DEFERRED повышение блокировки завершается ошибкой сразу
+            errors += 1
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+    connection.close()
+    results.append((latencies, errors))
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность SQLite при одновременной записи из нескольких потоков ' \
+           'с настройками по умолчанию и настройками bboard.database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--transactions', type=int, default=200, help='Транзакций в каждом потоке')
+        parser.add_argument('--bbs', type=int, default=100, help='Объявлений в тестовой базе')
+        parser.add_argument('--directory', default=None,
+                            help='Каталог для временной базы (по умолчанию системный временный каталог)')
+
+    def handle(self, *args, **options):
+        for name, configuration in CONFIGURATIONS.items():
+            with tempfile.TemporaryDirectory(dir=options['directory']) as directory:
+                path = os.path.join(directory, 'benchmark.sqlite3')
+                create_database(path, options['bbs'])
+                connect(path, configuration).close()  # режим журнала сохраняется в файле базы
+                results = []
+                threads = [threading.Thread(target=writer, args=(path, configuration, options['transactions'],
+                                                                 options['bbs'], number, results))
+                           for number in range(options['threads'])]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+            latencies = sorted(latency for thread_latencies, errors in results for latency in thread_latencies)
+            errors = sum(errors for thread_latencies, errors in results)
+            self.stdout.write('%-8s транзакций: %5s за %.2f с (%.0f/с), ошибок блокировки: %s, '
+                              'задержка p50 %.1f мс, p99 %.1f мс' % (
+                                  name, len(latencies), elapsed, len(latencies) / elapsed, errors,
+                                  percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000))
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p))]
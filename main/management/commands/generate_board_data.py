@@ -0,0 +1,135 @@
+import os
+import random
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.models import AdvUser, SuperRubric, SubRubric, Bb, AdditionalImage, Comment
+from main.rubrics import invalidate_rubric_tree
+from main.search import get_search_backend
+
+WORDS = ('продам', 'куплю', 'обменяю', 'новый', 'б/у', 'срочно', 'недорого', 'автомобиль', 'велосипед', 'диван',
+         'холодильник', 'телефон', 'ноутбук', 'квартира', 'дача', 'гараж', 'коляска', 'шкаф', 'стол', 'кресло',
+         'отличном', 'хорошем', 'состоянии', 'торг', 'доставка', 'самовывоз', 'гарантия', 'документы', 'фото',
+         'звоните', 'пишите', 'вечером', 'район', 'центр', 'метро', 'рядом', 'красный', 'синий', 'большой', 'малый')
+AUTHORS = ('Иван', 'Мария', 'Пётр', 'Анна', 'Гость', 'Сергей', 'Ольга', 'Дмитрий')
+PLACEHOLDER_DIR = 'generated'
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@contextmanager
+def explicit_created_at(*models):
+    # bulk_create заполняет поля auto_now_add текущим временем, а нам нужны
+    # заданные даты, поэтому на время генерации отключаем это поведение
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими пользователями, рубриками, объявлениями и комментариями ' \
+           '(отдельную базу задаёт переменная окружения BBOARD_DB_PATH, например generated.data)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора случайных чисел')
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--super-rubrics', type=int, default=5)
+        parser.add_argument('--sub-rubrics', type=int, default=4, help='Подрубрик в каждой надрубрике')
+        parser.add_argument('--bbs', type=int, default=10000)
+        parser.add_argument('--images', type=int, default=2, help='Наибольшее число доп. иллюстраций объявления')
+        parser.add_argument('--comments', type=int, default=5, help='Наибольшее число комментариев объявления')
+        parser.add_argument('--placeholders', type=int, default=16, help='Число разных файлов-заглушек')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        placeholders = self.create_placeholders(options['placeholders'])
+        rubrics = self.create_rubrics(options['super_rubrics'], options['sub_rubrics'])
+        users = self.create_users(options['users'], options['seed'])
+        self.stdout.write('Пользователей: %s, подрубрик: %s' % (len(users), len(rubrics)))
+
+        created = 0
+        with explicit_created_at(Bb, Comment):
+            while created < options['bbs']:
+                count = min(self.batch_size, options['bbs'] - created)
+                with transaction.atomic():
+                    bbs = self.create_bbs(count, created, rubrics, users, placeholders)
+                    self.create_images(bbs, options['images'], placeholders)
+                    self.create_comments(bbs, options['comments'])
+                created += count
+                self.stdout.write('Объявлений: %s' % created)
+
+        invalidate_rubric_tree()
+        # bulk_create не отправляет сигналов, поэтому поисковый индекс строим заново
+        get_search_backend().rebuild(Bb.objects.all(), batch_size=self.batch_size)
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    def text(self, min_words, max_words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(min_words, max_words)))
+
+    def create_placeholders(self, count):
+        from PIL import Image
+
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, PLACEHOLDER_DIR), exist_ok=True)
+        names = []
+        for i in range(count):
+            name = '%s/placeholder_%s.jpg' % (PLACEHOLDER_DIR, i)
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            if not os.path.exists(path):
+                color = tuple(self.random.randrange(256) for _ in range(3))
+                Image.new('RGB', (64, 48), color).save(path, 'JPEG')
+            names.append(name)
+        return names
+
+    def create_rubrics(self, super_count, sub_count):
+        rubrics = []
+        for i in range(1, super_count + 1):
+            super_rubric, _ = SuperRubric.objects.get_or_create(name='Надрубрика %s' % i, defaults={'order': i})
+            for j in range(1, sub_count + 1):
+                rubric, _ = SubRubric.objects.get_or_create(name='Рубрика %s-%s' % (i, j),
+                                                            defaults={'order': j, 'super_rubric': super_rubric})
+                rubrics.append(rubric.pk)
+        return rubrics
+
+    def create_users(self, count, seed):
+        password = make_password('password')  # хеширование одно на всех, иначе оно займёт основное время
+        users = [AdvUser(username='user_%s_%s' % (seed, i), email='user_%s_%s@example.com' % (seed, i),
+                         password=password, date_joined=START)
+                 for i in range(count)]
+        AdvUser.objects.bulk_create(users, batch_size=self.batch_size, ignore_conflicts=True)
+        return list(AdvUser.objects.filter(username__startswith='user_%s_' % seed).values_list('pk', flat=True))
+
+    def create_bbs(self, count, offset, rubrics, users, placeholders):
+        bbs = []
+        for i in range(offset, offset + count):
+            bbs.append(Bb(rubric_id=self.random.choice(rubrics), author_id=self.random.choice(users),
+                          title=self.text(2, 4)[:40], content=self.text(10, 60), price=self.random.randrange(100000),
+                          contacts=self.text(2, 4),
+                          image=self.random.choice(placeholders) if self.random.random() < 0.7 else '',
+                          is_active=self.random.random() < 0.95,
+                          created_at=START + timedelta(seconds=i * 60 + self.random.randrange(60))))
+        return Bb.objects.bulk_create(bbs, batch_size=self.batch_size)
+
+    def create_images(self, bbs, max_count, placeholders):
+        images = [AdditionalImage(bb=bb, image=self.random.choice(placeholders))
+                  for bb in bbs if bb.image for _ in range(self.random.randint(0, max_count))]
+        AdditionalImage.objects.bulk_create(images, batch_size=self.batch_size)
+
+    def create_comments(self, bbs, max_count):
+        comments = []
+        for bb in bbs:
+            for i in range(self.random.randint(0, max_count)):
+                comments.append(Comment(bb=bb, author=self.random.choice(AUTHORS), content=self.text(3, 20),
+                                        is_active=self.random.random() < 0.9,
+                                        created_at=bb.created_at + timedelta(hours=i + 1)))
+        Comment.objects.bulk_create(comments, batch_size=self.batch_size)
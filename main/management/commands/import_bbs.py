@@ -0,0 +1,31 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.importer import import_bbs
+from main.models import AdvUser
+
+
+class Command(BaseCommand):
+    help = 'Импортирует объявления из файла CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--author', required=True, help='Имя пользователя - автора объявлений')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='По умолчанию определяется по расширению')
+        parser.add_argument('--source-dir', help='Каталог изображений, по умолчанию каталог файла')
+        parser.add_argument('--max-image-size', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            author = AdvUser.objects.get(username=options['author'])
+        except AdvUser.DoesNotExist:
+            raise CommandError('Пользователь %s не найден' % options['author'])
+        format = options['format'] or ('csv' if options['file'].lower().endswith('.csv') else 'jsonl')
+        source_dir = options['source_dir'] or os.path.dirname(os.path.abspath(options['file']))
+        with open(options['file'], 'rb') as f:
+            result = import_bbs(f, format, author, source_dir, options['max_image_size'])
+        for line, message in result.errors:
+            self.stderr.write('Строка %s: %s' % (line, message))
+        self.stdout.write(self.style.SUCCESS('Добавлено объявлений: %s, ошибок: %s' % (
+            result.created, len(result.errors))))
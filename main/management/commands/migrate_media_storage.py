@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.files.storage import default_storage, storages
+from django.core.management.base import BaseCommand
+
+from main.images import is_processed, replace_file, variant_name
+from main.models import Bb, AdditionalImage
+from main.storage import is_content_addressed
+
+
+class Command(BaseCommand):
+    help = 'Переносит ранее загруженные изображения объявлений в хранилище с именами ' \
+           'по содержимому (main.storage), объединяя одинаковые файлы'
+
+    def handle(self, *args, **options):
+        names = set(Bb.objects.exclude(image='').values_list('image', flat=True).iterator())
+        names.update(AdditionalImage.objects.values_list('image', flat=True).iterator())
+        names = sorted(name for name in names if not is_content_addressed(name))
+        self.stdout.write('Файлов для переноса: %s' % len(names))
+
+        derived_storage = storages['derived']
+        new_names = {}
+        missing = 0
+        for name in names:
+            if not default_storage.exists(name):
+                missing += 1
+                self.stderr.write('Нет файла %s' % name)
+                continue
+            with default_storage.open(name) as f:
+                new_name = default_storage.save(name, f)
+            if is_processed(name):
+                for width in settings.IMAGE_WIDTHS:
+                    if derived_storage.exists(variant_name(name, width)) and \
+                            not derived_storage.exists(variant_name(new_name, width)):
+                        with derived_storage.open(variant_name(name, width)) as f:
+                            derived_storage.save(variant_name(new_name, width), f)
+            # Прежний файл удалит задание delete_files
+            replace_file(name, new_name)
+            new_names[name] = new_name
+
+        before = sum(default_storage.size(name) for name in new_names)
+        after = sum(default_storage.size(name) for name in set(new_names.values()))
+        self.stdout.write(self.style.SUCCESS(
+            'Перенесено: %s, из них одинаковых: %s, нет файла: %s. Освободится %.1f КБ после выполнения '
+            'заданий delete_files, миниатюры новых имён создадут задания create_thumbnails (run_jobs)' % (
+                len(new_names), len(new_names) - len(set(new_names.values())), missing, (before - after) / 1024)))
@@ -0,0 +1,34 @@
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from main.models import Bb, AdditionalImage
+from main.thumbnails import missing_aliases, generate_thumbnails, save_thumbnails
+from main.workers import get_executor
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие миниатюры всех изображений объявлений в пуле процессов'
+
+    def handle(self, *args, **options):
+        names = set(Bb.objects.exclude(image='').values_list('image', flat=True).iterator())
+        names.update(AdditionalImage.objects.values_list('image', flat=True).iterator())
+        self.stdout.write('Изображений: %s' % len(names))
+
+        executor = get_executor()
+        futures = []
+        for name in sorted(names):
+            alias_options = missing_aliases(name)
+            if alias_options:
+                futures.append(executor.submit(generate_thumbnails, name, alias_options))
+        created = failed = 0
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                self.stderr.write(str(e))
+                continue
+            save_thumbnails(result)
+            created += len(result[1])
+        self.stdout.write(self.style.SUCCESS('Создано миниатюр: %s, ошибок: %s' % (created, failed)))
@@ -0,0 +1,38 @@
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from main.images import is_processed, process_image, replace_original
+from main.models import Bb, AdditionalImage
+from main.workers import get_executor
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает ранее загруженные изображения объявлений (main.images) в пуле процессов ' \
+           'и сообщает, сколько места удалось сэкономить'
+
+    def handle(self, *args, **options):
+        names = set(Bb.objects.exclude(image='').values_list('image', flat=True).iterator())
+        names.update(AdditionalImage.objects.values_list('image', flat=True).iterator())
+        names = sorted(name for name in names if not is_processed(name))
+        self.stdout.write('Необработанных изображений: %s' % len(names))
+
+        executor = get_executor()
+        futures = [executor.submit(process_image, name) for name in names]
+        processed = skipped = failed = saved = before = 0
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+                before += result[3]
+                saved += replace_original(result)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(str(e))
+                continue
+            if result[1] is None:
+                skipped += 1
+            else:
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            'Обработано: %s, пропущено: %s, ошибок: %s. Было %.1f КБ, сэкономлено %.1f КБ (%.0f%%)' % (
+                processed, skipped, failed, before / 1024, saved / 1024, saved * 100 / before if before else 0)))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Bb
+from main.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество объявлений в одной пачке')
+
+    def handle(self, *args, **options):
+        count = get_search_backend().rebuild(Bb.objects.all(), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Проиндексировано объявлений: %s' % count))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from main.counters import repair_counters
+from main.models import Bb
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает число комментариев и время последнего комментария объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('ids', nargs='*', type=int, help='Ключи объявлений (по умолчанию - все)')
+
+    def handle(self, *args, **options):
+        queryset = Bb.objects.all()
+        if options['ids']:
+            queryset = queryset.filter(pk__in=options['ids'])
+        repaired = repair_counters(queryset, options['batch_size'])
+        self.stdout.write('Исправлено объявлений: %s' % repaired)
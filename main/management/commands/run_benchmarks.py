@@ -0,0 +1,35 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmarks import run_benchmarks, compare, load_results, save_results
+
+
+class Command(BaseCommand):
+    help = 'Замеряет задержки, число запросов и выделение памяти основных страниц и API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--output', default=os.path.join(settings.BASE_DIR, 'benchmark_results.json'))
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmark_baseline.json'))
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Допустимый рост p95, доля')
+        parser.add_argument('--update-baseline', action='store_true', help='Сохранить результаты как базовые')
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(iterations=options['iterations'])
+        self.stdout.write('%-28s %6s %9s %9s %8s %10s' % ('', 'status', 'p50, мс', 'p95, мс', 'запросы', 'память, КБ'))
+        for name, result in results.items():
+            self.stdout.write('%-28s %6s %9.2f %9.2f %8s %10.1f' % (
+                name, result['status'], result['p50_ms'], result['p95_ms'], result['queries'],
+                result['peak_alloc_kb']))
+        save_results(results, options['output'])
+
+        if options['update_baseline']:
+            save_results(results, options['baseline'])
+            self.stdout.write(self.style.SUCCESS('Базовые результаты обновлены'))
+        elif os.path.exists(options['baseline']):
+            regressions = compare(results, load_results(options['baseline']), options['tolerance'])
+            if regressions:
+                raise CommandError('Обнаружены регрессии:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Выполняет задания из очереди фоновых заданий (отправка писем и др.)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задания и завершиться')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=5, help='Пауза при пустой очереди, секунды')
+
+    def handle(self, *args, **options):
+        while True:
+            done, failed = run_pending(options['batch_size'])
+            if done or failed:
+                self.stdout.write('Выполнено: %s, с ошибкой: %s' % (done, failed))
+            if options['once']:
+                if not done and not failed:
+                    break
+                continue
+            if not done and not failed:
+                time.sleep(options['interval'])
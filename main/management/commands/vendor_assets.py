@@ -0,0 +1,35 @@
+import os
+import urllib.request
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from main.vendor import VENDOR_DIR, ASSETS, asset_source, asset_name, check_integrity, strip_source_map
+
+
+class Command(BaseCommand):
+    help = 'Скачивает Bootstrap и jQuery из CDN (настройки BOOTSTRAP4) в каталог static приложения main, ' \
+           'чтобы страницы не зависели от CDN'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', help='Каталог static, по умолчанию main/static')
+        parser.add_argument('--force', action='store_true', help='Скачать заново уже скачанные файлы')
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or os.path.join(apps.get_app_config('main').path, 'static')
+        for setting in ASSETS:
+            url, integrity = asset_source(setting)
+            path = os.path.join(directory, *asset_name(setting).split('/'))
+            if os.path.exists(path) and not options['force']:
+                self.stdout.write('%s уже скачан' % asset_name(setting))
+                continue
+            with urllib.request.urlopen(url, timeout=30) as response:
+                data = response.read()
+            if integrity and not check_integrity(data, integrity):
+                raise CommandError('Хэш файла %s не совпадает с integrity из настроек BOOTSTRAP4' % url)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(strip_source_map(data))
+            self.stdout.write('%s -> %s' % (url, asset_name(setting)))
+        self.stdout.write(self.style.SUCCESS('Готово. Файлы из каталога %s нужно добавить в репозиторий '
+                                             'и выполнить collectstatic' % os.path.join(directory, VENDOR_DIR)))
@@ -1,9 +1,21 @@
-from .models import SubRubric
+import logging
+import random
+import sys
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from bboard.routers import replica_reads
+
+from . import instrumentation, profiling
+from .rubrics import get_rubric_tree
+
+slow_logger = logging.getLogger('bboard.slow')
 
 
 def bboard_context_processor(request):
     context = {}
-    context['rubrics'] = SubRubric.objects.all()
+    context['rubrics'] = get_rubric_tree()  # надрубрики с подрубриками из кэша, без запросов к БД
     context[
         'keyword'] = ''  # с GET-параметром keyword,
     # понадобится для генерации интернет-адресов в гиперссылках пагинатора
@@ -13,6 +25,9 @@ def bboard_context_processor(request):
         if keyword:
             context['keyword'] = '?keyword=' + keyword
             context['all'] = context['keyword']
+    if request.GET.get('sort'):  # сортировка списка сохраняется при листании и возврате к списку
+        context['keyword'] += ('&' if context['keyword'] else '?') + 'sort=' + request.GET['sort']
+        context['all'] = context['keyword']
     if 'page' in request.GET:
         page = request.GET['page']
         if page != '1':
@@ -22,3 +37,148 @@ def bboard_context_processor(request):
                 context['all'] = '?page=' + page
 
     return context
+
+
+class InstrumentationMiddleware:
+    """
+    Замеряет каждый запрос (main.instrumentation): добавляет к ответу заголовок
+    Server-Timing, учитывает время в гистограмме контроллера и записывает запросы
+    дольше SLOW_REQUEST_THRESHOLD миллисекунд вместе с их SQL в журнал bboard.slow.
+    Для потоковых ответов замеряется время до начала передачи.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.INSTRUMENTATION:
+            return self.get_response(request)
+        metrics, token = instrumentation.start()
+        try:
+            with instrumentation.execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            instrumentation.finish(token)
+        return self.process_metrics(request, response, metrics)
+
+    async def __acall__(self, request):
+        if not settings.INSTRUMENTATION:
+            return await self.get_response(request)
+        metrics, token = instrumentation.start()
+        try:
+            with instrumentation.execute_wrapper(metrics):
+                response = await self.get_response(request)
+        finally:
+            instrumentation.finish(token)
+        return self.process_metrics(request, response, metrics)
+
+    def process_metrics(self, request, response, metrics):
+        elapsed = metrics.elapsed
+        view_name = getattr(request.resolver_match, 'view_name', None) or 'unresolved'
+        instrumentation.record(view_name, elapsed, metrics.db_count)
+        response['Server-Timing'] = metrics.server_timing(elapsed)
+        if elapsed * 1000 >= settings.SLOW_REQUEST_THRESHOLD:
+            self.log_slow_request(request, response, view_name, metrics, elapsed)
+        return response
+
+    def log_slow_request(self, request, response, view_name, metrics, elapsed):
+        lines = ['%s %s (%s) %s: %.1f мс, запросов %s (%.1f мс), шаблоны %.1f мс' % (
+            request.method, request.get_full_path(), view_name, response.status_code, elapsed * 1000,
+            metrics.db_count, metrics.db_time * 1000, metrics.template_time * 1000)]
+        # Параметры не записываются: среди них бывают пароли и персональные данные
+        for sql, duration in metrics.queries:
+            lines.append('  %.1f мс: %s' % (duration * 1000, sql))
+        if metrics.db_count > len(metrics.queries):
+            lines.append('  ... ещё запросов: %s' % (metrics.db_count - len(metrics.queries)))
+        slow_logger.warning('\n'.join(lines))
+
+
+class ProfilingMiddleware:
+    """
+    Профилирует один из PROFILING_SAMPLE_RATE запросов (0 - ни одного) и любой запрос
+    с подписанным заголовком X-Bboard-Profile (main.profiling). Стеки добавляются
+    к профилю контроллера, профили выводятся на странице /admin/profiles/.
+    В асинхронном режиме (ASGI) запросы не профилируются: в потоке цикла событий одновременно
+    выполняются разные запросы, а их работа с базой идёт в потоках sync_to_async.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def is_sampled(self, request):
+        rate = settings.PROFILING_SAMPLE_RATE
+        return rate and random.randrange(rate) == 0 or profiling.has_valid_token(request)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.is_sampled(request):
+            return self.get_response(request)
+        session = profiling.start(sys._getframe())
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks = profiling.stop(session)
+        self.save(request, stacks)
+        return response
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def save(self, request, stacks):
+        view_name = getattr(request.resolver_match, 'view_name', None) or 'unresolved'
+        profiling.save_profile(view_name, stacks)
+
+
+class ReplicaMiddleware:
+    """
+    Разрешает чтение с реплик (bboard.routers) на время обработки безопасных запросов.
+    После запроса, изменяющего данные, клиент получает cookie, и его запросы
+    REPLICA_STICKY_SECONDS секунд читают основную базу, видя свои изменения несмотря на
+    отставание реплик. Администрирование и страницы пользователя работают с основной базой.
+    """
+    STICKY_COOKIE = 'bboard_primary'
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+    PRIMARY_PATHS = ('/admin/', '/accounts/', '/account/')
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def is_enabled(self, request):
+        return request.method in self.SAFE_METHODS and self.STICKY_COOKIE not in request.COOKIES and \
+            not request.path.startswith(self.PRIMARY_PATHS)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        with replica_reads(self.is_enabled(request)):
+            response = self.get_response(request)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        # В цикле событий транзакций нет, а обращение к connections здесь отдало бы одно
+        # соединение всем потокам sync_to_async этого запроса
+        with replica_reads(self.is_enabled(request), depth=0):
+            response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if request.method not in self.SAFE_METHODS:
+            response.set_cookie(self.STICKY_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS, httponly=True,
+                                samesite='Lax')
+        return response
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+from main.stemming import normalize
+
+
+def create_fts(apps, schema_editor):
+    # Полнотекстовый индекс доступен только в SQLite, для других СУБД используется поиск по вхождению
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS main_bb_fts USING fts5"
+                          "(title, content, tokenize='unicode61 remove_diacritics 0')")
+    Bb = apps.get_model('main', 'Bb')
+    rows = [(bb.pk, normalize(bb.title), normalize(bb.content))
+            for bb in Bb.objects.only('pk', 'title', 'content').iterator()]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany('INSERT INTO main_bb_fts (rowid, title, content) VALUES (%s, %s, %s)', rows)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS main_bb_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_comment'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
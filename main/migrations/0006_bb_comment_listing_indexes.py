@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_bb_fts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at', '-id'], name='bb_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['rubric', '-created_at', '-id'], name='bb_active_rubric_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='bb_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['bb', 'created_at'], name='comment_active_bb_created_idx'),
+        ),
+    ]
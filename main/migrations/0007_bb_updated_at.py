@@ -0,0 +1,19 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_bb_comment_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bb',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Изменено'),
+            preserve_default=False,
+        ),
+        migrations.RunSQL('UPDATE main_bb SET updated_at = created_at', migrations.RunSQL.noop),
+    ]
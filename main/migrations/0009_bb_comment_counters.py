@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:46
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Bb = apps.get_model('main', 'Bb')
+    Comment = apps.get_model('main', 'Comment')
+    active = Comment.objects.filter(bb=OuterRef('pk'), is_active=True).order_by().values('bb')
+    Bb.objects.update(
+        comment_count=Coalesce(Subquery(active.annotate(count=Count('pk')).values('count')), Value(0)),
+        last_comment_at=Subquery(active.annotate(last=Max('created_at')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_job_deadjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bb',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментариев'),
+        ),
+        migrations.AddField(
+            model_name='bb',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Последний комментарий'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-comment_count', '-created_at', '-id'], name='bb_active_discussed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['rubric', '-comment_count', '-created_at', '-id'], name='bb_active_rubric_discussed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-last_comment_at', '-id'], name='bb_active_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['rubric', '-last_comment_at', '-id'], name='bb_active_rubric_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+from main.stemming import normalize
+
+
+def reindex_fts(apps, schema_editor):
+    # В индекс добавлены вторые основы слов (main.stemming.word_stems)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Bb = apps.get_model('main', 'Bb')
+    rows = [(bb.pk, normalize(bb.title), normalize(bb.content))
+            for bb in Bb.objects.only('pk', 'title', 'content').iterator()]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DELETE FROM main_bb_fts')
+        cursor.executemany('INSERT INTO main_bb_fts (rowid, title, content) VALUES (%s, %s, %s)', rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_bb_comment_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(reindex_fts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:49
+
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage, storages
+from django.db import migrations, models
+from PIL import Image
+
+
+def variant_name(name, width):
+    # как main.images.variant_name
+    stem, extension = os.path.splitext(name)
+    return '%s.%dw%s' % (stem, width, extension)
+
+
+def fill_widths(apps, schema_editor):
+    # Ширины ранее обработанных изображений (main.images) читаются из файлов один раз
+    derived_storage = storages['derived']
+    for model_name in ('Bb', 'AdditionalImage'):
+        model = apps.get_model('main', model_name)
+        names = set(model.objects.filter(image__startswith=settings.IMAGE_BASEDIR + '/')
+                    .values_list('image', flat=True).iterator())
+        for name in sorted(names):
+            try:
+                with default_storage.open(name) as f, Image.open(f) as image:
+                    width = image.width
+            except OSError:
+                continue
+            variants = [w for w in sorted(settings.IMAGE_WIDTHS) if derived_storage.exists(variant_name(name, w))]
+            model.objects.filter(image=name).update(image_width=width, image_variants=variants)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_bb_fts_word_stems'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='additionalimage',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='additionalimage',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='bb',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='bb',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_widths, migrations.RunPython.noop),
+    ]
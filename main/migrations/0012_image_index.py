@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:54
+
+import main.utilities
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_image_width_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='additionalimage',
+            name='image',
+            field=models.ImageField(db_index=True, upload_to=main.utilities.get_timestamp_path, verbose_name='Изображение'),
+        ),
+        migrations.AlterField(
+            model_name='bb',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, upload_to=main.utilities.get_timestamp_path, verbose_name='Изображение'),
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from .utilities import get_timestamp_path
 
@@ -7,10 +8,12 @@ class AdvUser(AbstractUser):
     is_activated = models.BooleanField(default=True, db_index=True, verbose_name='Прошел активацию?')
     send_messages = models.BooleanField(default=True, verbose_name='Слать оповещения о новых комментариях?')
 
+    # Объявления пользователя удаляются пакетно, см. main.deletion
     def delete(self, *args, **kwargs):
-        for bb in self.bb_set.all():
-            bb.delete()
-        super().delete(*args, **kwargs)
+        from .deletion import delete_bbs
+        with transaction.atomic():
+            delete_bbs(self.bb_set.all())
+            return super().delete(*args, **kwargs)
 
     class Meta(AbstractUser.Meta):
         pass
@@ -62,32 +65,77 @@ class SubRubric(Rubric):
         verbose_name_plural = 'Подрубрики'
 
 
+class BbQuerySet(models.QuerySet):
+    def for_detail(self):
+        # Всё, что выводит страница объявления, за три запроса: само объявление с рубрикой,
+        # надрубрикой и автором, его дополнительные иллюстрации и активные комментарии
+        return self.select_related('rubric', 'rubric__super_rubric', 'author').prefetch_related(
+            'additionalimage_set',
+            models.Prefetch('comment_set', queryset=Comment.objects.filter(is_active=True),
+                            to_attr='active_comments'))
+
+
 class Bb(models.Model):
     rubric = models.ForeignKey(SubRubric, on_delete=models.PROTECT, verbose_name='Рубрика')
     title = models.CharField(max_length=40, verbose_name='Товар')
     content = models.TextField(verbose_name='Описание')
     price = models.FloatField(default=0, verbose_name='Цена')
     contacts = models.TextField(verbose_name='Контакты')
-    image = models.ImageField(blank=True, upload_to=get_timestamp_path, verbose_name='Изображение')
+    image = models.ImageField(blank=True, upload_to=get_timestamp_path, db_index=True, verbose_name='Изображение')
     author = models.ForeignKey(AdvUser, on_delete=models.CASCADE, verbose_name='Автор объявления')
     is_active = models.BooleanField(default=True, db_index=True, verbose_name='Выводить в списке?')
     created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Опубликовано')
-
-    # Удаляем все связанные доп. иллюстрации при удалении текущей записи
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменено')  # версия для кэшей
+    # Число активных комментариев и время последнего из них, поддерживаются обработчиками
+    # сигналов Comment (main.signals), пересчитываются командой repair_comment_counters
+    comment_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментариев')
+    last_comment_at = models.DateTimeField(null=True, blank=True, editable=False,
+                                           verbose_name='Последний комментарий')
+    # Ширина обработанного изображения и ширины его уменьшенных копий для srcset (main.images)
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_variants = models.JSONField(default=list, blank=True, editable=False)
+
+    objects = BbQuerySet.as_manager()
+
+    # Удаляем все связанные доп. иллюстрации и комментарии при удалении текущей записи, см. main.deletion
     def delete(self, *args, **kwargs):
-        for ai in self.additionalimage_set.all():
-            ai.delete()
-        super().delete(*args, **kwargs)
+        from .deletion import delete_bbs
+        deleted = delete_bbs(Bb.objects.filter(pk=self.pk))
+        return deleted, {self._meta.label: deleted}
 
     class Meta:
         verbose_name_plural = 'Объявления'
         verbose_name = 'Объявление'
         ordering = ['-created_at']
+        # Частичные индексы под выборки активных объявлений (лента на главной, список рубрики)
+        # и индекс объявлений пользователя для профиля. Поле id указано явно: неявный rowid
+        # в индексе SQLite идёт по возрастанию и не избавляет от сортировки по (created_at, id) DESC
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_active=True),
+                         name='bb_active_created_idx'),
+            models.Index(fields=['rubric', '-created_at', '-id'], condition=models.Q(is_active=True),
+                         name='bb_active_rubric_created_idx'),
+            models.Index(fields=['author', '-created_at', '-id'], name='bb_author_created_idx'),
+            # Сортировки "обсуждаемые" и "недавно активные" на главной, в рубрике и в API
+            models.Index(fields=['-comment_count', '-created_at', '-id'], condition=models.Q(is_active=True),
+                         name='bb_active_discussed_idx'),
+            models.Index(fields=['rubric', '-comment_count', '-created_at', '-id'],
+                         condition=models.Q(is_active=True), name='bb_active_rubric_discussed_idx'),
+            models.Index(fields=['-last_comment_at', '-id'], condition=models.Q(is_active=True),
+                         name='bb_active_activity_idx'),
+            models.Index(fields=['rubric', '-last_comment_at', '-id'], condition=models.Q(is_active=True),
+                         name='bb_active_rubric_activity_idx'),
+            # Курсор инкрементной выгрузки для партнёров (api.export)
+            models.Index(fields=['updated_at', 'id'], condition=models.Q(is_active=True),
+                         name='bb_active_updated_idx'),
+        ]
 
 
 class AdditionalImage(models.Model):
     bb = models.ForeignKey(Bb, on_delete=models.CASCADE, verbose_name='Объявление')
-    image = models.ImageField(upload_to=get_timestamp_path, verbose_name='Изображение')
+    image = models.ImageField(upload_to=get_timestamp_path, db_index=True, verbose_name='Изображение')
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_variants = models.JSONField(default=list, blank=True, editable=False)
 
     class Meta:
         verbose_name_plural = 'Дополнительные иллюстрации'
@@ -105,3 +153,41 @@ class Comment(models.Model):
         verbose_name_plural = 'Комментарии'
         verbose_name = 'Комментарий'
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['bb', 'created_at'], condition=models.Q(is_active=True),
+                         name='comment_active_bb_created_idx'),
+        ]
+
+
+class Job(models.Model):
+    name = models.CharField(max_length=50, verbose_name='Задание')
+    payload = models.JSONField(default=dict, verbose_name='Параметры')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    run_at = models.DateTimeField(default=timezone.now, verbose_name='Выполнить после')
+    locked_by = models.CharField(max_length=32, blank=True, verbose_name='Обработчик')
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name='Захвачено до')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+
+    class Meta:
+        verbose_name_plural = 'Задания'
+        verbose_name = 'Задание'
+        ordering = ['run_at', 'id']
+        indexes = [
+            models.Index(fields=['run_at', 'id'], name='job_run_at_idx'),
+        ]
+
+
+# Задания, исчерпавшие попытки выполнения
+class DeadJob(models.Model):
+    name = models.CharField(max_length=50, verbose_name='Задание')
+    payload = models.JSONField(default=dict, verbose_name='Параметры')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(verbose_name='Создано')
+    failed_at = models.DateTimeField(auto_now_add=True, verbose_name='Отклонено')
+
+    class Meta:
+        verbose_name_plural = 'Отклонённые задания'
+        verbose_name = 'Отклонённое задание'
+        ordering = ['-failed_at']
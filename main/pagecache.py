@@ -0,0 +1,154 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.http import urlencode
+
+from .decorators import has_pending_messages, load_user
+from .versions import get_versions, aget_versions
+
+# Кэш готовых страниц для гостей. Ключ страницы состоит из пути, значимых GET-параметров
+# и версий данных (main.versions), от которых страница зависит, поэтому изменение
+# объявления или комментария делает недоступными только затронутые страницы: главную,
+# страницы рубрик и страницу самого объявления.
+# Пока одна копия процесса формирует устаревшую страницу, остальные запросы получают
+# предыдущую её версию, а не формируют страницу одновременно (защита от лавины запросов).
+# Части страницы, которые нельзя кэшировать (форма с CSRF и CAPTCHA), помечаются в кэше
+# метками-"дырами" и формируются заново при каждой выдаче
+PAGE_KEY = 'page:%s:%s'
+STALE_KEY = 'page:stale:%s'
+LOCK_KEY = 'page:lock:%s'
+LOCK_TIMEOUT = 30
+# Значимые GET-параметры: остальные на содержимое страниц не влияют
+PAGE_PARAMETERS = ('keyword', 'sort', 'page')
+
+
+def page_key(request):
+    params = []
+    for name in PAGE_PARAMETERS:
+        value = request.GET.get(name, '')
+        if value and not (name == 'page' and value == '1'):
+            params.append((name, value))
+    return hashlib.md5(('%s?%s' % (request.path, urlencode(params))).encode()).hexdigest()
+
+
+def is_cacheable_request(request):
+    return request.method in ('GET', 'HEAD') and not request.user.is_authenticated and \
+        not has_pending_messages(request)
+
+
+def page_cache(scopes, holes=None):
+    """
+    Кэширует страницы, выдаваемые гостям. scopes(request, *args, **kwargs) возвращает
+    области версий, от которых зависит страница. holes - словарь {метка: функция},
+    функция (request, *args, **kwargs) возвращает HTML, подставляемый вместо метки
+    при каждой выдаче. Контроллер выводит метки, если request.page_cache_holes истинно.
+    """
+    holes = holes or {}
+
+    def fill_holes(content, request, *args, **kwargs):
+        for placeholder, render in holes.items():
+            content = content.replace(placeholder, render(request, *args, **kwargs))
+        return content
+
+    def respond(entry, request, *args, **kwargs):
+        content_type, content = entry
+        return HttpResponse(fill_holes(content, request, *args, **kwargs), content_type=content_type)
+
+    def versioned_key(url_key, versions):
+        versions = '.'.join(str(version) for version in versions)
+        return PAGE_KEY % (url_key, hashlib.md5(versions.encode()).hexdigest())
+
+    def cache_key(request, *args, **kwargs):
+        url_key = page_key(request)
+        return url_key, versioned_key(url_key, get_versions(*scopes(request, *args, **kwargs)))
+
+    def page_entry(response):
+        # Текст страницы и запись для кэша (None, если страницу кэшировать нельзя)
+        content = response.content.decode(response.charset)
+        if response.status_code == 200 and not response.cookies:
+            return content, (response['Content-Type'], content)
+        return content, None
+
+    def store(response, key, url_key):
+        content, entry = page_entry(response)
+        if entry:
+            cache.set_many({key: entry, STALE_KEY % url_key: entry}, settings.PAGE_CACHE_TIMEOUT)
+        return content
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            # Кэш - через его асинхронные методы, чтобы общий кэш (Redis, Memcached) не блокировал
+            # цикл событий; "дыры" формируются в потоке: они обращаются к базе данных
+            async def async_fill_holes(content, request, *args, **kwargs):
+                if not holes:
+                    return content
+                return await sync_to_async(fill_holes)(content, request, *args, **kwargs)
+
+            async def async_respond(entry, request, *args, **kwargs):
+                content_type, content = entry
+                return HttpResponse(await async_fill_holes(content, request, *args, **kwargs),
+                                    content_type=content_type)
+
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                await load_user(request)
+                if not settings.PAGE_CACHE_TIMEOUT or not is_cacheable_request(request):
+                    return await view(request, *args, **kwargs)
+                url_key = page_key(request)
+                key = versioned_key(url_key, await aget_versions(*scopes(request, *args, **kwargs)))
+                entry = await cache.aget(key)
+                if entry:
+                    return await async_respond(entry, request, *args, **kwargs)
+
+                lock_key = LOCK_KEY % url_key
+                if not await cache.aadd(lock_key, time.time(), LOCK_TIMEOUT):
+                    entry = await cache.aget(STALE_KEY % url_key)
+                    if entry:
+                        return await async_respond(entry, request, *args, **kwargs)
+                    return await view(request, *args, **kwargs)
+                try:
+                    request.page_cache_holes = True
+                    response = await view(request, *args, **kwargs)
+                    if response.streaming:
+                        return response
+                    content, entry = page_entry(response)
+                    if entry:
+                        await cache.aset_many({key: entry, STALE_KEY % url_key: entry}, settings.PAGE_CACHE_TIMEOUT)
+                    response.content = await async_fill_holes(content, request, *args, **kwargs)
+                    return response
+                finally:
+                    await cache.adelete(lock_key)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.PAGE_CACHE_TIMEOUT or not is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+            url_key, key = cache_key(request, *args, **kwargs)
+            entry = cache.get(key)
+            if entry:
+                return respond(entry, request, *args, **kwargs)
+
+            lock_key = LOCK_KEY % url_key
+            if not cache.add(lock_key, time.time(), LOCK_TIMEOUT):
+                # Страницу уже формирует другой запрос: выдаём предыдущую версию, если она есть
+                entry = cache.get(STALE_KEY % url_key)
+                if entry:
+                    return respond(entry, request, *args, **kwargs)
+                return view(request, *args, **kwargs)
+            try:
+                request.page_cache_holes = True
+                response = view(request, *args, **kwargs)
+                if response.streaming:
+                    return response
+                response.content = fill_holes(store(response, key, url_key), request, *args, **kwargs)
+                return response
+            finally:
+                cache.delete(lock_key)
+        return wrapper
+    return decorator
@@ -0,0 +1,176 @@
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+# Сортировки списков объявлений: GET-параметр sort -> поля упорядочивания.
+# Каждой соответствует частичный индекс по активным объявлениям (main.models.Bb.Meta)
+BB_ORDERINGS = {
+    'new': ('-created_at', '-id'),
+    'discussed': ('-comment_count', '-created_at', '-id'),
+    'active': ('-last_comment_at', '-id'),
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPaginator:
+    """
+    Пагинатор по ключу (seek-пагинация). Вместо OFFSET и COUNT(*) очередная страница
+    выбирается условием "после последней записи предыдущей страницы" по полям упорядочивания,
+    поэтому глубокие страницы выбираются так же быстро, как первая.
+    Положение страницы передаётся в непрозрачном курсоре - значении GET-параметра page.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-pk'), count_timeout=300):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.count_timeout = count_timeout
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def field_value(self, obj, name):
+        # Страница может состоять и из словарей, выбранных через values()
+        if isinstance(obj, dict):
+            return obj[name]
+        return getattr(obj, name)
+
+    def encode_cursor(self, direction, obj):
+        values = []
+        for name in self.fields:
+            value = self.field_value(obj, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        data = json.dumps([direction] + values, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+    def decode_cursor(self, token):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            direction, values = data[0], data[1:]
+            if direction not in ('n', 'p') or len(values) != len(self.fields):
+                raise InvalidCursor(token)
+            model = self.queryset.model
+            values = [model._meta.pk.to_python(value) if name == 'pk' else model._meta.get_field(name).to_python(value)
+                      for name, value in zip(self.fields, values)]
+            if any(value is None and name not in self.nullable for name, value in zip(self.fields, values)):
+                raise InvalidCursor(token)
+        except (ValueError, TypeError, IndexError, LookupError, ValidationError) as e:
+            raise InvalidCursor(token) from e
+        return direction, values
+
+    @cached_property
+    def nullable(self):
+        opts = self.queryset.model._meta
+        return {name for name in self.fields if name != 'pk' and opts.get_field(name).null}
+
+    def compare(self, name, lookup, value):
+        # NULL считается меньше любого значения, как при сортировке в SQLite
+        if name not in self.nullable:
+            return Q(**{'%s__%s' % (name, lookup): value})
+        if lookup == 'lt':
+            return Q(pk__in=[]) if value is None else Q(**{'%s__lt' % name: value}) | Q(**{'%s__isnull' % name: True})
+        if value is None:
+            return Q(**{'%s__isnull' % name: False})
+        return Q(**{'%s__gt' % name: value})
+
+    def equals(self, name, value):
+        if value is None:
+            return Q(**{'%s__isnull' % name: True})
+        return Q(**{name: value})
+
+    def seek_filter(self, values, forward):
+        # Лексикографическое сравнение (a, b) < (x, y) записывается как a < x OR (a = x AND b < y)
+        q = Q()
+        for i, ordering in enumerate(self.ordering):
+            descending = ordering.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            condition = self.compare(self.fields[i], lookup, values[i])
+            for name, value in zip(self.fields[:i], values[:i]):
+                condition &= self.equals(name, value)
+            q |= condition
+        return q
+
+    def reversed_ordering(self):
+        return [name[1:] if name.startswith('-') else '-' + name for name in self.ordering]
+
+    def get_page(self, token=None):
+        """
+        Возвращает страницу по курсору. Пустой, ошибочный курсор или '1' дают первую страницу.
+        Числовые номера страниц из старых ссылок обрабатываются через OFFSET.
+        """
+        token = token or ''
+        if token.isdigit():
+            number = int(token)
+            if number > 1:
+                start = (number - 1) * self.per_page
+                rows = list(self.queryset.order_by(*self.ordering)[start:start + self.per_page + 1])
+                return KeysetPage(rows[:self.per_page], self, len(rows) > self.per_page, bool(rows))
+            token = ''
+        if token:
+            try:
+                direction, values = self.decode_cursor(token)
+            except InvalidCursor:
+                token = ''
+        if not token:
+            rows = list(self.queryset.order_by(*self.ordering)[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], self, len(rows) > self.per_page, False)
+        if direction == 'n':
+            queryset = self.queryset.filter(self.seek_filter(values, True)).order_by(*self.ordering)
+            rows = list(queryset[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], self, len(rows) > self.per_page, True)
+        queryset = self.queryset.filter(self.seek_filter(values, False)).order_by(*self.reversed_ordering())
+        rows = list(queryset[:self.per_page + 1])
+        return KeysetPage(rows[:self.per_page][::-1], self, True, len(rows) > self.per_page)
+
+    @cached_property
+    def count(self):
+        # Общее количество записей не требуется для навигации, поэтому считается
+        # только по обращению и кэшируется: значение может немного отставать от базы
+        key = 'paginator_count:%s' % hashlib.md5(str(self.queryset.query).encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = self.queryset.count()
+            cache.set(key, count, self.count_timeout)
+        return count
+
+
+class KeysetPage:
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @cached_property
+    def next_cursor(self):
+        if self.has_next():
+            return self.paginator.encode_cursor('n', self.object_list[-1])
+        return ''
+
+    @cached_property
+    def previous_cursor(self):
+        if self.has_previous():
+            return self.paginator.encode_cursor('p', self.object_list[0])
+        return ''
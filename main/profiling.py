@@ -0,0 +1,231 @@
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.utils.html import escape
+
+# Выборочное профилирование запросов на рабочем сервере. Один фоновый поток раз в
+# PROFILING_INTERVAL секунд снимает стеки потоков, обрабатывающих отобранные запросы,
+# и считает одинаковые стеки. По завершении запроса стеки добавляются в файл профиля
+# контроллера в формате collapsed stacks ("кадр;кадр;кадр число" в строке), который
+# понимают flamegraph.pl и speedscope, а /admin/profiles/ выводит его как flame graph.
+# Неотобранный запрос обходится одним сравнением, профилировщик при этом не работает
+PROFILE_HEADER = 'HTTP_X_BBOARD_PROFILE'
+PROFILE_SALT = 'main.profiling'
+PROFILE_EXTENSION = '.folded'
+
+_lock = threading.Lock()
+_files_lock = threading.Lock()
+_sessions = {}  # идентификатор потока -> профилируемый запрос
+_active = threading.Event()  # установлено, пока есть профилируемые запросы
+_sampler = None
+
+
+class Session:
+    def __init__(self, thread_id, root):
+        self.thread_id = thread_id
+        self.root = root  # кадр, выше которого стек не записывается (промежуточный слой)
+        self.stacks = Counter()
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return '%s.%s' % (frame.f_globals.get('__name__', '?'), getattr(code, 'co_qualname', code.co_name))
+
+
+def collapse(frame, root):
+    names = []
+    while frame is not None and frame is not root:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def sample_loop():
+    while True:
+        _active.wait()  # без профилируемых запросов поток не просыпается
+        time.sleep(settings.PROFILING_INTERVAL)
+        with _lock:
+            sessions = list(_sessions.values())
+        if not sessions:
+            continue
+        frames = sys._current_frames()
+        for session in sessions:
+            frame = frames.get(session.thread_id)
+            if frame is not None:
+                stack = collapse(frame, session.root)
+                if stack:
+                    session.stacks[stack] += 1
+
+
+def start(root):
+    global _sampler
+    session = Session(threading.get_ident(), root)
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=sample_loop, name='bboard-profiler', daemon=True)
+            _sampler.start()
+        _sessions[session.thread_id] = session
+        _active.set()
+    return session
+
+
+def stop(session):
+    with _lock:
+        _sessions.pop(session.thread_id, None)
+        if not _sessions:
+            _active.clear()
+    return session.stacks
+
+
+def profile_token(user):
+    """
+    Значение заголовка X-Bboard-Profile, включающего профилирование запросов сотрудника user.
+    """
+    return signing.TimestampSigner(salt=PROFILE_SALT).sign(str(user.pk))
+
+
+def has_valid_token(request):
+    # Заголовок действует, пока его владелец остаётся действующим сотрудником
+    token = request.META.get(PROFILE_HEADER)
+    if not token:
+        return False
+    try:
+        pk = signing.TimestampSigner(salt=PROFILE_SALT).unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return get_user_model().objects.filter(pk=pk, is_staff=True, is_active=True).exists()
+
+
+# Файлы профилей
+def profile_name(view_name):
+    # Имя контроллера "main:by_rubric" превращается в безопасное имя файла
+    return re.sub(r'[^\w.-]', '_', view_name)
+
+
+def profile_path(name):
+    return os.path.join(settings.PROFILES_DIR, profile_name(name) + PROFILE_EXTENSION)
+
+
+def read_profile(name):
+    stacks = Counter()
+    try:
+        with open(profile_path(name), encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack and count.isdigit():
+                    stacks[stack] += int(count)
+    except FileNotFoundError:
+        pass
+    return stacks
+
+
+def save_profile(view_name, stacks):
+    """
+    Добавляет стеки к профилю контроллера. Файл заменяется целиком, поэтому читатель
+    никогда не видит его недописанным.
+    """
+    if not stacks:
+        return
+    os.makedirs(settings.PROFILES_DIR, exist_ok=True)
+    with _files_lock:
+        total = read_profile(view_name)
+        total.update(stacks)
+        path = profile_path(view_name)
+        temp = '%s.%s.tmp' % (path, threading.get_ident())
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.writelines('%s %s\n' % (stack, count) for stack, count in total.most_common())
+        os.replace(temp, path)
+
+
+def list_profiles():
+    """
+    Возвращает список словарей (name, samples, modified) по файлам профилей, новые первыми.
+    """
+    profiles = []
+    try:
+        names = os.listdir(settings.PROFILES_DIR)
+    except FileNotFoundError:
+        return profiles
+    for filename in names:
+        if filename.endswith(PROFILE_EXTENSION):
+            name = filename[:-len(PROFILE_EXTENSION)]
+            path = os.path.join(settings.PROFILES_DIR, filename)
+            profiles.append({'name': name, 'samples': sum(read_profile(name).values()),
+                             'modified': os.path.getmtime(path)})
+    return sorted(profiles, key=lambda profile: -profile['modified'])
+
+
+def delete_profile(name):
+    try:
+        os.remove(profile_path(name))
+    except FileNotFoundError:
+        pass
+
+
+# Flame graph: ширина прямоугольника пропорциональна числу замеров, в которых кадр
+# присутствовал в стеке, вызываемые функции располагаются над вызывающими
+FRAME_HEIGHT = 16
+MIN_FRAME_WIDTH = 0.5
+CHAR_WIDTH = 7
+
+
+def build_tree(stacks):
+    tree = {'name': 'all', 'count': 0, 'children': {}}
+    for stack, count in stacks.items():
+        tree['count'] += count
+        node = tree
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'name': name, 'count': 0, 'children': {}})
+            node['count'] += count
+    return tree
+
+
+def frame_color(name):
+    # Цвет зависит только от имени кадра, поэтому одна функция одного цвета на всех профилях
+    digest = hashlib.md5(name.encode()).digest()
+    return 'rgb(%s,%s,%s)' % (205 + digest[0] % 50, 80 + digest[1] % 130, digest[2] % 55)
+
+
+def flamegraph_svg(stacks, width=1200):
+    tree = build_tree(stacks)
+    if not tree['count']:
+        return ''
+    rects = []
+    depth = 0
+    scale = width / tree['count']
+    pending = [(tree, 0.0, 0)]
+    while pending:
+        node, x, level = pending.pop()
+        node_width = node['count'] * scale
+        if node_width < MIN_FRAME_WIDTH:
+            continue
+        depth = max(depth, level)
+        rects.append((node, x, level, node_width))
+        child_x = x
+        for child in sorted(node['children'].values(), key=lambda child: child['name']):
+            pending.append((child, child_x, level + 1))
+            child_x += child['count'] * scale
+    height = (depth + 1) * FRAME_HEIGHT
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="%s" height="%s" font-family="monospace" '
+             'font-size="11">' % (width, height)]
+    for node, x, level, node_width in rects:
+        y = height - (level + 1) * FRAME_HEIGHT
+        title = '%s (%s, %.1f%%)' % (node['name'], node['count'], 100 * node['count'] / tree['count'])
+        label = node['name']
+        chars = int(node_width / CHAR_WIDTH) - 1
+        if len(label) > chars:
+            label = label[:chars - 2] + '..' if chars > 2 else ''
+        parts.append('<g><title>%s</title><rect x="%.1f" y="%s" width="%.1f" height="%s" fill="%s" rx="2"/>'
+                     '<text x="%.1f" y="%s">%s</text></g>' % (
+                         escape(title), x, y, node_width, FRAME_HEIGHT - 1, frame_color(node['name']),
+                         x + 3, y + FRAME_HEIGHT - 4, escape(label)))
+    parts.append('</svg>')
+    return ''.join(parts)
@@ -0,0 +1,66 @@
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.urls import reverse
+
+# Дерево рубрик для панели навигации: надрубрики с упорядоченными подрубриками.
+# Хранится в кэше по умолчанию под ключом с версией и дополнительно в памяти процесса,
+# поэтому в установившемся режиме вывод панели не выполняет ни одного запроса к БД.
+# Смена версии сразу видна всем процессам, только если кэш общий (main.checks). Версия
+# и дерево хранятся не дольше TREE_TIMEOUT, поэтому с кэшем в памяти процесса остальные
+# процессы видят изменения рубрик с задержкой не больше TREE_TIMEOUT.
+SuperRubricNode = namedtuple('SuperRubricNode', ('pk', 'name', 'sub_rubrics'))
+SubRubricNode = namedtuple('SubRubricNode', ('pk', 'name', 'url'))
+
+VERSION_KEY = 'rubric_tree:version'
+TREE_KEY = 'rubric_tree:%s'
+TREE_TIMEOUT = 60 * 5
+
+_local = {'version': None, 'tree': None}
+
+
+def build_rubric_tree():
+    from .models import SubRubric
+
+    tree = []
+    rubrics = SubRubric.objects.select_related('super_rubric')
+    for rubric in rubrics:
+        super_rubric = rubric.super_rubric
+        if not tree or tree[-1].pk != super_rubric.pk:
+            tree.append(SuperRubricNode(super_rubric.pk, super_rubric.name, []))
+        url = reverse('main:by_rubric', kwargs={'pk': rubric.pk})
+        tree[-1].sub_rubrics.append(SubRubricNode(rubric.pk, rubric.name, url))
+    return tree
+
+
+def get_rubric_tree():
+    """
+    Возвращает дерево рубрик. Сначала сверяет версию в кэше с копией в памяти процесса,
+    затем ищет дерево в кэше и только при промахе строит его по базе данных.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Версия истекла: add не заменит версию, записанную в это время другим процессом
+        version = time.time_ns()
+        if not cache.add(VERSION_KEY, version, TREE_TIMEOUT):
+            version = cache.get(VERSION_KEY, version)
+    if _local['version'] == version:
+        return _local['tree']
+    key = TREE_KEY % version
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_rubric_tree()
+        cache.set(key, tree, TREE_TIMEOUT)
+    _local['version'] = version
+    _local['tree'] = tree
+    return tree
+
+
+def invalidate_rubric_tree():
+    # Новая версия делает устаревшими дерево в кэше и копии деревьев в памяти процессов,
+    # которые читают этот кэш. Версия берётся из времени, чтобы после истечения или вытеснения
+    # ключа из кэша она не повторилась
+    version = time.time_ns()
+    cache.set(VERSION_KEY, version, TREE_TIMEOUT)
+    return version
@@ -0,0 +1,108 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .stemming import tokenize, normalize
+
+
+class IcontainsSearchBackend:
+    """
+    Простейший поиск по вхождению подстроки. Не требует индекса,
+    используется для СУБД без полнотекстового поиска.
+    """
+
+    def filter(self, queryset, keyword):
+        # Отбирает объявления по ключевому слову, не меняя их порядок
+        if not keyword:
+            return queryset
+        return queryset.filter(Q(title__icontains=keyword) | Q(content__icontains=keyword))
+
+    def rank(self, queryset, keyword):
+        # Отбирает объявления и упорядочивает их по релевантности
+        return self.filter(queryset, keyword)
+
+    def index(self, bbs):
+        pass
+
+    def remove(self, pks):
+        pass
+
+    def rebuild(self, queryset, batch_size=1000):
+        return 0
+
+
+class SQLiteFTSBackend(IcontainsSearchBackend):
+    """
+    Полнотекстовый поиск на виртуальной таблице SQLite FTS5 (см. миграцию 0005_bb_fts).
+    В таблице хранятся основы слов заголовка и описания, rowid совпадает с ключом объявления.
+    """
+    table = 'main_bb_fts'
+    weights = (10.0, 1.0)  # совпадение в заголовке важнее совпадения в описании
+
+    def match_expression(self, keyword):
+        # Основы слов запроса получаются так же, как при индексации (normalize), и ищутся
+        # как префиксы. Все слова запроса должны присутствовать, у слова с двумя основами -
+        # любая из них
+        return ' AND '.join(
+            '(%s)' % ' OR '.join('"%s"*' % stem.replace('"', '""') for stem in stems)
+            for stems in tokenize(keyword))
+
+    def filter(self, queryset, keyword):
+        match = self.match_expression(keyword or '')
+        if not match:
+            return queryset
+        sql = 'SELECT rowid FROM %s WHERE %s MATCH %%s' % (self.table, self.table)
+        return queryset.filter(pk__in=RawSQL(sql, (match,)))
+
+    def rank(self, queryset, keyword):
+        match = self.match_expression(keyword or '')
+        if not match:
+            return queryset
+        sql = '(SELECT bm25(%s, %s) FROM %s WHERE %s MATCH %%s AND %s.rowid = %s.id)' % (
+            self.table, ', '.join(map(str, self.weights)), self.table, self.table, self.table,
+            queryset.model._meta.db_table)
+        queryset = self.filter(queryset, keyword)
+        # bm25() возвращает тем меньшее значение, чем релевантнее запись
+        return queryset.annotate(search_rank=RawSQL(sql, (match,))).order_by('search_rank', '-created_at', '-pk')
+
+    def insert(self, bbs):
+        rows = [(bb.pk, normalize(bb.title), normalize(bb.content)) for bb in bbs]
+        with connection.cursor() as cursor:
+            cursor.executemany('INSERT INTO %s (rowid, title, content) VALUES (%%s, %%s, %%s)' % self.table, rows)
+
+    def index(self, bbs):
+        bbs = list(bbs)
+        self.remove([bb.pk for bb in bbs])
+        self.insert(bbs)
+
+    def remove(self, pks):
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % self.table, [(pk,) for pk in pks])
+
+    def rebuild(self, queryset, batch_size=1000):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % self.table)
+        count = 0
+        batch = []
+        for bb in queryset.only('pk', 'title', 'content').iterator(chunk_size=batch_size):
+            batch.append(bb)
+            if len(batch) == batch_size:
+                self.insert(batch)
+                count += len(batch)
+                batch = []
+        self.insert(batch)
+        count += len(batch)
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (self.table, self.table))
+        return count
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    default = 'main.search.SQLiteFTSBackend' if connection.vendor == 'sqlite' else \
+        'main.search.IcontainsSearchBackend'
+    return import_string(getattr(settings, 'SEARCH_BACKEND', default))()
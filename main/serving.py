@@ -0,0 +1,197 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+# Отдача статических и загруженных файлов самим сайтом, когда перед ним нет веб-сервера,
+# знающего о них (bboard.urls).
+# Статические файлы: имена с хэшем содержимого (ManifestStaticFilesStorage, main.storage)
+# кэшируются клиентами навсегда (immutable), сжатые при collectstatic копии .br/.gz
+# отдаются клиентам, которые их принимают.
+# Загруженные файлы: ETag и Last-Modified, запросы части файла (Range), а при MEDIA_SENDFILE
+# передача файла веб-серверу (X-Sendfile у Apache и lighttpd, X-Accel-Redirect у nginx).
+# Имена с хэшем содержимого (main.storage) тоже кэшируются навсегда
+IMMUTABLE = 'public, max-age=31536000, immutable'
+HASHED_STATIC_NAME = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+CONTENT_HASH = re.compile(r'(^|/)[0-9a-f]{64}[./]')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Сжатые копии в порядке предпочтения
+ENCODINGS = (('br', '.br', re.compile(r'\bbr\b')), ('gzip', '.gz', re.compile(r'\bgzip\b')))
+
+
+def file_etag(st):
+    return '"%x-%x"' % (st.st_mtime_ns, st.st_size)
+
+
+def byte_range(header, size):
+    """
+    Возвращает пару (начало, конец включительно) из заголовка Range, None, если заголовок
+    не задан или не поддерживается (несколько диапазонов), и False, если диапазон вне файла.
+    """
+    match = RANGE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        length = int(end)
+        return (max(0, size - length), size - 1) if length else False
+    start = int(start)
+    if end and int(end) < start:
+        return None  # синтаксически неверный диапазон игнорируется
+    if start >= size:
+        return False
+    return start, min(int(end), size - 1) if end else size - 1
+
+
+def if_range_passes(request, etag, mtime):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return parse_etags(if_range) == [etag]
+    return parse_http_date_safe(if_range) == int(mtime)
+
+
+class FileRange:
+    """
+    Часть файла f длиной length с позиции start: чтение останавливается на конце диапазона,
+    поэтому FileResponse отдаёт её блоками, не загружая в память целиком.
+    """
+
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self.file = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def file_response(filelike, response, length):
+    # Ответ FileResponse с заголовками и статусом response: содержимое читается блоками,
+    # а файл целиком под WSGI передаётся wsgi.file_wrapper (sendfile)
+    streamed = FileResponse(filelike, content_type=response['Content-Type'], status=response.status_code)
+    if 'Content-Disposition' in streamed:
+        del streamed['Content-Disposition']  # имя сжатой копии клиенту не нужно
+    for header, value in response.items():
+        if header != 'Content-Type':
+            streamed[header] = value
+    streamed['Content-Length'] = length
+    return streamed
+
+
+def serve_file(request, path, cache_control, encodings=False, ranges=False, sendfile=None):
+    """
+    Ответ с файлом path: заголовки кэширования, ответ 304 на условный запрос, при encodings -
+    сжатая копия файла, при ranges - часть файла, при sendfile - заголовок для веб-сервера
+    (пара (заголовок, значение)) вместо содержимого.
+    """
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        raise Http404('Файл не найден')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('Файл не найден')
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    encoding = None
+    if encodings:
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        for name, suffix, accepts in ENCODINGS:
+            if accepts.search(accept_encoding) and os.path.exists(path + suffix):
+                encoding = name
+                path += suffix
+                st = os.stat(path)
+                break
+
+    response = HttpResponse(content_type=content_type)
+    etag = file_etag(st)
+    if encoding:
+        etag = etag[:-1] + '-%s"' % encoding  # у каждой сжатой копии свой ETag
+        response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(st.st_mtime)
+    response['Cache-Control'] = cache_control
+    if encodings:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    if ranges:
+        response['Accept-Ranges'] = 'bytes'
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime), response=response)
+    if conditional is not response:
+        return conditional
+
+    if sendfile:
+        # Содержимое, диапазоны и условия запроса обрабатывает веб-сервер
+        response[sendfile[0]] = sendfile[1]
+        return response
+
+    requested = byte_range(request.META.get('HTTP_RANGE', ''), st.st_size) \
+        if ranges and if_range_passes(request, etag, st.st_mtime) else None
+    if requested is False:
+        response.status_code = 416
+        response['Content-Range'] = 'bytes */%d' % st.st_size
+        return response
+    if requested:
+        start, end = requested
+        response.status_code = 206
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, st.st_size)
+        if request.method == 'HEAD':
+            response['Content-Length'] = end - start + 1
+            return response
+        return file_response(FileRange(open(path, 'rb'), start, end - start + 1), response, end - start + 1)
+
+    if request.method == 'HEAD':
+        response['Content-Length'] = st.st_size
+        return response
+    return file_response(open(path, 'rb'), response, st.st_size)
+
+
+@require_safe
+def static_file(request, path):
+    if settings.DEBUG or not os.path.isdir(settings.STATIC_ROOT or ''):
+        # При разработке - из каталогов static приложений, без хэшей в именах
+        full_path = finders.find(path)
+        if not full_path:
+            raise Http404('Файл не найден')
+        return serve_file(request, full_path, 'no-cache', encodings=True)
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    cache_control = IMMUTABLE if HASHED_STATIC_NAME.search(path) else 'public, max-age=%d' % settings.STATIC_MAX_AGE
+    return serve_file(request, full_path, cache_control, encodings=True)
+
+
+@require_safe
+def media_file(request, path):
+    # Служебные файлы хранилища (отметки CLAIMS_DIR, временные .upload-*, main.storage)
+    # и прочие скрытые файлы не отдаются
+    if any(part.startswith('.') for part in path.split('/')):
+        raise Http404('Файл не найден')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    cache_control = IMMUTABLE if CONTENT_HASH.search(path) else 'public, max-age=%d' % settings.MEDIA_MAX_AGE
+    sendfile = None
+    if settings.MEDIA_SENDFILE == 'x-sendfile':
+        sendfile = ('X-Sendfile', full_path)
+    elif settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        sendfile = ('X-Accel-Redirect', quote(settings.MEDIA_ACCEL_REDIRECT_PREFIX + path))
+    return serve_file(request, full_path, cache_control, ranges=True, sendfile=sendfile)
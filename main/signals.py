@@ -0,0 +1,132 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django_cleanup.signals import cleanup_post_delete
+from django.utils import timezone
+
+from .cards import invalidate_card
+from .counters import comment_added, comment_removed
+from .deletion import bbs_deleted
+from .events import publish_comment
+from .images import enqueue_image, delete_variants
+from .instrumentation import install_execute_wrapper
+from .models import Rubric, SuperRubric, SubRubric, Bb, AdditionalImage, Comment
+from .rubrics import invalidate_rubric_tree
+from .search import get_search_backend
+from .versions import bump
+
+
+# Замеры запросов и их лимиты (main.instrumentation.execute_wrapper) действуют на всех соединениях
+@receiver(connection_created)
+def connection_created_dispatcher(sender, connection, **kwargs):
+    install_execute_wrapper(connection)
+
+
+# Прокси-модели отправляют сигналы от своего имени, поэтому подписываемся на все три класса
+@receiver(post_save, sender=Rubric)
+@receiver(post_save, sender=SuperRubric)
+@receiver(post_save, sender=SubRubric)
+@receiver(post_delete, sender=Rubric)
+@receiver(post_delete, sender=SuperRubric)
+@receiver(post_delete, sender=SubRubric)
+def rubric_changed_dispatcher(sender, **kwargs):
+    invalidate_rubric_tree()
+    bump('rubrics')
+
+
+# Поисковый индекс пишется в той же транзакции, что и само объявление
+@receiver(post_save, sender=Bb)
+def bb_saved_dispatcher(sender, instance, **kwargs):
+    get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=Bb)
+def bb_deleted_dispatcher(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+    invalidate_card(instance)
+
+
+# Версии для условных запросов (main.versions). При переносе объявления в другую рубрику
+# меняются обе рубрики, поэтому прежняя рубрика запоминается перед сохранением
+@receiver(pre_save, sender=Bb)
+def bb_pre_save_dispatcher(sender, instance, **kwargs):
+    if instance.pk:
+        instance._old_rubric_id = Bb.objects.filter(pk=instance.pk).values_list('rubric_id', flat=True).first()
+
+
+@receiver(post_save, sender=Bb)
+@receiver(post_delete, sender=Bb)
+def bb_version_dispatcher(sender, instance, **kwargs):
+    rubric_ids = {instance.rubric_id, getattr(instance, '_old_rubric_id', None)} - {None}
+    bump('index', 'bb:%s' % instance.pk, *['rubric:%s' % pk for pk in rubric_ids])
+
+
+# Пакетное удаление (main.deletion) не отправляет post_delete. Карточки удалённых объявлений
+# в кэше больше не запрашиваются и вытесняются по истечении срока
+@receiver(bbs_deleted, sender=Bb)
+def bbs_deleted_dispatcher(sender, ids, rubric_ids, **kwargs):
+    get_search_backend().remove(ids)
+    bump('index', *['rubric:%s' % pk for pk in rubric_ids], *['bb:%s' % pk for pk in ids])
+
+
+# Изменение иллюстраций меняет версию объявления, а с ней и ключ его карточки в кэше
+@receiver(post_save, sender=AdditionalImage)
+@receiver(post_delete, sender=AdditionalImage)
+def additional_image_changed_dispatcher(sender, instance, **kwargs):
+    Bb.objects.filter(pk=instance.bb_id).update(updated_at=timezone.now())
+    bump('bb:%s' % instance.bb_id)
+
+
+# Счётчики комментариев объявления (main.counters). Учитываются только активные комментарии,
+# поэтому перед сохранением запоминается, был ли комментарий активным
+@receiver(pre_save, sender=Comment)
+def comment_pre_save_dispatcher(sender, instance, **kwargs):
+    instance._old_is_active = False
+    if instance.pk:
+        instance._old_is_active = Comment.objects.filter(pk=instance.pk, is_active=True).exists()
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved_dispatcher(sender, instance, **kwargs):
+    was_active = getattr(instance, '_old_is_active', False)
+    if instance.is_active and not was_active:
+        comment_added(instance.bb_id, instance.created_at)
+        publish_comment(instance)
+    elif was_active and not instance.is_active:
+        comment_removed(instance.bb_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted_dispatcher(sender, instance, **kwargs):
+    if instance.is_active:
+        comment_removed(instance.bb_id)
+
+
+# Число комментариев выводится в карточках, поэтому меняются и списки объявлений
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed_dispatcher(sender, instance, **kwargs):
+    # объявление обычно уже загружено формой или сериализатором при проверке поля bb
+    if Comment.bb.is_cached(instance):
+        rubric_id = instance.bb.rubric_id
+    else:
+        rubric_id = Bb.objects.filter(pk=instance.bb_id).values_list('rubric_id', flat=True).first()
+    bump('index', 'bb:%s' % instance.bb_id, *(['rubric:%s' % rubric_id] if rubric_id else []))
+
+
+# Загруженные изображения (из профиля, из администрирования) обрабатываются, а их миниатюры
+# создаются фоновыми заданиями (main.images). Задание пишется в той же транзакции, что и запись,
+# поэтому не теряется и не выполняется для отменённой записи
+@receiver(post_save, sender=Bb)
+@receiver(post_save, sender=AdditionalImage)
+def image_saved_dispatcher(sender, instance, **kwargs):
+    if instance.image:
+        enqueue_image(instance.image.name)
+
+
+# django_cleanup удаляет заменённый или освободившийся файл, а уменьшенные копии - здесь.
+# Файл, который используют и другие записи, хранилище (main.storage) не удаляет
+@receiver(cleanup_post_delete)
+def image_file_deleted_dispatcher(sender, file_name, file, success, **kwargs):
+    if success and not file.storage.exists(file_name):
+        delete_variants(file_name)
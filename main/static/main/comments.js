@@ -0,0 +1,41 @@
+// Новые комментарии объявления появляются без перезагрузки страницы (поток main.events)
+(function () {
+    var list = document.getElementById('comments');
+    if (!list || !window.EventSource) {
+        return;
+    }
+    var url = list.dataset.eventsUrl;
+    // Комментарии, добавленные после формирования страницы, досылаются при подключении
+    if (list.dataset.lastEventId) {
+        url += '?last_event_id=' + encodeURIComponent(list.dataset.lastEventId);
+    }
+    var source = new EventSource(url);
+
+    function paragraph(text, className) {
+        var element = document.createElement('p');
+        element.className = className || '';
+        element.textContent = text;
+        return element;
+    }
+
+    source.addEventListener('comment', function (event) {
+        var comment = JSON.parse(event.data);
+        if (document.getElementById('comment-' + comment.id)) {
+            return;
+        }
+        var item = document.createElement('div');
+        item.className = 'my-2 p-2 border';
+        item.id = 'comment-' + comment.id;
+        var author = document.createElement('h5');
+        author.textContent = comment.author;
+        item.appendChild(author);
+        item.appendChild(paragraph(comment.content));
+        item.appendChild(paragraph(new Date(comment.created_at).toLocaleString(), 'text-right font-italic'));
+        list.appendChild(item);
+    });
+    // Пропущено слишком много комментариев
+    source.addEventListener('reload', function () {
+        source.close();
+        window.location.reload();
+    });
+})();
@@ -0,0 +1,73 @@
+import re
+
+# Стеммер Портера для русского языка. Применяется и к тексту объявлений при индексации,
+# и к ключевым словам при поиске (word_stems), поэтому "автомобиль" найдёт "автомобили".
+PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+REFLEXIVE = re.compile(r'(с[яь])$')
+ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+VERB = re.compile(r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|'
+                  r'ыть|ишь|ую|ю)|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$')
+NOUN = re.compile(r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|'
+                  r'ью|ю|ия|ья|я)$')
+RV = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+DERIVATIONAL = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя]+[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+DER = re.compile(r'ость?$')
+SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+I = re.compile(r'и$')
+P = re.compile(r'ь$')
+NN = re.compile(r'нн$')
+
+WORD = re.compile(r'\w+')
+
+
+def stem(word, verbs=True):
+    # При verbs=False окончание слова не считается глагольным
+    word = word.lower().replace('ё', 'е')
+    m = RV.match(word)
+    if not m:
+        return word  # слова без русских гласных (латиница, числа) оставляем как есть
+    start, rv = m.groups()
+    temp = PERFECTIVE_GERUND.sub('', rv, 1)
+    if temp == rv:
+        rv = REFLEXIVE.sub('', rv, 1)
+        temp = ADJECTIVE.sub('', rv, 1)
+        if temp != rv:
+            rv = PARTICIPLE.sub('', temp, 1)
+        else:
+            temp = VERB.sub('', rv, 1) if verbs else rv
+            rv = NOUN.sub('', rv, 1) if temp == rv else temp
+    else:
+        rv = temp
+    rv = I.sub('', rv, 1)
+    if DERIVATIONAL.match(rv):
+        rv = DER.sub('', rv, 1)
+    temp = P.sub('', rv, 1)
+    if temp == rv:
+        rv = SUPERLATIVE.sub('', rv, 1)
+        rv = NN.sub('н', rv, 1)
+    else:
+        rv = temp
+    return start + rv
+
+
+def word_stems(word):
+    """
+    Основы слова. Окончание может быть и глагольным, и окончанием существительного
+    ("купили" и "автомобили"), тогда у слова две основы: "автомоб" и "автомобил".
+    """
+    stems = [stem(word)]
+    noun = stem(word, verbs=False)
+    if noun != stems[0]:
+        stems.append(noun)
+    return stems
+
+
+def tokenize(text):
+    # Разбивает текст на слова и возвращает списки их основ
+    return [word_stems(word) for word in WORD.findall(text.lower())]
+
+
+def normalize(text):
+    # Текст в том виде, в котором он хранится в поисковом индексе: все основы всех слов
+    return ' '.join(' '.join(stems) for stems in tokenize(text))
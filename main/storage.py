@@ -0,0 +1,164 @@
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.utils.deconstruct import deconstructible
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Хранилище загруженных файлов с именами по содержимому: файл сохраняется как
+# [каталог/]ab/cd/<sha256>.<расширение>, где каталог берётся из предложенного имени, а хэш
+# вычисляется при копировании загрузки, без повторного чтения. Одинаковые файлы хранятся
+# в одном экземпляре, поэтому и миниатюры (они привязаны к имени исходного файла) создаются
+# для них один раз. Файл удаляется, только когда на него не ссылается ни одно поле FileField:
+# django_cleanup и задание delete_files удаляют файл объявления, не зная о его копиях.
+# Проверка наличия файла в _save и проверка ссылок с удалением в delete выполняются под одной
+# блокировкой (в процессе - threading.Lock, между процессами - flock файла CLAIMS_DIR/.lock).
+# Запись, которая сошлётся на уже имеющийся файл, сохраняется после _save, поэтому _save
+# отмечает такой файл в CLAIMS_DIR, а delete в течение MEDIA_DELETE_GRACE секунд после отметки
+# не удаляет файл, а откладывает удаление заданием delete_files
+CONTENT_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+CLAIMS_DIR = '.claims'
+
+
+def content_name(directory, digest, extension):
+    return '/'.join(part for part in (directory, digest[:2], digest[2:4], digest + extension) if part)
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_NAME.search(name))
+
+
+_lock = threading.Lock()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым в _save, совпадение имён означает совпадение файлов
+        return name
+
+    def claim_path(self, name):
+        return os.path.join(self.location, CLAIMS_DIR, os.path.normpath(name))
+
+    @contextmanager
+    def lock(self):
+        os.makedirs(os.path.join(self.location, CLAIMS_DIR), exist_ok=True)
+        with _lock, open(os.path.join(self.location, CLAIMS_DIR, '.lock'), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # снимается при закрытии файла
+            yield
+
+    def _save(self, name, content):
+        directory, basename = os.path.split(name)
+        extension = os.path.splitext(basename)[1].lower()
+        os.makedirs(self.location, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temporary = tempfile.mkstemp(dir=self.location, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+            name = content_name(directory.replace('\\', '/'), digest.hexdigest(), extension)
+            path = self.path(name)
+            with self.lock():
+                if os.path.exists(path):
+                    # Такой файл уже есть: отметка не даст delete удалить его, пока сохраняется запись
+                    claim = self.claim_path(name)
+                    os.makedirs(os.path.dirname(claim), exist_ok=True)
+                    with open(claim, 'a'):
+                        pass
+                    os.utime(claim)
+                    return name
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.chmod(temporary, self.file_permissions_mode if self.file_permissions_mode is not None else 0o644)
+                # Замена атомарна: одновременная загрузка того же файла запишет то же содержимое
+                os.replace(temporary, path)
+            return name
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def is_referenced(self, name):
+        for model in apps.get_models():
+            if model._meta.proxy:
+                continue
+            for field in model._meta.concrete_fields:
+                if isinstance(field, models.FileField) and \
+                        model._default_manager.filter(**{field.name: name}).exists():
+                    return True
+        return False
+
+    def delete(self, name):
+        if not name:
+            return
+        from .jobs import enqueue  # хранилище создаётся до загрузки моделей
+        with self.lock():
+            if self.is_referenced(name):
+                return
+            claim = self.claim_path(name)
+            if os.path.exists(claim):
+                claimed_until = os.path.getmtime(claim) + settings.MEDIA_DELETE_GRACE
+                if claimed_until > time.time():
+                    enqueue('delete_files', {'names': [name]},
+                            run_at=datetime.fromtimestamp(claimed_until, timezone.utc))
+                    return
+                os.remove(claim)
+            super().delete(name)
+
+
+# Статические файлы: имена с хэшем содержимого (ManifestStaticFilesStorage) и сжатые копии
+# <имя>.gz и, если установлен пакет brotli, <имя>.br, которые collectstatic записывает рядом
+# с текстовыми файлами. Их отдаёт main.serving, не сжимая ответ при каждом запросе
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.mjs', '.map', '.svg', '.html', '.txt', '.json', '.xml', '.ico',
+                           '.ttf', '.otf', '.eot')
+MIN_COMPRESSED_SIZE = 256  # меньшие файлы сжатие почти не уменьшает
+
+
+def compress(data):
+    yield '.gz', gzip.compress(data, 9, mtime=0)
+    if brotli is not None:
+        yield '.br', brotli.compress(data, quality=11)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(paths) | set(self.hashed_files.values())):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                self.save_compressed(name)
+
+    def save_compressed(self, name):
+        with self.open(name) as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESSED_SIZE:
+            return
+        for suffix, compressed in compress(data):
+            self.delete(name + suffix)
+            if len(compressed) < len(data):
+                self._save(name + suffix, ContentFile(compressed))
@@ -0,0 +1,53 @@
+from bootstrap4.templatetags.bootstrap4 import bootstrap_css, bootstrap_javascript
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from .. import events
+from ..cards import render_cards
+from ..images import image_srcset
+from ..vendor import local_url
+from ..thumbnails import get_thumbnail_url
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def bb_cards(context, bbs):
+    # Карточки объявлений из кэша; GET-параметры для ссылок берутся из контекстного процессора
+    return mark_safe(''.join(render_cards(bbs, context.get('all', ''))))
+
+
+@register.simple_tag
+def thumbnail_or_empty(image, alias='default'):
+    # Адрес готовой миниатюры или заглушки, пока миниатюра создаётся в фоне
+    return get_thumbnail_url(image, alias) or static('main/empty.jpg')
+
+
+@register.simple_tag
+def srcset(image, sizes):
+    # Атрибуты srcset и sizes обработанного изображения (main.images) или ничего
+    value = image_srcset(image)
+    return format_html(' srcset="{}" sizes="{}"', value, sizes) if value else ''
+
+
+@register.simple_tag
+def vendor_css():
+    # Bootstrap из static сайта (main.vendor), пока файлы не скачаны - из CDN, как bootstrap_css
+    url = local_url('css_url')
+    return format_html('<link rel="stylesheet" href="{}">', url) if url else bootstrap_css()
+
+
+@register.simple_tag
+def vendor_javascript():
+    urls = [local_url('jquery_slim_url'), local_url('javascript_url')]
+    if not all(urls):
+        return bootstrap_javascript(jquery='slim')
+    return format_html_join('\n', '<script src="{}"></script>', ((url,) for url in urls))
+
+
+@register.filter
+def event_id(comment):
+    # Идентификатор события потока комментариев (main.events) для продолжения с этого комментария
+    return events.event_id(comment)
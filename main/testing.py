@@ -0,0 +1,34 @@
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from .models import AdvUser, SuperRubric, SubRubric
+
+
+class BoardTestCase(TestCase):
+    """
+    Тест с рубрикой "Велосипеды" надрубрики "Транспорт" и пользователем seller.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.super_rubric = SuperRubric.objects.create(name='Транспорт')
+        cls.rubric = SubRubric.objects.create(name='Велосипеды', super_rubric=cls.super_rubric)
+        cls.user = AdvUser.objects.create_user(username='seller', password='password')
+
+
+class TemporaryFilesMixin:
+    """
+    Временные каталоги, удаляемые после теста.
+    """
+
+    def temporary_directory(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        return path
+
+    def use_temporary_media(self, **settings):
+        # Загруженные файлы - во временном каталоге self.media_root до конца теста
+        self.media_root = self.temporary_directory()
+        self.enterContext(self.settings(MEDIA_ROOT=self.media_root, **settings))
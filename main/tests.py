@@ -1,3 +1,1749 @@
-from django.test import TestCase
+import asyncio
+import base64
+import contextvars
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.staticfiles import finders
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, FileSystemStorage
+from django.core.management import call_command, CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import get_connection
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection, connections, OperationalError
+from django.http import FileResponse, HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, AsyncClient, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+
+from bboard import urls as project_urls
+from bboard.asgi import application as asgi_application
+from bboard.database import PRAGMAS
+from bboard.routers import _unavailable
+
+from .deletion import bbs_deleted
+from .images import is_processed, process_image, replace_original, variant_name
+from .importer import import_bbs, check_public_url, PublicRedirectHandler
+from .rubrics import get_rubric_tree
+from .search import get_search_backend, IcontainsSearchBackend, SQLiteFTSBackend
+from .stemming import stem, word_stems, tokenize, normalize
+from .storage import is_content_addressed, CLAIMS_DIR
+from .thumbnails import create_thumbnails, enqueue_thumbnails, generate_thumbnails, get_thumbnail_url
+from .testing import BoardTestCase, TemporaryFilesMixin
+from .instrumentation import histograms, reset_histograms, execute_wrapper, InstrumentedCache
+from .decorators import query_budget, QueryBudgetExceeded, QueryCounter, conditional
+from .jobs import register, run_pending, handlers
+from .models import AdvUser, SuperRubric, SubRubric, Bb, AdditionalImage, Comment, Job, DeadJob
+from .pagecache import LOCK_KEY, page_key
+from .cards import ALL_PLACEHOLDER, LISTING_FIELDS, card_key, invalidate_card, render_cards
+from .counters import repair_counters
+from .pagination import KeysetPaginator, InvalidCursor, BB_ORDERINGS
+from . import async_views, checks, events, instrumentation, profiling, rubrics, vendor
+from .management.commands.benchmark_asgi import serve_asgi, generate_load, free_port
+
+# Адреса асинхронных контроллеров (ASYNC_VIEWS) для AsyncViewsTests перекрывают
+# одноимённые адреса проекта, имена для reverse берутся из bboard.urls
+urlpatterns = [
+    path('<int:rubric_pk>/<int:pk>', async_views.detail),
+    path('<int:pk>/', async_views.by_rubric),
+    path('', async_views.index),
+] + project_urls.urlpatterns
+
+# Полный просмотр таблицы или сортировка во временном B-дереве в плане запроса
+BAD_PLAN = re.compile(r'^SCAN main_\w+$|TEMP B-TREE')
+
+
+class StemmerTests(SimpleTestCase):
+    def test_stem(self):
+        self.assertEqual(stem('квартиры'), 'квартир')
+        self.assertEqual(stem('Ёлки'), 'елк')
+        self.assertEqual(stem('iphone'), 'iphone')
+        self.assertEqual(stem('2024'), '2024')
+
+    def test_word_stems(self):
+        # глагольное окончание "или" - у существительного окончание "и"
+        self.assertEqual(word_stems('автомобили'), ['автомоб', 'автомобил'])
+        self.assertEqual(word_stems('автомобиль'), ['автомобил'])
+        self.assertEqual(tokenize('Продам автомобили!'), [['прод'], ['автомоб', 'автомобил']])
+        self.assertEqual(normalize('Продам автомобили!'), 'прод автомоб автомобил')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Полнотекстовый индекс есть только в SQLite')
+class SearchTests(BoardTestCase):
+    """
+    Поиск по основам слов: форма слова в запросе не обязана совпадать с формой в объявлении.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.cars = Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Автомобили в аренду',
+                                     content='Посуточно', contacts='-')
+        cls.car = Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Продам велосипед',
+                                    content='Или обменяю на автомобиль', contacts='-')
+        cls.flat = Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Квартира', content='Без мебели',
+                                     contacts='-')
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, keyword):
+        return list(get_search_backend().rank(Bb.objects.all(), keyword))
+
+    def test_word_forms(self):
+        self.assertIsInstance(get_search_backend(), SQLiteFTSBackend)
+        for keyword in ('автомобиль', 'автомобили', 'АВТОМОБИЛЯМИ', 'автомоб'):
+            self.assertEqual(set(self.search(keyword)), {self.cars, self.car}, keyword)
+        self.assertEqual(self.search('квартиры'), [self.flat])
+        self.assertEqual(self.search('квартира мебель'), [self.flat])
+        self.assertEqual(self.search('квартира автомобиль'), [])
+
+    def test_rank(self):
+        # совпадение в заголовке важнее совпадения в описании
+        self.assertEqual(self.search('автомобиль'), [self.cars, self.car])
+        bbs = Bb.objects.filter(is_active=True)
+        self.assertEqual(get_search_backend().filter(bbs, ''), bbs)
+        self.assertEqual(list(get_search_backend().filter(bbs, 'велосипеды')), [self.car])
+
+    def test_index_follows_changes(self):
+        self.flat.title = 'Комната'
+        self.flat.save()
+        self.assertEqual(self.search('квартира'), [])
+        self.assertEqual(self.search('комнаты'), [self.flat])
+        self.cars.delete()
+        self.assertEqual(self.search('автомобили'), [self.car])
+        self.assertEqual(self.client.get('/', {'keyword': 'комнату'}).context['bbs'][0], self.flat)
+        self.assertEqual(get_search_backend().rebuild(Bb.objects.all()), 2)
+        self.assertEqual(self.search('автомобили'), [self.car])
+
+    def test_icontains_backend(self):
+        backend = IcontainsSearchBackend()
+        self.assertEqual(list(backend.rank(Bb.objects.all(), 'Квартир')), [self.flat])
+
+
+class KeysetPaginatorTests(BoardTestCase):
+    """
+    Курсоры страниц: кодирование, ошибочные курсоры, переходы вперёд и назад при равных
+    значениях полей сортировки и при NULL в last_comment_at.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        Bb.objects.bulk_create([
+            Bb(rubric=cls.rubric, author=cls.user, title='Товар %s' % i, content='-', contacts='-',
+               comment_count=i % 3, last_comment_at=now - timedelta(hours=i % 4) if i % 2 else None)
+            for i in range(11)
+        ])
+        # у всех объявлений одно время публикации, порядок задаёт только ключ
+        Bb.objects.update(created_at=now)
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, paginator):
+        # Проходит страницы вперёд по next_cursor, затем назад по previous_cursor
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        forward = [[bb.pk for bb in page] for page in pages]
+        backward = [forward[-1]]
+        page = pages[-1]
+        while page.has_previous():
+            page = paginator.get_page(page.previous_cursor)
+            backward.insert(0, [bb.pk for bb in page])
+        self.assertFalse(pages[0].has_previous())
+        return forward, backward
+
+    def test_pages(self):
+        for ordering in BB_ORDERINGS.values():
+            with self.subTest(ordering=ordering):
+                paginator = KeysetPaginator(Bb.objects.all(), 3, ordering)
+                forward, backward = self.walk(paginator)
+                expected = list(Bb.objects.order_by(*ordering).values_list('pk', flat=True))
+                self.assertEqual(sum(forward, []), expected)
+                self.assertEqual(forward, backward)
+                self.assertEqual([len(ids) for ids in forward], [3, 3, 3, 2])
+                self.assertEqual(paginator.count, 11)
+
+    def test_nullable_ordering(self):
+        ordering = BB_ORDERINGS['active']
+        paginator = KeysetPaginator(Bb.objects.all(), 2, ordering)
+        self.assertEqual(paginator.nullable, {'last_comment_at'})
+        forward, backward = self.walk(paginator)
+        bbs = sorted(Bb.objects.all(), key=lambda bb: (bb.last_comment_at is not None, bb.last_comment_at, bb.pk),
+                     reverse=True)
+        self.assertEqual(sum(forward, []), [bb.pk for bb in bbs])
+        self.assertEqual(forward, backward)
+        self.assertIsNone(bbs[-1].last_comment_at)
+        # курсор с NULL
+        token = paginator.encode_cursor('n', bbs[-3])
+        self.assertEqual(paginator.decode_cursor(token), ('n', [None, bbs[-3].pk]))
+        self.assertEqual([bb.pk for bb in paginator.get_page(token)], [bb.pk for bb in bbs[-2:]])
+
+    def test_cursor(self):
+        paginator = KeysetPaginator(Bb.objects.all(), 3)
+        bb = Bb.objects.first()
+        token = paginator.encode_cursor('p', bb)
+        self.assertRegex(token, r'^[\w-]+$')
+        self.assertEqual(paginator.decode_cursor(token), ('p', [bb.created_at, bb.pk]))
+        row = Bb.objects.values('created_at', 'pk').first()
+        self.assertEqual(paginator.encode_cursor('p', row), token)
+
+    def test_invalid_cursors(self):
+        paginator = KeysetPaginator(Bb.objects.all(), 3)
+        first = [bb.pk for bb in paginator.get_page()]
+
+        def cursor(*data):
+            return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+        for token in ('мусор', '!!', cursor('x', '2024-01-01T00:00:00', 1), cursor('n', '2024-01-01T00:00:00'),
+                      cursor('n', 'вчера', 1), cursor('n', None, 1), cursor('n', '2024-01-01T00:00:00', 'a'),
+                      cursor({}), cursor()):
+            with self.subTest(token=token):
+                with self.assertRaises(InvalidCursor):
+                    paginator.decode_cursor(token)
+                page = paginator.get_page(token)
+                self.assertEqual([bb.pk for bb in page], first)
+                self.assertFalse(page.has_previous())
+
+    def test_page_numbers(self):
+        # номера страниц из старых ссылок
+        paginator = KeysetPaginator(Bb.objects.all(), 3)
+        forward, backward = self.walk(paginator)
+        self.assertEqual([bb.pk for bb in paginator.get_page('1')], forward[0])
+        page = paginator.get_page('3')
+        self.assertEqual([bb.pk for bb in page], forward[2])
+        self.assertTrue(page.has_previous())
+        self.assertEqual([bb.pk for bb in paginator.get_page(page.next_cursor)], forward[3])
+        self.assertEqual(list(paginator.get_page('100')), [])
+
+    def test_listing_count(self):
+        # COUNT по рубрике выполняется только для первой страницы без поиска
+        url = '/%s/' % self.rubric.pk
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertContains(response, 'Объявлений: 11')
+        self.assertEqual(len([query for query in context if 'COUNT(' in query['sql']]), 1)
+        for url in ('%s?page=%s' % (url, response.context['page'].next_cursor), url + '?keyword=Товар'):
+            with self.subTest(url=url), CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+                self.assertNotContains(response, 'Объявлений:')
+                self.assertFalse([query for query in context if 'COUNT(' in query['sql']])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN есть только в SQLite')
+class QueryPlanTests(BoardTestCase):
+    """
+    Проверяет, что самые частые выборки списков используют индексы,
+    а не просматривают таблицы целиком и не сортируют результат.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.rubrics = [cls.rubric] + [SubRubric.objects.create(name='Рубрика %s' % i, super_rubric=cls.super_rubric)
+                                      for i in range(1, 5)]
+        Bb.objects.bulk_create([
+            Bb(rubric=cls.rubrics[i % 5], author=cls.user, title='Товар %s' % i, content='Описание', contacts='-',
+               is_active=i % 7 != 0)
+            for i in range(500)
+        ])
+        cls.bb = Bb.objects.filter(is_active=True).first()
+        Comment.objects.bulk_create([
+            Comment(bb=cls.bb, author='Гость', content='Комментарий', is_active=i % 3 != 0) for i in range(50)
+        ])
+
+    def setUp(self):
+        cache.clear()  # количество записей пагинатора кэшируется
+
+    def assertIndexedQueries(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        self.assertTrue(context.captured_queries)
+        for query in context.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = [row[3] for row in cursor.fetchall()]
+            for step in plan:
+                self.assertIsNone(BAD_PLAN.search(step), '%s\n%s' % (query['sql'], '\n'.join(plan)))
+
+    def test_index_listing(self):
+        self.assertIndexedQueries(lambda: list(Bb.objects.filter(is_active=True)[:10]))
+
+    def test_rubric_listing(self):
+        paginator = KeysetPaginator(Bb.objects.filter(is_active=True, rubric=self.rubrics[0].pk), 2)
+        page = paginator.get_page()
+        self.assertIndexedQueries(lambda: paginator.get_page(page.next_cursor))
+        self.assertIndexedQueries(lambda: paginator.get_page(paginator.get_page(page.next_cursor).previous_cursor))
+        self.assertIndexedQueries(lambda: paginator.count)
+
+    def test_sorted_rubric_listing(self):
+        for ordering in (BB_ORDERINGS['discussed'], BB_ORDERINGS['active']):
+            paginator = KeysetPaginator(Bb.objects.filter(is_active=True, rubric=self.rubrics[0].pk), 2, ordering)
+            self.assertIndexedQueries(lambda: paginator.get_page(paginator.get_page().next_cursor))
+
+    def test_profile_listing(self):
+        paginator = KeysetPaginator(Bb.objects.filter(author=self.user.pk), 10)
+        self.assertIndexedQueries(lambda: paginator.get_page(paginator.get_page().next_cursor))
+
+    def test_detail_comments(self):
+        self.assertIndexedQueries(lambda: list(Comment.objects.filter(bb=self.bb.pk, is_active=True)))
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class QueryBudgetTests(BoardTestCase):
+    """
+    Контроллеры отмечены декоратором query_budget. Объявление с множеством иллюстраций
+    и комментариев не должно увеличивать число запросов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.bb = Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Велосипед', content='Горный',
+                                   contacts='-')
+        AdditionalImage.objects.bulk_create([AdditionalImage(bb=cls.bb, image='%s.jpg' % i) for i in range(10)])
+        Comment.objects.bulk_create([Comment(bb=cls.bb, author='Гость', content='Торг?') for i in range(10)])
+
+    def test_public_pages(self):
+        for url in ('/', '/%s/' % self.rubric.pk, '/%s/?keyword=велосипед' % self.rubric.pk,
+                    '/%s/%s' % (self.rubric.pk, self.bb.pk)):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+    def test_authenticated_pages(self):
+        self.client.force_login(self.user)
+        for url in ('/', '/%s/%s' % (self.rubric.pk, self.bb.pk), '/accounts/profile/',
+                    '/accounts/profile/%s' % self.bb.pk):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+    def test_comment_is_shown_after_post(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/%s/%s' % (self.rubric.pk, self.bb.pk),
+                                    {'bb': self.bb.pk, 'author': 'seller', 'content': 'Продано'})
+        self.assertContains(response, 'Продано')
+
+    def test_budget_exceeded(self):
+        @query_budget(1)
+        def view(request):
+            list(Bb.objects.all())
+            list(Comment.objects.all())
+            return HttpResponse()
+
+        with self.assertRaises(QueryBudgetExceeded):
+            view(RequestFactory().get('/'))
+
+
+class CardCacheTests(BoardTestCase):
+    """
+    Карточки объявлений в списках берутся из кэша, пока не изменится объявление
+    или его иллюстрации.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.bb = Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Велосипед', content='Горный',
+                                   contacts='-')
+
+    def setUp(self):
+        cache.clear()
+
+    def listing(self):
+        # как в контроллерах списков: остальные поля берутся из кэша карточек
+        return list(Bb.objects.only(*LISTING_FIELDS))
+
+    def test_cached(self):
+        html, = render_cards(self.listing(), '?sort=new&page=2')
+        self.assertIn('Горный', html)
+        self.assertIn('href="/%s/%s?sort=new&amp;page=2"' % (self.rubric.pk, self.bb.pk), html)
+        # в кэше карточка без GET-параметров
+        self.assertIn(ALL_PLACEHOLDER, cache.get(card_key(self.bb)))
+        bbs = self.listing()
+        with self.assertNumQueries(0):
+            html, = render_cards(bbs)
+        self.assertIn('href="/%s/%s"' % (self.rubric.pk, self.bb.pk), html)
+
+    def test_invalidated_by_updated_at(self):
+        old_key = card_key(self.bb)
+        render_cards(self.listing())
+        self.bb.title = 'Шоссейный велосипед'
+        self.bb.save()
+        self.assertNotEqual(card_key(self.bb), old_key)
+        html, = render_cards(self.listing())
+        self.assertIn('Шоссейный велосипед', html)
+        # новая иллюстрация тоже меняет updated_at
+        key = card_key(self.bb)
+        AdditionalImage.objects.create(bb=self.bb, image='photo.jpg')
+        self.bb.refresh_from_db()
+        self.assertNotEqual(card_key(self.bb), key)
+        render_cards(self.listing())
+        self.assertIsNotNone(cache.get(card_key(self.bb)))
+        invalidate_card(self.bb)
+        self.assertIsNone(cache.get(card_key(self.bb)))
+
+    def test_pages(self):
+        self.assertContains(self.client.get('/'), 'Горный')
+        self.assertContains(self.client.get('/%s/' % self.rubric.pk), 'Горный')
+        self.bb.content = 'Складной'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bb.save()
+        self.assertContains(self.client.get('/'), 'Складной')
+        self.assertContains(self.client.get('/%s/' % self.rubric.pk), 'Складной')
+
+
+class ThumbnailTests(TemporaryFilesMixin, BoardTestCase):
+    """
+    Пока фоновое задание не создало миниатюры, в списках выводится заглушка.
+    """
+
+    def setUp(self):
+        from PIL import Image
+
+        self.use_temporary_media()
+        cache.clear()
+        output = io.BytesIO()
+        Image.new('RGB', (400, 300), 'green').save(output, 'JPEG')
+        # файл уже обработан (main.images), поэтому сразу ставятся только миниатюры
+        name = default_storage.save('images/photo.jpg', ContentFile(output.getvalue()))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bb = Bb.objects.create(rubric=self.rubric, author=self.user, title='Велосипед', content='-',
+                                        contacts='-', image=name)
+
+    def test_placeholder_replaced(self):
+        self.assertEqual(list(Job.objects.values_list('name', flat=True)), ['create_thumbnails'])
+        for url in ('/', '/%s/' % self.rubric.pk):
+            self.assertContains(self.client.get(url), 'src="/static/main/empty.jpg"')
+        # карточка с заглушкой не кэшируется, а задание ставится один раз
+        self.assertIsNone(cache.get(card_key(self.bb)))
+        self.assertEqual(Job.objects.count(), 1)
+
+        self.assertEqual(run_pending(), (1, 0))
+        thumbnail_url = get_thumbnail_url(self.bb.image)
+        self.assertRegex(thumbnail_url, r'^/media/thumbnails/images/')
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, thumbnail_url[len('/media/'):])))
+        cache.clear()  # кэш страниц
+        for url in ('/', '/%s/' % self.rubric.pk):
+            response = self.client.get(url)
+            self.assertNotContains(response, 'empty.jpg')
+            self.assertContains(response, 'src="%s"' % thumbnail_url)
+        self.assertIsNotNone(cache.get(card_key(self.bb)))
+        self.assertFalse(Job.objects.exists())
+
+    def test_job_repeatable(self):
+        name = self.bb.image.name
+        self.assertIsNone(enqueue_thumbnails(name))
+        run_pending()
+        # выполненное задание можно поставить снова, повторное и задание для удалённого файла
+        # ничего не делают
+        self.assertIsNotNone(enqueue_thumbnails(name))
+        self.assertEqual(run_pending(), (1, 0))
+        default_storage.delete(name)
+        create_thumbnails({'name': name})
+
+    @override_settings(MEDIA_WORKERS=2)
+    def test_job_uses_worker_pool(self):
+        # миниатюры создаются в пуле, а сохраняются в процессе, выполняющем задания
+        with ThreadPoolExecutor(1) as executor, patch('main.workers.get_executor', return_value=executor), \
+                patch.object(executor, 'submit', wraps=executor.submit) as submit:
+            self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(submit.call_args.args[:2], (generate_thumbnails, self.bb.image.name))
+        self.assertRegex(get_thumbnail_url(self.bb.image), r'^/media/thumbnails/images/')
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', JOBS_MAX_ATTEMPTS=3,
+                   JOBS_RETRY_DELAY=0)
+class JobQueueTests(TestCase):
+    """
+    Письма с требованием активации ставятся в очередь и отправляются обработчиком пачкой.
+    """
+
+    def register(self, username):
+        return self.client.post('/accounts/register/', {
+            'username': username, 'email': '%s@example.com' % username, 'password1': 'Vfrc-2024-pass',
+            'password2': 'Vfrc-2024-pass', 'first_name': '', 'last_name': '', 'send_messages': True,
+        })
+
+    def test_registration_enqueues_email(self):
+        self.register('buyer')
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Job.objects.filter(name='send_email').count(), 1)
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertFalse(Job.objects.exists())
+
+    def test_batch_uses_one_connection(self):
+        for i in range(3):
+            self.register('buyer%s' % i)
+        connections = []
+        with patch('main.jobs.get_connection', side_effect=lambda: connections.append(get_connection()) or
+                   connections[-1]):
+            self.assertEqual(run_pending(), (3, 0))
+        self.assertEqual(len(connections), 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_failed_job_is_retried_then_dead(self):
+        calls = []
+
+        @register('test_failing')
+        def failing(payload):
+            calls.append(payload)
+            raise ValueError('сбой')
+
+        self.addCleanup(handlers.pop, 'test_failing')
+        Job.objects.create(name='test_failing', payload={'n': 1}, run_at=timezone.now())
+        for attempt in range(1, 3):
+            self.assertEqual(run_pending(), (0, 1))
+            self.assertEqual(Job.objects.get().attempts, attempt)
+        self.assertEqual(run_pending(), (0, 1))
+        self.assertEqual(len(calls), 3)
+        self.assertFalse(Job.objects.exists())
+        dead = DeadJob.objects.get()
+        self.assertEqual(dead.payload, {'n': 1})
+        self.assertIn('сбой', dead.last_error)
+
+
+class DeletionTests(TemporaryFilesMixin, BoardTestCase):
+    """
+    Удаление пользователя и объявлений выполняется постоянным числом запросов,
+    а файлы удаляются фоновым заданием, только если на них больше никто не ссылается.
+    """
+
+    def setUp(self):
+        self.use_temporary_media()
+
+    def create_user(self, username, count, image='shared.jpg'):
+        user = AdvUser.objects.create_user(username=username, password='password')
+        bbs = Bb.objects.bulk_create([Bb(rubric=self.rubric, author=user, title='Товар', content='-', contacts='-',
+                                         image=image) for i in range(count)])
+        AdditionalImage.objects.bulk_create([AdditionalImage(bb=bb, image='%s_%s.jpg' % (username, bb.pk))
+                                             for bb in bbs])
+        Comment.objects.bulk_create([Comment(bb=bb, author='Гость', content='Торг?') for bb in bbs])
+        return user
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return len(context)
+
+    def test_constant_queries(self):
+        small = self.create_user('small', 2)
+        large = self.create_user('large', 40)
+        self.assertEqual(self.count_queries(small.delete), self.count_queries(large.delete))
+        self.assertFalse(Bb.objects.exists())
+        self.assertFalse(AdditionalImage.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+
+    def test_signal(self):
+        user = self.create_user('owner', 3)
+        received = []
+        receiver = lambda sender, **kwargs: received.append(kwargs)
+        bbs_deleted.connect(receiver)
+        self.addCleanup(bbs_deleted.disconnect, receiver)
+        ids = sorted(user.bb_set.values_list('pk', flat=True))
+        user.delete()
+        self.assertEqual(sorted(received[0]['ids']), ids)
+        self.assertEqual(received[0]['rubric_ids'], [self.rubric.pk])
+
+    def test_files_deleted_when_unreferenced(self):
+        for name in ('shared.jpg', 'seller_file.jpg'):
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(b'-')
+        seller = self.create_user('owner', 1, 'seller_file.jpg')
+        self.create_user('other', 1)
+        Bb.objects.filter(author=seller).update(image='shared.jpg')
+        Bb.objects.create(rubric=self.rubric, author=seller, title='Товар', content='-', contacts='-',
+                          image='seller_file.jpg')
+        seller.delete()
+        self.assertEqual(Job.objects.filter(name='delete_files').count(), 1)
+        # и обработка загруженного файла, которая для удалённого файла ничего не делает
+        self.assertEqual(run_pending(), (2, 0))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'seller_file.jpg')))
+        # файл всё ещё используется объявлением другого пользователя
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'shared.jpg')))
+
+
+@override_settings(MEDIA_WORKERS=0, IMAGE_MAX_SIZE=1600, IMAGE_FORMAT='JPEG', IMAGE_WIDTHS=(320, 640, 1024))
+class ImageProcessingTests(TemporaryFilesMixin, BoardTestCase):
+    """
+    Загруженное изображение поворачивается по EXIF, уменьшается, теряет метаданные
+    и заменяется прогрессивным JPEG с уменьшенными копиями для srcset.
+    """
+
+    def setUp(self):
+        from PIL import Image
+
+        self.use_temporary_media()
+        cache.clear()
+        # Снимок 2000x1000, повёрнутый камерой на 90 градусов, с координатами съёмки в EXIF
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010f] = 'Camera'
+        Image.new('RGB', (2000, 1000), 'red').save(os.path.join(self.media_root, 'photo.jpg'), exif=exif,
+                                                   quality=100)
+        self.bb = Bb.objects.create(rubric=self.rubric, author=self.user, title='Велосипед', content='-',
+                                    contacts='-', image='photo.jpg')
+        AdditionalImage.objects.create(bb=self.bb, image='photo.jpg')
+
+    def test_replace_original(self):
+        from PIL import Image
+
+        size = os.path.getsize(os.path.join(self.media_root, 'photo.jpg'))
+        with self.captureOnCommitCallbacks():
+            saved = replace_original(process_image('photo.jpg'))
+        self.bb.refresh_from_db()
+        name = self.bb.image.name
+        self.assertRegex(name, r'^images/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(self.bb.additionalimage_set.get().image.name, name)
+        self.assertEqual(saved, size - os.path.getsize(os.path.join(self.media_root, name)))
+        self.assertGreater(saved, 0)
+        with Image.open(os.path.join(self.media_root, name)) as image:
+            self.assertEqual(image.size, (800, 1600))
+            self.assertTrue(image.info.get('progressive'))
+            self.assertNotIn('exif', image.info)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, variant_name(name, 320))))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, variant_name(name, 640))))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, variant_name(name, 1024))))
+        # исходный файл удаляется заданием, когда на него больше никто не ссылается, миниатюры
+        # обработанного создаются заданием, а поставленная в setUp обработка уже не нужна
+        self.assertEqual(sorted(Job.objects.values_list('name', flat=True)),
+                         ['create_thumbnails', 'delete_files', 'process_upload'])
+        self.assertEqual(run_pending(), (3, 0))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'photo.jpg')))
+        self.assertTrue(get_thumbnail_url(self.bb.image))
+
+    def test_upload_job(self):
+        # одно задание на объявление и иллюстрацию с одним файлом
+        self.assertEqual(list(Job.objects.values_list('name', 'payload')), [('process_upload', {'name': 'photo.jpg'})])
+        self.assertEqual(run_pending(), (1, 0))
+        self.bb.refresh_from_db()
+        self.assertTrue(is_processed(self.bb.image.name))
+        self.assertEqual(self.bb.additionalimage_set.get().image, self.bb.image)
+        self.assertEqual(run_pending(), (2, 0))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'photo.jpg')))
+        self.assertTrue(get_thumbnail_url(self.bb.image))
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(MEDIA_WORKERS=2)
+    def test_upload_job_uses_worker_pool(self):
+        # изображение обрабатывается в пуле, а записи обновляются в процессе, выполняющем задания
+        with ThreadPoolExecutor(1) as executor, patch('main.workers.get_executor', return_value=executor), \
+                patch.object(executor, 'submit', wraps=executor.submit) as submit:
+            self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(submit.call_args.args, (process_image, 'photo.jpg'))
+        self.bb.refresh_from_db()
+        self.assertTrue(is_processed(self.bb.image.name))
+
+    def test_not_an_image(self):
+        name = default_storage.save('document.jpg', ContentFile(b'not an image'))
+        Bb.objects.create(rubric=self.rubric, author=self.user, title='Документ', content='-', contacts='-',
+                          image=name)
+        Job.objects.filter(payload__name='photo.jpg').delete()
+        with self.assertLogs('main.images', 'WARNING'):
+            self.assertEqual(run_pending(), (1, 0))
+        self.assertTrue(default_storage.exists(name))
+
+    def test_replaced_while_processing(self):
+        result = process_image('photo.jpg')
+        Bb.objects.filter(pk=self.bb.pk).update(image='')
+        AdditionalImage.objects.all().delete()
+        self.assertEqual(replace_original(result), 0)
+        self.assertEqual([files for path, dirs, files in os.walk(os.path.join(self.media_root, 'images')) if files],
+                         [])
+
+    def test_srcset(self):
+        response = self.client.get('/%s/%s' % (self.rubric.pk, self.bb.pk))
+        self.assertNotContains(response, 'srcset')
+        with self.captureOnCommitCallbacks(execute=True):  # новые версии страницы
+            replace_original(process_image('photo.jpg'))
+        bb = Bb.objects.get()
+        self.assertEqual((bb.image_width, bb.image_variants), (800, [320, 640]))
+        # ширины берутся из записей, без обращения к хранилищу и к самому файлу
+        with patch.object(FileSystemStorage, 'exists', side_effect=AssertionError), \
+                patch('PIL.Image.open', side_effect=AssertionError):
+            response = self.client.get('/%s/%s' % (self.rubric.pk, self.bb.pk))
+        url = '/media/' + bb.image.name
+        self.assertContains(response, 'srcset="%s 320w, %s 640w, %s 800w" sizes="300px"' % (
+            variant_name(url, 320), variant_name(url, 640), url))
+        self.assertContains(response, 'sizes="180px"')
+
+
+@override_settings(MEDIA_WORKERS=0)
+class ContentAddressedStorageTests(TemporaryFilesMixin, BoardTestCase):
+    """
+    Одинаковые файлы хранятся один раз под именем по содержимому и удаляются, только когда
+    на них больше никто не ссылается.
+    """
+
+    def setUp(self):
+        self.use_temporary_media()
+
+    def create_bb(self, image):
+        return Bb.objects.create(rubric=self.rubric, author=self.user, title='Велосипед', content='-', contacts='-',
+                                 image=image)
+
+    def test_deduplication(self):
+        digest = hashlib.sha256(b'photo').hexdigest()
+        self.assertEqual(default_storage.save('1.JPG', ContentFile(b'photo')),
+                         '%s/%s/%s.jpg' % (digest[:2], digest[2:4], digest))
+        self.assertEqual(default_storage.save('2.jpg', ContentFile(b'photo')),
+                         '%s/%s/%s.jpg' % (digest[:2], digest[2:4], digest))
+        # каталог из предложенного имени сохраняется
+        self.assertTrue(default_storage.save('images/3.jpg', ContentFile(b'other')).startswith('images/'))
+        files = [name for path, dirs, names in os.walk(self.media_root) for name in names
+                 if CLAIMS_DIR not in path.split(os.sep)]
+        self.assertEqual(len(files), 2)
+
+    def test_delete_shared_file(self):
+        name = default_storage.save('photo.jpg', ContentFile(b'photo'))
+        first = self.create_bb(name)
+        second = self.create_bb(name)
+        with self.captureOnCommitCallbacks(execute=True):  # django_cleanup удаляет файл после фиксации
+            first.image = ''
+            first.save()
+        self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.image = ''
+            second.save()
+        self.assertFalse(default_storage.exists(name))
+
+    def test_delete_claimed_file(self):
+        name = default_storage.save('photo.jpg', ContentFile(b'photo'))
+        bb = self.create_bb(name)
+        # повторная загрузка: запись, которая сошлётся на файл, ещё не сохранена
+        self.assertEqual(default_storage.save('copy.jpg', ContentFile(b'photo')), name)
+        with self.captureOnCommitCallbacks(execute=True):
+            bb.image = ''
+            bb.save()
+        self.assertTrue(default_storage.exists(name))
+        job = Job.objects.get(name='delete_files')
+        self.assertEqual(job.payload, {'names': [name]})
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=settings.MEDIA_DELETE_GRACE - 60))
+        with self.settings(MEDIA_DELETE_GRACE=0):
+            default_storage.delete(name)
+        self.assertFalse(default_storage.exists(name))
+
+    def test_migrate_media_storage(self):
+        for name in ('1.jpg', '2.jpg'):
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(b'photo')
+        first = self.create_bb('1.jpg')
+        AdditionalImage.objects.create(bb=first, image='2.jpg')
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks():
+            call_command('migrate_media_storage', stdout=out)
+        self.assertIn('одинаковых: 1', out.getvalue())
+        first.refresh_from_db()
+        self.assertTrue(is_content_addressed(first.image.name))
+        self.assertEqual(first.additionalimage_set.get().image.name, first.image.name)
+        run_pending()
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, '1.jpg')))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, '2.jpg')))
+        with default_storage.open(first.image.name) as f:
+            self.assertEqual(f.read(), b'photo')
+
+
+@override_settings(MEDIA_WORKERS=0, IMPORT_MAX_IMAGE_SIZE=100)
+class ImportTests(TemporaryFilesMixin, BoardTestCase):
+    """
+    Импорт пропускает ошибочные строки, сообщая о них, и добавляет остальные вместе с изображениями.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = AdvUser.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+
+    def setUp(self):
+        from PIL import Image
+
+        self.source_dir = self.temporary_directory()
+        self.use_temporary_media(IMPORT_SOURCE_DIR=self.source_dir)
+        Image.new('RGB', (400, 200), 'red').save(os.path.join(self.source_dir, 'big.jpg'))
+        Image.new('RGB', (40, 20), 'blue').save(os.path.join(self.source_dir, 'small.png'))
+
+    def test_csv(self):
+        data = (
+            'rubric,title,content,price,contacts,image,images\n'
+            'велосипеды,Велосипед,Горный,1000,тел.,big.jpg,small.png;big.jpg\n'
+            'Самокаты,Самокат,Детский,500,тел.,,\n'
+            'Велосипеды,,Без названия,100,тел.,,\n'
+            'Велосипеды,Шлем,Новый,дорого,тел.,,\n'
+            'Велосипеды,Насос,Ручной,100,тел.,нет.jpg,\n'
+            'Велосипеды,Звонок,Громкий,50,тел.,../big.jpg,\n'
+            'Велосипеды,Замок,Надёжный,200,тел.,,\n'
+        ).encode()
+        result = import_bbs(io.BytesIO(data), 'csv', self.user, self.source_dir)
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line for line, message in result.errors], [3, 4, 5, 6, 7])
+        self.assertIn('Самокаты', result.errors[0][1])
+        bb = Bb.objects.get(title='Велосипед')
+        self.assertEqual(bb.author, self.user)
+        self.assertEqual(bb.additionalimage_set.count(), 2)
+        with default_storage.open(bb.image.name) as f:
+            from PIL import Image
+            self.assertEqual(Image.open(f).size, (100, 50))
+        # один и тот же исходный файл копируется один раз
+        self.assertIn(bb.image.name, bb.additionalimage_set.values_list('image', flat=True))
+
+    def test_jsonl(self):
+        data = '\n'.join([
+            json.dumps({'rubric': 'Велосипеды', 'title': 'Велосипед', 'content': 'Горный', 'price': 1000,
+                        'contacts': 'тел.', 'is_active': False, 'images': ['small.png']}),
+            '{не json',
+            json.dumps({'rubric': 'Велосипеды', 'title': 'Шлем', 'content': 'Новый', 'contacts': 'тел.',
+                        'images': 'small.png'}),
+        ]).encode()
+        result = import_bbs(io.BytesIO(data), 'jsonl', self.user, self.source_dir)
+        self.assertEqual(result.created, 1)
+        self.assertEqual([line for line, message in result.errors], [2, 3])
+        bb = Bb.objects.get()
+        self.assertFalse(bb.is_active)
+        self.assertEqual(bb.additionalimage_set.count(), 1)
+
+    def test_admin_upload(self):
+        self.client.force_login(self.user)
+        data = 'rubric,title,content,price,contacts\nВелосипеды,Велосипед,Горный,1000,тел.\nНет,Х,Х,1,Х\n'
+        response = self.client.post('/admin/main/bb/import/', {
+            'author': 'admin', 'file': SimpleUploadedFile('bbs.csv', data.encode())})
+        self.assertContains(response, 'Рубрика')
+        self.assertEqual(Bb.objects.count(), 1)
+        # через администрирование изображения по адресам не загружаются
+        data = 'rubric,title,content,price,contacts,image\nВелосипеды,Самокат,-,1,-,http://example.com/1.jpg\n'
+        with patch('main.importer.load_image') as load_image:
+            response = self.client.post('/admin/main/bb/import/', {
+                'author': 'admin', 'file': SimpleUploadedFile('bbs.csv', data.encode())})
+        load_image.assert_not_called()
+        self.assertContains(response, 'Адреса изображений не поддерживаются')
+        self.assertEqual(Bb.objects.count(), 1)
+
+    def test_symlink_outside_source_dir(self):
+        from PIL import Image
+
+        outside = self.temporary_directory()
+        Image.new('RGB', (40, 20), 'green').save(os.path.join(outside, 'secret.png'))
+        os.symlink(outside, os.path.join(self.source_dir, 'link'))
+        data = 'rubric,title,content,price,contacts,image\nВелосипеды,Велосипед,-,1,-,link/secret.png\n'
+        result = import_bbs(io.BytesIO(data.encode()), 'csv', self.user, self.source_dir)
+        self.assertEqual(result.created, 0)
+        self.assertIn('Недопустимый путь', result.errors[0][1])
+
+    def test_internal_urls(self):
+        for url in ('http://127.0.0.1/1.jpg', 'http://10.0.0.1/1.jpg', 'http://169.254.169.254/latest/',
+                    'http://[::1]/1.jpg', 'ftp://example.com/1.jpg'):
+            with self.subTest(url=url), self.assertRaises(ValueError):
+                check_public_url(url)
+        # перенаправление на внутренний адрес не выполняется
+        request = urllib.request.Request('http://93.184.215.14/1.jpg')
+        with self.assertRaises(ValueError):
+            PublicRedirectHandler().redirect_request(request, None, 302, 'Found', {}, 'http://127.0.0.1/admin')
+
+
+class ConditionalGetTests(BoardTestCase):
+    """
+    Списки и страницы объявлений отдают валидаторы, вычисленные по версиям данных,
+    и отвечают 304, пока данные не изменились.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.bb = Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Велосипед', content='Горный',
+                                   contacts='-')
+
+    def setUp(self):
+        cache.clear()
+
+    def assertNotModified(self, url):
+        self.client.get(url)  # страница с формой устанавливает cookie CSRF, от которой зависит ETag
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304, url)
+        return response
+
+    def test_not_modified(self):
+        for url in ('/', '/%s/' % self.rubric.pk, '/%s/%s' % (self.rubric.pk, self.bb.pk), '/api/bbs/',
+                    '/api/bbs/?rubric=%s' % self.rubric.pk, '/api/bbs/%s' % self.bb.pk):
+            self.assertNotModified(url)
+        response = self.client.get('/')
+        self.assertIn('Cookie', response['Vary'])
+        self.assertEqual(self.client.get('/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_changes(self):
+        urls = ('/', '/%s/' % self.rubric.pk, '/api/bbs/')
+        etags = [self.assertNotModified(url)['ETag'] for url in urls]
+        with self.captureOnCommitCallbacks(execute=True):
+            Bb.objects.create(rubric=self.rubric, author=self.user, title='Самокат', content='-', contacts='-')
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, url)
+
+        url = '/api/bbs/%s' % self.bb.pk
+        etag = self.assertNotModified(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(bb=self.bb, author='Гость', content='Торг?')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_users_do_not_share_pages(self):
+        anonymous = self.client.get('/')
+        self.client.force_login(self.user)
+        response = self.client.get('/')
+        self.assertNotEqual(response['ETag'], anonymous['ETag'])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=anonymous['ETag']).status_code, 200)
+
+    def test_pending_messages(self):
+        @conditional(lambda request: ['index'])
+        def view(request):
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request._messages = CookieStorage(request)
+        self.assertTrue(view(request).has_header('ETag'))
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request._messages = CookieStorage(request)
+        messages.add_message(request, messages.SUCCESS, 'Объявление добавлено')
+        self.assertFalse(view(request).has_header('ETag'))
+
+
+class RubricTreeTests(BoardTestCase):
+    """
+    Дерево рубрик берётся из памяти процесса, пока не сменится или не истечёт его версия в кэше.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_version_expires(self):
+        self.assertEqual(get_rubric_tree()[0].sub_rubrics[0].name, 'Велосипеды')
+        # изменение без сигнала, как в другом процессе с собственным кэшем
+        SubRubric.objects.filter(pk=self.rubric.pk).update(name='Самокаты')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_rubric_tree()[0].sub_rubrics[0].name, 'Велосипеды')
+        cache.delete(rubrics.VERSION_KEY)  # истечение TREE_TIMEOUT
+        self.assertEqual(get_rubric_tree()[0].sub_rubrics[0].name, 'Самокаты')
+
+
+class PageCacheTests(BoardTestCase):
+    """
+    Страницы для гостей выдаются из кэша без запросов к базе данных, а изменение данных
+    делает устаревшими только затронутые страницы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_rubric = SubRubric.objects.create(name='Самокаты', super_rubric=cls.super_rubric)
+        cls.bb = Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Велосипед', content='Горный',
+                                   contacts='-')
+
+    def setUp(self):
+        cache.clear()
+        self.detail_url = '/%s/%s' % (self.rubric.pk, self.bb.pk)
+
+    def create_bb(self, title, rubric):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Bb.objects.create(rubric=rubric, author=self.user, title=title, content='-', contacts='-')
+
+    def test_process_local_cache_check(self):
+        # кэш в памяти процесса на рабочем сервере не сбрасывает страницы в других процессах
+        with override_settings(DEBUG=False):
+            self.assertEqual([error.id for error in checks.check_page_cache(None)], ['main.W001'])
+            with override_settings(PAGE_CACHE_TIMEOUT=0):
+                self.assertEqual(checks.check_page_cache(None), [])
+        with override_settings(DEBUG=True):
+            self.assertEqual(checks.check_page_cache(None), [])
+        # ETag условных запросов зависят от тех же версий
+        with override_settings(DEBUG=False, PAGE_CACHE_TIMEOUT=0):
+            self.assertEqual([error.id for error in checks.check_conditional_requests(None)], ['main.W002'])
+
+    def test_cached_without_queries(self):
+        for url in ('/', '/?keyword=велосипед', '/%s/' % self.rubric.pk):
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_targeted_purge(self):
+        other_url = '/%s/' % self.other_rubric.pk
+        for url in ('/', '/%s/' % self.rubric.pk, other_url, self.detail_url):
+            self.client.get(url)
+        self.create_bb('Тандем', self.other_rubric)
+        self.assertContains(self.client.get('/'), 'Тандем')
+        self.assertContains(self.client.get(other_url), 'Тандем')
+        with self.assertNumQueries(0):
+            self.client.get('/%s/' % self.rubric.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(bb=self.bb, author='Гость', content='Торг уместен?')
+        self.assertContains(self.client.get(self.detail_url), 'Торг уместен?')
+        # число комментариев выводится в карточке, но страница другой рубрики остаётся в кэше
+        self.assertContains(self.client.get('/'), 'Комментариев: 1')
+        with self.assertNumQueries(0):
+            self.client.get(other_url)
+
+    def test_comment_form_hole(self):
+        first = self.client.get(self.detail_url).content.decode()
+        second = self.client.get(self.detail_url).content.decode()
+        key = re.compile(r'name="captcha_0" value="(\w+)"')
+        self.assertNotEqual(key.search(first).group(1), key.search(second).group(1))
+        self.assertIn('csrfmiddlewaretoken', second)
+
+    def test_stale_page_while_rebuilding(self):
+        self.client.get('/')
+        self.create_bb('Тандем', self.other_rubric)
+        request = RequestFactory().get('/')
+        cache.add(LOCK_KEY % page_key(request), 1)
+        self.assertNotContains(self.client.get('/'), 'Тандем')
+        cache.delete(LOCK_KEY % page_key(request))
+        self.assertContains(self.client.get('/'), 'Тандем')
+
+    def test_not_cached_for_users(self):
+        self.client.force_login(self.user)
+        self.client.get('/')
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/')
+        self.assertTrue(context.captured_queries)
+
+
+class CommentCounterTests(BoardTestCase):
+    """
+    Число активных комментариев и время последнего из них хранятся в объявлении
+    и используются для сортировки списков.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.bbs = [Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Товар %s' % i, content='-',
+                                     contacts='-') for i in range(5)]
+
+    def setUp(self):
+        cache.clear()
+
+    def counters(self, bb):
+        bb.refresh_from_db()
+        return bb.comment_count, bb.last_comment_at
+
+    def test_counters(self):
+        bb = self.bbs[0]
+        first = Comment.objects.create(bb=bb, author='Гость', content='Первый')
+        second = Comment.objects.create(bb=bb, author='Гость', content='Второй')
+        self.assertEqual(self.counters(bb), (2, second.created_at))
+        Comment.objects.create(bb=bb, author='Гость', content='Скрытый', is_active=False)
+        self.assertEqual(self.counters(bb), (2, second.created_at))
+
+        second.is_active = False
+        second.save()
+        self.assertEqual(self.counters(bb), (1, first.created_at))
+        second.is_active = True
+        second.save()
+        self.assertEqual(self.counters(bb), (2, second.created_at))
+        second.content = 'Исправленный'
+        second.save()
+        self.assertEqual(self.counters(bb), (2, second.created_at))
+
+        second.delete()
+        self.assertEqual(self.counters(bb), (1, first.created_at))
+        first.delete()
+        self.assertEqual(self.counters(bb), (0, None))
+
+    def test_repair(self):
+        bb = self.bbs[1]
+        comment = Comment.objects.create(bb=bb, author='Гость', content='Комментарий')
+        Bb.objects.filter(pk__in=[bb.pk, self.bbs[2].pk]).update(comment_count=7, last_comment_at=None)
+        self.assertEqual(repair_counters(Bb.objects.all(), batch_size=2), 2)
+        self.assertEqual(self.counters(bb), (1, comment.created_at))
+        self.assertEqual(self.counters(self.bbs[2]), (0, None))
+        self.assertEqual(repair_counters(Bb.objects.all()), 0)
+
+    def test_sorted_pages(self):
+        for i, bb in enumerate(self.bbs[:3]):
+            for j in range(i + 1):
+                Comment.objects.create(bb=bb, author='Гость', content='Комментарий')
+        Comment.objects.create(bb=self.bbs[0], author='Гость', content='Последний')
+        expected = {
+            'discussed': [self.bbs[2], self.bbs[1], self.bbs[0], self.bbs[4], self.bbs[3]],
+            'active': [self.bbs[0], self.bbs[2], self.bbs[1], self.bbs[4], self.bbs[3]],
+        }
+        for sort, bbs in expected.items():
+            titles = []
+            url = '/%s/?sort=%s' % (self.rubric.pk, sort)
+            while url:
+                response = self.client.get(url)
+                titles += [bb.title for bb in response.context['bbs']]
+                page = response.context['page']
+                url = '/%s/?sort=%s&page=%s' % (self.rubric.pk, sort, page.next_cursor) if page.has_next() else ''
+            self.assertEqual(titles, [bb.title for bb in bbs], sort)
+        # ссылки на следующую страницу сохраняют сортировку
+        self.assertContains(self.client.get('/%s/?sort=active' % self.rubric.pk), '?sort=active&page=')
+
+
+class InstrumentationTests(TemporaryFilesMixin, BoardTestCase):
+    """
+    Каждый запрос замеряется: заголовок Server-Timing, гистограмма контроллера
+    и журнал медленных запросов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Велосипед', content='-', contacts='-')
+
+    def setUp(self):
+        cache.clear()
+        reset_histograms()
+
+    def timings(self, response):
+        return dict(re.match(r'(\w+);(.*)', item.strip()).groups() for item in response['Server-Timing'].split(','))
+
+    def test_server_timing(self):
+        timings = self.timings(self.client.get('/%s/' % self.rubric.pk))
+        self.assertEqual(set(timings), {'db', 'tpl', 'cp', 'cache', 'total'})
+        self.assertRegex(timings['db'], r'desc="[1-9]\d* queries"')
+        self.assertNotEqual(timings['tpl'], 'dur=0.0')
+        # страница из кэша: ни одного запроса, шаблоны не выводятся
+        timings = self.timings(self.client.get('/%s/' % self.rubric.pk))
+        self.assertIn('desc="0 queries"', timings['db'])
+        self.assertEqual(timings['tpl'], 'dur=0.0')
+        self.assertRegex(timings['cache'], r'desc="[1-9]\d* hits / 0 misses"')
+
+    def test_any_cache_backend(self):
+        from django.core.cache.backends.filebased import FileBasedCache
+
+        file_cache = InstrumentedCache(self.temporary_directory(), {'OPTIONS': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache'}})
+        self.assertIsInstance(file_cache, FileBasedCache)
+        metrics, token = instrumentation.start()
+        try:
+            file_cache.set('a', 1)
+            self.assertIsNone(file_cache.get('b'))
+            self.assertEqual(file_cache.get('a'), 1)
+            self.assertEqual(file_cache.get_many(['a', 'b']), {'a': 1})
+        finally:
+            instrumentation.finish(token)
+        self.assertEqual((metrics.cache_hits, metrics.cache_misses), (2, 2))
+
+    def test_histograms(self):
+        for i in range(3):
+            self.client.get('/')
+        summary = dict(histograms())['main:index']
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(sum(summary['buckets']), 3)
+
+        staff = AdvUser.objects.create_user(username='admin', password='password', is_staff=True)
+        self.client.force_login(staff)
+        self.assertContains(self.client.get('/admin/metrics/'), 'main:index')
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0)
+    def test_slow_log(self):
+        with self.assertLogs('bboard.slow', 'WARNING') as logs:
+            self.client.get('/%s/' % self.rubric.pk)
+        self.assertIn('(main:by_rubric) 200', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class ProfilingTests(TemporaryFilesMixin, TestCase):
+    """
+    Выборочное профилирование: стеки отобранных запросов копятся в файлах профилей
+    контроллеров и выводятся сотрудникам как flame graph.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = AdvUser.objects.create_user(username='admin', password='password', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        self.profiles_dir = self.temporary_directory()
+        self.enterContext(self.settings(PROFILES_DIR=self.profiles_dir, PROFILING_INTERVAL=0.001))
+
+    def test_sampler(self):
+        def busy_function():
+            deadline = time.perf_counter() + 0.1
+            while time.perf_counter() < deadline:
+                pass
+
+        session = profiling.start(sys._getframe())
+        busy_function()
+        stacks = profiling.stop(session)
+        self.assertFalse(profiling._active.is_set())  # поток замеров снова ждёт
+        # кадры выше переданного в start (вызывающие) в стек не попадают
+        self.assertTrue(stacks)
+        self.assertTrue(all(stack.split(';')[0].endswith('.busy_function') for stack in stacks), stacks)
+
+    def test_signed_header(self):
+        with patch('main.profiling.save_profile') as save_profile:
+            self.client.get('/', HTTP_X_BBOARD_PROFILE='forged:token')
+            save_profile.assert_not_called()
+            self.client.get('/', HTTP_X_BBOARD_PROFILE=profiling.profile_token(self.staff))
+            self.assertEqual(save_profile.call_args[0][0], 'main:index')
+            # бывший сотрудник заголовком больше не пользуется
+            token = profiling.profile_token(self.staff)
+            AdvUser.objects.filter(pk=self.staff.pk).update(is_staff=False)
+            save_profile.reset_mock()
+            self.client.get('/', HTTP_X_BBOARD_PROFILE=token)
+            save_profile.assert_not_called()
+
+    def test_profiles_view(self):
+        profiling.save_profile('main:by_rubric', Counter({'main.views.by_rubric;main.search.<filter>': 3}))
+        profiling.save_profile('main:by_rubric', Counter({'main.views.by_rubric': 2}))
+        self.assertEqual(profiling.read_profile('main:by_rubric')['main.views.by_rubric'], 2)
+
+        self.assertEqual(self.client.get('/admin/profiles/').status_code, 302)
+        self.client.force_login(self.staff)
+        response = self.client.get('/admin/profiles/')
+        self.assertContains(response, 'main_by_rubric')
+        response = self.client.get('/admin/profiles/main_by_rubric/')
+        self.assertContains(response, '<svg')
+        self.assertContains(response, 'main.search.&lt;filter&gt;')
+        self.client.post('/admin/profiles/', {'name': 'main_by_rubric'})
+        self.assertEqual(self.client.get('/admin/profiles/main_by_rubric/').status_code, 404)
+
+
+class DatabaseSettingsTests(TestCase):
+    """
+    Соединения с SQLite настраиваются bboard.database.
+    """
+
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            for name in ('synchronous', 'busy_timeout', 'cache_size'):
+                cursor.execute('PRAGMA %s' % name)
+                self.assertEqual(str(cursor.fetchone()[0]), str(PRAGMAS[name]).replace('NORMAL', '1'), name)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_benchmark(self):
+        output = io.StringIO()
+        call_command('benchmark_sqlite', threads=2, transactions=5, bbs=3, stdout=output)
+        self.assertIn('tuned    транзакций:    10', output.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(BoardTestCase):
+    """
+    Гости читают с реплики, запись и чтение после записи - с основной базы.
+    """
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.bb = Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Велосипед', content='-', contacts='-')
+
+    def setUp(self):
+        cache.clear()
+        # Тестовая база в памяти с общим кэшем: без этого зеркало не может читать таблицы,
+        # изменённые в незавершённой транзакции теста
+        with connections['replica'].cursor() as cursor:
+            cursor.execute('PRAGMA read_uncommitted = 1')
+
+    def queries(self, method, url, **kwargs):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, len(primary), len(replica)
+
+    def test_reads_from_replica(self):
+        response, primary, replica = self.queries('get', '/%s/' % self.rubric.pk)
+        self.assertContains(response, 'Велосипед')
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_sticky_after_write(self):
+        response, primary, replica = self.queries('post', '/api/bbs/%s/comments' % self.bb.pk,
+                                                  data={'bb': self.bb.pk, 'author': 'Гость', 'content': 'Торг?'})
+        self.assertEqual(response.status_code, 403)  # комментарии через API - только для пользователей
+        self.assertIn('bboard_primary', response.cookies)
+        response, primary, replica = self.queries('get', '/%s/%s' % (self.rubric.pk, self.bb.pk))
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_primary_views(self):
+        self.client.force_login(self.user)
+        response, primary, replica = self.queries('get', '/accounts/profile/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica, 0)
+
+    def test_unavailable_replica(self):
+        self.addCleanup(_unavailable.clear)
+        with patch.object(connections['replica'], 'ensure_connection', side_effect=OperationalError), \
+                self.assertLogs('bboard.routers', 'WARNING'), \
+                CaptureQueriesContext(connections['default']) as primary:
+            self.assertContains(self.client.get('/%s/' % self.rubric.pk), 'Велосипед')
+            self.assertTrue(primary.captured_queries)
+            # недоступная реплика не проверяется повторно до истечения REPLICA_RETRY_INTERVAL
+            cache.clear()
+            self.client.get('/%s/' % self.rubric.pk)
+            self.assertEqual(connections['replica'].ensure_connection.call_count, 1)
+
+
+# Данные TestCase не зафиксированы и видны только через соединение теста
+@override_settings(ROOT_URLCONF=__name__, ASYNC_PARALLEL_QUERIES=False)
+class AsyncViewsTests(BoardTestCase):
+    """
+    Асинхронные контроллеры выдают те же страницы, что и синхронные, и выполняют
+    независимые запросы одновременно, не теряя их при замерах и проверке лимитов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.bbs = [Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Велосипед %s' % i, content='-',
+                                     contacts='-') for i in range(3)]
+        Comment.objects.create(bb=cls.bbs[0], author='Гость', content='Торг уместен?')
+        cls.detail_url = '/%s/%s' % (cls.rubric.pk, cls.bbs[0].pk)
+
+    def setUp(self):
+        cache.clear()
+        self.async_client = AsyncClient()
+
+    def normalize(self, content):
+        # CSRF и CAPTCHA у каждого ответа свои
+        return re.sub(r'csrfmiddlewaretoken" value="[\w-]+"|[0-9a-f]{40}', '', content.decode())
+
+    def test_same_pages(self):
+        for url in ('/', '/?keyword=велосипед', '/%s/' % self.rubric.pk, '/%s/?sort=discussed' % self.rubric.pk,
+                    self.detail_url, '/%s/' % (self.rubric.pk + 100)):
+            cache.clear()
+            response = async_to_sync(self.async_client.get)(url)
+            with override_settings(ROOT_URLCONF='bboard.urls'):
+                cache.clear()
+                expected = self.client.get(url)
+            self.assertEqual(response.status_code, expected.status_code, url)
+            if expected.status_code == 200:
+                self.assertEqual(self.normalize(response.content), self.normalize(expected.content), url)
+                self.assertTrue(response.has_header('ETag'))
+
+    def test_page_cache_and_conditional(self):
+        url = '/%s/' % self.rubric.pk
+        response = async_to_sync(self.async_client.get)(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(self.async_client.get)(url).status_code, 200)
+            not_modified = async_to_sync(self.async_client.get)(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_comment_by_user(self):
+        async_to_sync(self.async_client.aforce_login)(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = async_to_sync(self.async_client.post)(self.detail_url, {'bb': self.bbs[0].pk,
+                                                                               'author': 'seller',
+                                                                               'content': 'Беру'})
+        self.assertContains(response, 'Беру')
+        self.assertContains(response, 'Комментарий добавлен')
+        self.assertEqual(self.bbs[0].comment_set.count(), 2)
+
+    def test_instrumentation(self):
+        reset_histograms()
+        response = async_to_sync(self.async_client.get)(self.detail_url)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+
+    def test_execute_wrapper_in_other_thread(self):
+        # Запрос из другого потока выполняется через его собственное соединение
+        def query():
+            try:
+                with connections['default'].cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            finally:
+                connections['default'].close()
+
+        counter = QueryCounter()
+        with execute_wrapper(counter):
+            context = contextvars.copy_context()
+            thread = threading.Thread(target=context.run, args=(query,))
+            thread.start()
+            thread.join()
+        self.assertEqual(counter.count, 1)
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_benchmark_server(self):
+        port = free_port()
+
+        async def run():
+            ready = asyncio.Event()
+            server = asyncio.ensure_future(serve_asgi(asgi_application, port, ready))
+            await ready.wait()
+            try:
+                return await generate_load(port, ['/', '/%s/' % self.rubric.pk], 10, 3)
+            finally:
+                server.cancel()
+
+        elapsed, latencies, errors = async_to_sync(run)()
+        self.assertEqual((len(latencies), errors), (10, 0))
+
+
+@override_settings(ROOT_URLCONF=__name__, ASYNC_PARALLEL_QUERIES=True)
+class AsyncParallelQueriesTests(TransactionTestCase):
+    """
+    Запросы асинхронных контроллеров в отдельных потоках (in_thread) со своими соединениями
+    видят зафиксированные данные и выполняются одновременно.
+    """
+
+    def setUp(self):
+        cache.clear()
+        user = AdvUser.objects.create_user('seller', 'seller@example.com', 'password')
+        rubric = SubRubric.objects.create(name='Велосипеды',
+                                          super_rubric=SuperRubric.objects.create(name='Транспорт'))
+        self.bb = Bb.objects.create(rubric=rubric, author=user, title='Велосипед', content='-', contacts='-')
+        Comment.objects.create(bb=self.bb, author='Гость', content='Торг уместен?')
+
+    def test_same_pages(self):
+        for url in ('/', '/%s/' % self.bb.rubric_id, '/%s/%s' % (self.bb.rubric_id, self.bb.pk)):
+            cache.clear()
+            response = async_to_sync(AsyncClient().get)(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertContains(response, 'Велосипед')
+        self.assertContains(response, 'Торг уместен?')
+
+    def test_parallel(self):
+        def slow(value):
+            time.sleep(0.2)
+            return Bb.objects.filter(pk=self.bb.pk).count() + value
+
+        async def gather():
+            return await asyncio.gather(*(async_views.in_thread(slow, i) for i in range(3)))
+
+        start = time.perf_counter()
+        self.assertEqual(async_to_sync(gather)(), [1, 2, 3])
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+
+@override_settings(COMMENT_EVENTS_BACKEND='main.events.LocalBackend', COMMENT_EVENTS_HEARTBEAT=5,
+                   ASYNC_PARALLEL_QUERIES=False)
+class CommentEventsTests(BoardTestCase):
+    """
+    Поток новых комментариев: публикация после сохранения, продолжение с Last-Event-ID,
+    отключение медленных клиентов и опрос базы для нескольких процессов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.bb = Bb.objects.create(rubric=cls.rubric, author=cls.user, title='Велосипед', content='-', contacts='-')
+        cls.comment = Comment.objects.create(bb=cls.bb, author='Гость', content='Торг уместен?')
+
+    def setUp(self):
+        cache.clear()
+        events.get_events_backend.cache_clear()
+        self.addCleanup(events.get_events_backend.cache_clear)
+
+    def create_comment(self, content, is_active=True):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Comment.objects.create(bb=self.bb, author='Гость', content=content, is_active=is_active)
+
+    def stream(self, scenario, bb_id=None, headers=(), query=b''):
+        """
+        Открывает поток объявления и выполняет сопрограмму scenario(read), где read(marker)
+        возвращает текст, принятый до появления marker. Возвращает статус ответа.
+        """
+        async def run():
+            messages = asyncio.Queue()
+            disconnected = asyncio.Event()
+            received = []
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                await messages.put(message)
+
+            async def read(marker):
+                while marker not in ''.join(received):
+                    message = await asyncio.wait_for(messages.get(), 5)
+                    if message['type'] == 'http.response.start':
+                        status.append(message['status'])
+                    else:
+                        received.append(message.get('body', b'').decode())
+                        if not message.get('more_body'):
+                            break
+                text = ''.join(received)
+                received.clear()
+                return text
+
+            status = []
+            scope = {'type': 'http', 'method': 'GET', 'path': '/events/bbs/%s' % (bb_id or self.bb.pk),
+                     'query_string': query, 'headers': list(headers)}
+            task = asyncio.ensure_future(events.events_application(None)(scope, receive, send))
+            try:
+                await scenario(read)
+            finally:
+                disconnected.set()
+                await asyncio.wait_for(task, 5)
+            return status[0]
+        return async_to_sync(run)()
+
+    def test_new_comment(self):
+        async def scenario(read):
+            self.assertIn('retry: ', await read('\n\n'))
+            await sync_to_async(self.create_comment)('Скрытый', is_active=False)
+            comment = await sync_to_async(self.create_comment)('Беру')
+            text = await read('\n\n')
+            self.assertIn('id: %s\nevent: comment\n' % events.event_id(comment), text)
+            self.assertEqual(json.loads(text.split('data: ')[1])['content'], 'Беру')
+
+        self.assertEqual(self.stream(scenario), 200)
+        self.assertEqual(events.broker.count(), 0)
+
+    def test_resume(self):
+        later = Comment.objects.create(bb=self.bb, author='Гость', content='Беру')
+
+        async def scenario(read):
+            text = await read('Беру')
+            self.assertNotIn('Торг уместен?', text)
+            self.assertIn('id: %s' % events.event_id(later), text)
+
+        self.stream(scenario, headers=[(b'last-event-id', events.event_id(self.comment).encode())])
+        # при первом подключении страница передаёт последний показанный комментарий в адресе
+        self.stream(scenario, query=b'last_event_id=' + events.event_id(self.comment).encode())
+
+    @override_settings(COMMENT_EVENTS_CATCHUP=1)
+    def test_too_many_missed(self):
+        Comment.objects.create(bb=self.bb, author='Гость', content='Беру')
+        Comment.objects.create(bb=self.bb, author='Гость', content='Продано?')
+
+        async def scenario(read):
+            self.assertIn('event: reload', await read('event: reload'))
+
+        self.stream(scenario, headers=[(b'last-event-id', events.event_id(self.comment).encode())])
+
+    @override_settings(COMMENT_EVENTS_HEARTBEAT=0.05)
+    def test_heartbeat(self):
+        async def scenario(read):
+            await read(': ping')
+
+        self.stream(scenario)
+
+    def test_unknown_bb(self):
+        async def scenario(read):
+            self.assertIn('не найдено', await read('не найдено'))
+
+        self.assertEqual(self.stream(scenario, bb_id=self.bb.pk + 100), 404)
+
+    def test_slow_client(self):
+        async def run():
+            subscription = events.broker.subscribe(self.bb.pk, 2)
+            try:
+                for i in range(5):
+                    events.broker.publish({'bb': self.bb.pk, 'id': '1-%s' % i, 'data': ''})
+                await asyncio.sleep(0)
+                return [await subscription.queue.get() for i in range(3)], subscription.overflowed
+            finally:
+                events.broker.unsubscribe(subscription)
+
+        queued, overflowed = async_to_sync(run)()
+        self.assertTrue(overflowed)
+        self.assertEqual([event['id'] for event in queued[:2]], ['1-0', '1-1'])
+        self.assertIs(queued[2], events.CLOSE)
+
+    @override_settings(COMMENT_EVENTS_BACKEND='main.events.DatabasePollingBackend', COMMENT_EVENTS_POLL_INTERVAL=0.05)
+    def test_polling_backend(self):
+        # Комментарий из другого процесса: сигналы в этом процессе не отправляются
+        async def scenario(read):
+            await read('\n\n')
+            await sync_to_async(Comment.objects.bulk_create)([Comment(bb=self.bb, author='Гость', content='Беру')])
+            self.assertIn('Беру', await read('Беру'))
+
+        self.stream(scenario)
+
+    def test_detail_page(self):
+        response = self.client.get('/%s/%s' % (self.rubric.pk, self.bb.pk))
+        self.assertContains(response, 'data-events-url="/events/bbs/%s"' % self.bb.pk)
+        self.assertContains(response, 'data-last-event-id="%s"' % events.event_id(self.comment))
+        # без ASGI поток недоступен, и EventSource не переподключается
+        self.assertEqual(self.client.get('/events/bbs/%s' % self.bb.pk).status_code, 503)
+
+
+class StaticServingTests(TemporaryFilesMixin, TestCase):
+    """
+    collectstatic создаёт имена с хэшем и сжатые копии, а сайт отдаёт их с бессрочным
+    кэшированием и по Accept-Encoding.
+    """
+
+    def setUp(self):
+        self.static_root = self.temporary_directory()
+        storages = dict(settings.STORAGES, staticfiles={'BACKEND': 'main.storage.CompressedManifestStaticFilesStorage'})
+        self.enterContext(self.settings(STATIC_ROOT=self.static_root, STORAGES=storages))
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_collectstatic(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+
+        name = staticfiles_storage.stored_name('main/comments.js')
+        self.assertRegex(name, r'^main/comments\.[0-9a-f]{12}\.js$')
+        self.assertTrue(os.path.exists(os.path.join(self.static_root, name + '.gz')))
+        # изображения не сжимаются, слишком маленькие файлы тоже
+        self.assertFalse(os.path.exists(os.path.join(self.static_root, 'main/bg.jpg.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.static_root, 'main/style.css.gz')))
+        with open(os.path.join(self.static_root, staticfiles_storage.stored_name('main/style.css'))) as f:
+            self.assertIn(staticfiles_storage.stored_name('main/bg.jpg').split('/')[1], f.read())
+
+    def test_serve(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+
+        url = staticfiles_storage.url('main/comments.js')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/javascript')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertNotIn('Content-Disposition', response)
+        with open(finders.find('main/comments.js'), 'rb') as f:
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), f.read())
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate',
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        response = self.client.get(url)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(int(response['Content-Length']), os.path.getsize(finders.find('main/comments.js')))
+        # имя без хэша кэшируется ненадолго
+        self.assertEqual(self.client.get('/static/main/comments.js')['Cache-Control'],
+                         'public, max-age=%s' % settings.STATIC_MAX_AGE)
+        self.assertEqual(self.client.get('/static/../bboard/settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/static/main/nothing.js').status_code, 404)
+
+
+class MediaServingTests(TemporaryFilesMixin, TestCase):
+    """
+    Загруженные файлы отдаются с ETag, по частям (Range) или через веб-сервер (X-Sendfile).
+    """
+
+    def setUp(self):
+        self.use_temporary_media(MEDIA_SENDFILE=None)
+        self.name = default_storage.save('photo.jpg', ContentFile(bytes(range(100))))
+        self.url = '/media/' + self.name
+
+    def test_full_and_conditional(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(100)))
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        # имя по содержимому (main.storage) не меняет содержимого
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+                         304)
+        self.assertEqual(self.client.head(self.url)['Content-Length'], '100')
+
+    def get_range(self, header):
+        # часть файла передаётся потоком, не целиком в памяти
+        response = self.client.get(self.url, HTTP_RANGE=header)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.get_range('bytes=10-19'), bytes(range(10, 20)))
+        self.assertEqual(self.get_range('bytes=-5'), bytes(range(95, 100)))
+        self.assertEqual(self.get_range('bytes=90-'), bytes(range(90, 100)))
+        self.assertEqual(self.get_range('bytes=95-200'), bytes(range(95, 100)))
+        with patch.object(FileResponse, 'block_size', 3):
+            self.assertEqual(self.get_range('bytes=10-19'), bytes(range(10, 20)))
+        response = self.client.head(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual((response.status_code, response['Content-Length'], response.content), (206, '10', b''))
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+        # несколько диапазонов не поддерживаются, файл изменился - ответ целиком
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"').status_code, 200)
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag).status_code, 206)
+
+    def test_sendfile(self):
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.name)
+        self.assertEqual(response.content, b'')
+        with override_settings(MEDIA_SENDFILE='x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, self.name))
+
+    def test_not_found(self):
+        with open(os.path.join(self.media_root, 'thumbnail.jpg'), 'wb') as f:
+            f.write(b'-')
+        self.assertEqual(self.client.get('/media/thumbnail.jpg')['Cache-Control'],
+                         'public, max-age=%s' % settings.MEDIA_MAX_AGE)
+        self.assertEqual(self.client.get('/media/nothing.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    def test_hidden_files(self):
+        # служебные файлы хранилища не отдаются
+        for name in (os.path.join(CLAIMS_DIR, self.name), os.path.join(CLAIMS_DIR, '.lock'), '.upload-1234'):
+            os.makedirs(os.path.dirname(os.path.join(self.media_root, name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(b'-')
+            self.assertEqual(self.client.get('/media/' + name).status_code, 404)
+        self.assertEqual(self.client.get('/media/thumbnails/.hidden/' + self.name).status_code, 404)
+
+
+class VendorAssetsTests(TemporaryFilesMixin, TestCase):
+    """
+    Bootstrap и jQuery скачиваются один раз с проверкой integrity, после чего страницы
+    ссылаются на собственные копии, а не на CDN.
+    """
+
+    def setUp(self):
+        self.static_dir = self.temporary_directory()
+        self.addCleanup(vendor.is_vendored.cache_clear)
+        cache.clear()
+
+    def fake_cdn(self, url, timeout):
+        return io.BytesIO(b'/* %s */\n/*# sourceMappingURL=x.map */' % url.encode())
+
+    def bootstrap_settings(self):
+        result = {}
+        for setting in vendor.ASSETS:
+            url, integrity = vendor.asset_source(setting)
+            data = self.fake_cdn(url, 0).read()
+            result[setting] = {'url': url, 'href': url, 'integrity': 'sha384-' + base64.b64encode(
+                hashlib.sha384(data).digest()).decode()}
+        return result
+
+    def test_vendor(self):
+        self.assertContains(self.client.get('/'), 'https://cdn.jsdelivr.net/npm/bootstrap')
+        with override_settings(BOOTSTRAP4=self.bootstrap_settings()), \
+                patch('urllib.request.urlopen', self.fake_cdn):
+            call_command('vendor_assets', directory=self.static_dir, stdout=io.StringIO())
+        with open(os.path.join(self.static_dir, 'vendor', 'bootstrap.min.css'), 'rb') as f:
+            self.assertNotIn(b'sourceMappingURL', f.read())
+        vendor.is_vendored.cache_clear()
+        cache.clear()  # кэш страниц
+        with override_settings(STATICFILES_DIRS=[self.static_dir]):
+            response = self.client.get('/')
+        self.assertNotContains(response, 'cdn.jsdelivr.net')
+        self.assertContains(response, '<link rel="stylesheet" href="/static/vendor/bootstrap.min.css">')
+        self.assertContains(response, '<script src="/static/vendor/jquery-3.5.1.slim.min.js"></script>')
+
+    def test_integrity_mismatch(self):
+        with patch('urllib.request.urlopen', self.fake_cdn), self.assertRaises(CommandError):
+            call_command('vendor_assets', directory=self.static_dir, stdout=io.StringIO())
@@ -0,0 +1,89 @@
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.files import get_thumbnailer, ThumbnailFile
+from easy_thumbnails.models import Source
+from easy_thumbnails.utils import get_storage_hash
+
+from .jobs import register, enqueue_unique
+from .workers import submit
+
+# Миниатюры всех псевдонимов THUMBNAIL_ALIASES создаются заранее фоновым заданием
+# create_thumbnails (main.jobs, команда run_jobs) в пуле процессов (main.workers),
+# а не при первом выводе списка.
+# Задание хранится в базе данных, поэтому не теряется при перезапуске сайта.
+# Пока миниатюра не готова, выводится заглушка
+
+
+def missing_aliases(name):
+    thumbnailer = get_thumbnailer(default_storage, name)
+    return {alias: dict(options) for alias, options in aliases.all(include_global=True).items()
+            if not thumbnailer.get_existing_thumbnail(options)}
+
+
+def generate_thumbnails(name, alias_options):
+    # Только декодирование и масштабирование, без базы данных: задание create_thumbnails
+    # и команда pregenerate_thumbnails выполняют это в пуле процессов
+    thumbnailer = get_thumbnailer(default_storage, name)
+    results = []
+    for alias, options in alias_options.items():
+        thumbnail = thumbnailer.generate_thumbnail(options)
+        results.append((options, thumbnail.name, thumbnail.file.read()))
+    return name, results
+
+
+def save_thumbnails(result):
+    name, results = result
+    thumbnailer = get_thumbnailer(default_storage, name)
+    for options, thumbnail_name, data in results:
+        thumbnail = ThumbnailFile(thumbnail_name, file=ContentFile(data), storage=thumbnailer.thumbnail_storage,
+                                  thumbnail_options=thumbnailer.get_options(options))
+        thumbnailer.save_thumbnail(thumbnail)
+
+
+def enqueue_thumbnails(name):
+    """
+    Ставит в очередь создание недостающих миниатюр файла name. Повторная постановка
+    файла, миниатюры которого ещё не созданы, ничего не делает.
+    """
+    if name:
+        return enqueue_unique('create_thumbnails', {'name': name})
+
+
+@register('create_thumbnails')
+def create_thumbnails(payload):
+    name = payload['name']
+    if not default_storage.exists(name):
+        return  # файл удалён вместе с объявлением
+    alias_options = missing_aliases(name)
+    if alias_options:
+        # Миниатюры сохраняются в текущем процессе, когда готова вся пачка заданий
+        return submit(generate_thumbnails, name, alias_options), lambda future: save_thumbnails(future.result())
+
+
+def delete_thumbnails(name):
+    # То же, что ThumbnailerFieldFile.delete_thumbnails(), но по имени файла, без экземпляра модели.
+    # Исходный файл ищется по имени в любом хранилище: записи, созданные до перехода
+    # на main.storage, привязаны к обычному FileSystemStorage
+    thumbnail_storage = get_thumbnailer(default_storage, name).thumbnail_storage
+    storage_hash = get_storage_hash(thumbnail_storage)
+    for source_cache in Source.objects.filter(name=name):
+        for thumbnail_cache in source_cache.thumbnails.all():
+            if thumbnail_cache.storage_hash == storage_hash:
+                thumbnail_storage.delete(thumbnail_cache.name)
+        source_cache.delete()
+
+
+def get_thumbnail_url(fieldfile, alias='default'):
+    """
+    Возвращает адрес готовой миниатюры или None, если её ещё нет. Отсутствующая миниатюра
+    ставится в очередь, так что вывод страницы никогда не ждёт масштабирования изображения.
+    """
+    if not fieldfile:
+        return None
+    thumbnailer = get_thumbnailer(fieldfile)
+    thumbnail = thumbnailer.get_existing_thumbnail(aliases.get(alias, target=fieldfile))
+    if thumbnail:
+        return thumbnail.url
+    enqueue_thumbnails(fieldfile.name)
+    return None
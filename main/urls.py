@@ -1,9 +1,14 @@
+from django.conf import settings
 from django.urls import path
-from .views import index, other_page, BBLoginView, ChangeUserInfoView, profile, BBPasswordChangeView, RegisterUserView, \
-    RegisterDoneView, user_activate, DeleteUserView, by_rubric, detail, profile_bb_detail, profile_bb_add, \
-    profile_bb_change, profile_bb_delete
+from .views import other_page, BBLoginView, ChangeUserInfoView, profile, BBPasswordChangeView, RegisterUserView, \
+    RegisterDoneView, user_activate, DeleteUserView, profile_bb_detail, profile_bb_add, \
+    profile_bb_change, profile_bb_delete, bb_events
+from . import views, async_views
 from django.contrib.auth.views import LogoutView
 
+# Общедоступные страницы под ASGI обслуживают асинхронные контроллеры
+views_module = async_views if settings.ASYNC_VIEWS else views
+
 app_name = 'main'
 urlpatterns = [
     path('accounts/register/activate/<str:sign>/', user_activate, name='register_activate'),
@@ -11,10 +16,11 @@ urlpatterns = [
     path('accounts/register/', RegisterUserView.as_view(), name='register'),
     path('accounts/logout/', LogoutView.as_view(next_page='/'), name='logout'),
     path('accounts/password/change', BBPasswordChangeView.as_view(), name='password_change'),
-    path('<int:rubric_pk>/<int:pk>', detail, name='detail'),
-    path('<int:pk>/', by_rubric, name='by_rubric'),
+    path('events/bbs/<int:pk>', bb_events, name='bb_events'),
+    path('<int:rubric_pk>/<int:pk>', views_module.detail, name='detail'),
+    path('<int:pk>/', views_module.by_rubric, name='by_rubric'),
     path('<str:page>/', other_page, name='other'),
-    path('', index, name='index'),
+    path('', views_module.index, name='index'),
     path('accounts/login/', BBLoginView.as_view(), name='login'),
     path('accounts/profile/delete/', DeleteUserView.as_view(), name='profile_delete'),
     path('accounts/profile/change', ChangeUserInfoView.as_view(), name='profile_change'),
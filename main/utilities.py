@@ -11,7 +11,7 @@ def get_timestamp_path(instance, filename):
     return '%s%s' % (datetime.now().timestamp(), splitext(filename)[1])
 
 
-def send_activation_notification(user):
+def activation_notification(user):
     if ALLOWED_HOSTS:
         host = 'http://' + ALLOWED_HOSTS[0]
     else:
@@ -19,4 +19,11 @@ def send_activation_notification(user):
     context = {'user': user, 'host': host, 'sign': signer.sign(user.username)}
     subject = render_to_string('email/activation_letter_subject.txt', context)
     body_text = render_to_string('email/activation_letter_body.txt', context)
-    user.email_user(subject, body_text)
+    # Письмо в виде параметров задания send_email (см. main.jobs)
+    return {'subject': ''.join(subject.splitlines()), 'body': body_text, 'to': [user.email]}
+
+
+def send_activation_notification(user):
+    # Письмо не отправляется сразу, а ставится в очередь заданий: регистрация не ждёт почтовый сервер
+    from .jobs import enqueue
+    enqueue('send_email', activation_notification(user))
@@ -0,0 +1,50 @@
+import base64
+import hashlib
+import re
+from functools import lru_cache
+
+from bootstrap4.bootstrap import get_bootstrap_setting
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+
+# Bootstrap и jQuery из каталога static сайта (main/static/vendor) вместо CDN: файлы,
+# указанные в настройках BOOTSTRAP4, один раз скачивает команда vendor_assets с проверкой
+# их хэшей (integrity). Пока файлов нет, страницы ссылаются на CDN, как раньше
+VENDOR_DIR = 'vendor'
+# Настройки BOOTSTRAP4 с адресами файлов, которые выводит layout/basic.html
+ASSETS = ('css_url', 'jquery_slim_url', 'javascript_url')
+SOURCE_MAP = re.compile(rb'\n?/[/*]# sourceMappingURL=[^\n]*')
+
+
+def asset_source(setting):
+    # Пара (адрес в CDN, integrity) из настроек django-bootstrap4
+    value = get_bootstrap_setting(setting)
+    return value.get('href') or value.get('url'), value.get('integrity')
+
+
+def asset_name(setting):
+    return '%s/%s' % (VENDOR_DIR, asset_source(setting)[0].rsplit('/', 1)[1])
+
+
+def check_integrity(data, integrity):
+    algorithm, _, expected = integrity.partition('-')
+    return base64.b64encode(hashlib.new(algorithm, data).digest()).decode() == expected
+
+
+def strip_source_map(data):
+    # Карты исходного кода не скачиваются, а ссылки на них ManifestStaticFilesStorage
+    # пытался бы заменить именами с хэшем
+    return SOURCE_MAP.sub(b'', data)
+
+
+@lru_cache(maxsize=None)
+def is_vendored(name):
+    return finders.find(name) is not None
+
+
+def local_url(setting):
+    """
+    Адрес скачанного файла настройки setting или None, если файла нет.
+    """
+    name = asset_name(setting)
+    return static(name) if is_vendored(name) else None
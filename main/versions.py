@@ -0,0 +1,63 @@
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db import transaction
+
+# Версии данных для условных запросов (ETag, Last-Modified). Версия области - время её
+# последнего изменения в наносекундах, хранится в общем кэше и меняется обработчиками
+# сигналов (main.signals). Проверка версий не выполняет ни одного запроса к базе данных.
+# Области:
+#   rubrics      - дерево рубрик в панели навигации
+#   index        - любое активное объявление (главная страница, список API)
+#   rubric:<pk>  - объявления рубрики
+#   bb:<pk>      - объявление, его иллюстрации и комментарии
+VERSION_KEY = 'version:%s'
+VERSION_TIMEOUT = None
+
+
+def get_versions(*scopes):
+    """
+    Возвращает список версий областей scopes. Отсутствующая в кэше версия (после его
+    очистки или перезапуска) создаётся заново текущим временем.
+    """
+    keys = [VERSION_KEY % scope for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            # add не перезапишет версию, записанную в это время другим процессом
+            if not cache.add(key, version, VERSION_TIMEOUT):
+                version = cache.get(key, version)
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(*scopes):
+    """
+    То же, что get_versions, для асинхронных контроллеров: через асинхронные методы кэша.
+    """
+    keys = [VERSION_KEY % scope for scope in scopes]
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = time.time_ns()
+            if not await cache.aadd(key, version, VERSION_TIMEOUT):
+                version = await cache.aget(key, version)
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes):
+    """
+    Меняет версии областей после фиксации транзакции. Если сменить версию раньше,
+    параллельный запрос может сохранить у клиента старые данные под новой версией.
+    """
+    def set_versions():
+        now = time.time_ns()
+        cache.set_many({VERSION_KEY % scope: now for scope in scopes}, VERSION_TIMEOUT)
+    transaction.on_commit(set_versions)
+
+
+def version_datetime(version):
+    return datetime.fromtimestamp(version / 1e9, timezone.utc)
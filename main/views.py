@@ -9,23 +9,31 @@ from django.views.generic.edit import UpdateView, CreateView, DeleteView
 from django.views.generic.base import TemplateView  # для работы с шаблонами
 
 from django.template import TemplateDoesNotExist
-from django.template.loader import get_template  # для загрузки шаблонов
+from django.template.loader import get_template, render_to_string  # для загрузки шаблонов
+from django.utils.safestring import mark_safe
 
 from django.core.signing import BadSignature
-from django.core.paginator import Paginator
 
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import HttpResponse, Http404
 from django.urls import reverse_lazy  # для получения URL по имени
-from django.db.models import Q  # для выполнения сложных запросов
 
-from .models import AdvUser, SubRubric, Bb, Comment
+from .models import AdvUser, SubRubric, Bb
 from .forms import ChangeUserInfoForm, RegisterUserForm, SearchForm, BbForm, AIFormSet, UserCommentForm, \
     GuestCommentForm
 
+from .cards import LISTING_FIELDS
+from .decorators import query_budget, conditional
+from .pagecache import page_cache
+from .pagination import KeysetPaginator, BB_ORDERINGS
+from .search import get_search_backend
 from .utilities import signer  # используем уже созданный экземпляр класса для экономии оперативной памяти
 
 
+# Метка формы комментария в кэшированной странице объявления (main.pagecache)
+COMMENT_FORM_HOLE = mark_safe('<!-- bboard:comment-form -->')
+
+
 @login_required
 def profile_bb_change(request, pk):
     bb = get_object_or_404(Bb, pk=pk)
@@ -76,18 +84,25 @@ def profile_bb_add(request):
 
 
 @login_required
+@query_budget(4)
 def profile_bb_detail(request, pk):
-    bb = get_object_or_404(Bb, pk=pk)
+    bb = get_object_or_404(Bb.objects.for_detail(), pk=pk)
     ais = bb.additionalimage_set.all()
     context = {'bb': bb, 'ais': ais}
-    return render(request, 'main/detail.html', context)
+    return render(request, 'main/profile_bb_detail.html', context)
+
+
+def render_comment_form(request, rubric_pk, pk):
+    # Форма комментария гостя в кэшированной странице объявления: CSRF и CAPTCHA у каждого свои
+    form = GuestCommentForm(initial={'bb': pk})
+    return render_to_string('main/includes/comment_form.html', {'form': form}, request)
 
 
+@conditional(lambda request, rubric_pk, pk: ['rubrics', 'bb:%s' % pk], form=True)
+@page_cache(lambda request, rubric_pk, pk: ['rubrics', 'bb:%s' % pk], holes={COMMENT_FORM_HOLE: render_comment_form})
+@query_budget(8)
 def detail(request, rubric_pk, pk):
-    bb = Bb.objects.get(pk=pk)
-    ais = bb.additionalimage_set.all()
-    comments = Comment.objects.filter(bb=pk, is_active=True)
-    initial = {'bb': bb.pk}
+    initial = {'bb': pk}
     if request.user.is_authenticated:
         initial['author'] = request.user.username
         form_class = UserCommentForm
@@ -102,31 +117,43 @@ def detail(request, rubric_pk, pk):
         else:
             form = c_form
             messages.add_message(request, messages.WARNING, 'Комментарий не добавлен')
-    context = {'bb': bb, 'ais': ais, 'comments': comments, 'form': form}
+    # Объявление загружается после сохранения комментария, чтобы новый комментарий сразу попал на страницу
+    bb = get_object_or_404(Bb.objects.for_detail(), pk=pk)
+    context = {'bb': bb, 'ais': bb.additionalimage_set.all(), 'comments': bb.active_comments, 'form': form}
+    if getattr(request, 'page_cache_holes', False):
+        context['comment_form_hole'] = COMMENT_FORM_HOLE
     return render(request, 'main/detail.html', context)
 
 
+def bb_events(request, pk):
+    # Поток комментариев обслуживает main.events под ASGI (bboard.asgi). На ответ с ошибкой
+    # EventSource не переподключается, и страница просто остаётся без обновлений
+    return HttpResponse('Поток комментариев доступен только при работе под ASGI', status=503,
+                        content_type='text/plain; charset=utf-8')
+
+
+@conditional(lambda request, pk: ['rubrics', 'rubric:%s' % pk])
+@page_cache(lambda request, pk: ['rubrics', 'rubric:%s' % pk])
+@query_budget(7)
 def by_rubric(request, pk):
     """
     Представление для отображения объявлений по рубрикам.
     """
     rubric = get_object_or_404(SubRubric, pk=pk)  # получение рубрики по первичному ключу
-    bbs = Bb.objects.filter(is_active=True, rubric=pk)  # фильтрация объявлений по рубрике
-    if 'keyword' in request.GET:
-        keyword = request.GET['keyword']
-        q = Q(title__icontains=keyword) | Q(
-            content__icontains=keyword)  # поиск по ключевому слову в заголовке и содержимом
-        bbs = bbs.filter(q)
-    else:
-        keyword = ''
+    sort = request.GET.get('sort', '')
+    ordering = BB_ORDERINGS.get(sort, BB_ORDERINGS['new'])  # новые, обсуждаемые или недавно активные
+    # поля упорядочивания нужны для курсора страницы, поэтому выбираются вместе с полями списка
+    fields = set(LISTING_FIELDS) | {name.lstrip('-') for name in ordering}
+    bbs = Bb.objects.filter(is_active=True, rubric=pk).only(*fields)  # фильтрация объявлений по рубрике
+    keyword = request.GET.get('keyword', '')
+    bbs = get_search_backend().filter(bbs, keyword)  # поиск по ключевому слову в заголовке и содержимом
     form = SearchForm(initial={'keyword': keyword})  # создание формы поиска с текущим ключевым словом
-    paginator = Paginator(bbs, 2)  # пагинация объявлений, по 2 на страницу
-    if 'page' in request.GET:
-        page_num = request.GET['page']
-    else:
-        page_num = 1
-    page = paginator.get_page(page_num)  # получение текущей страницы
-    context = {'rubric': rubric, 'page': page, 'bbs': page.object_list, 'form': form}  # контекст для шаблона
+    paginator = KeysetPaginator(bbs, 2, ordering)  # пагинация объявлений по ключу сортировки, по 2 на страницу
+    page = paginator.get_page(request.GET.get('page'))  # получение текущей страницы по курсору
+    # число объявлений (COUNT по всей рубрике) - только на первой странице без поиска
+    count = paginator.count if not keyword and not request.GET.get('page') else None
+    context = {'rubric': rubric, 'page': page, 'bbs': page.object_list, 'form': form, 'count': count,
+               'sort': sort if sort in BB_ORDERINGS else ''}  # контекст для шаблона
     return render(request, 'main/by_rubric.html', context)
 
 
@@ -222,14 +249,25 @@ def other_page(request, page):  # из page получаем имя выводи
     return HttpResponse(template.render(request=request))
 
 
+@conditional(lambda request: ['rubrics', 'index'])
+@page_cache(lambda request: ['rubrics', 'index'])
+@query_budget(5)
 def index(request):
-    bbs = Bb.objects.filter(is_active=True)[:10]
-    context = {'bbs': bbs}
+    keyword = request.GET.get('keyword', '')
+    bbs = Bb.objects.filter(is_active=True).only(*LISTING_FIELDS)  # остальное возьмём из кэша карточек
+    if keyword:
+        bbs = get_search_backend().rank(bbs, keyword)  # самые релевантные
+    bbs = bbs[:10]
+    form = SearchForm(initial={'keyword': keyword})
+    context = {'bbs': bbs, 'form': form}
     return render(request, 'main/index.html', context)
 
 
 @login_required
+@query_budget(4)
 def profile(request):
-    bbs = bbs = Bb.objects.filter(author=request.user.pk)
-    context = {'bbs': bbs}
+    bbs = Bb.objects.filter(author=request.user.pk)
+    paginator = KeysetPaginator(bbs, 10)
+    page = paginator.get_page(request.GET.get('page'))
+    context = {'page': page, 'bbs': page.object_list}
     return render(request, 'main/profile.html', context)
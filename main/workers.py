@@ -0,0 +1,40 @@
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.conf import settings
+
+# Пул процессов для тяжёлой обработки изображений при импорте (main.importer), командами
+# process_images и pregenerate_thumbnails и фоновыми заданиями (main.images, main.thumbnails),
+# которые отправляют работу сюда через submit
+_executor = None
+
+
+def init_worker():
+    # Дочерние процессы запускаются заново (spawn) и не наследуют соединения с базой данных
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bboard.settings')
+    import django
+    django.setup()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.MEDIA_WORKERS or None,
+                                        mp_context=multiprocessing.get_context('spawn'), initializer=init_worker)
+    return _executor
+
+
+def submit(func, *args):
+    """
+    Выполняет func(*args) в пуле процессов. При MEDIA_WORKERS = 0 выполняет сразу в текущем
+    процессе. В обоих случаях возвращает Future.
+    """
+    if settings.MEDIA_WORKERS:
+        return get_executor().submit(func, *args)
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future